@@ -352,7 +352,7 @@ jq -c '.[] | .results[]' ${arg_outpur_dir_name}"/affyprobe_enst.json" | while re
       }
       ' ${transcript_fasta_fn}
       # CBE substrate: NNNNNNNNNNNNNNNNNNNNCNNNNNNNNNNNNNNNNNNNN
-      python get_cbe_substrate_20nt.py `cat ${transcript_seq_fn}` ${pred_target_fn};
+      python get_cbe_substrate_20nt.py ${transcript_seq_fn} ${pred_target_fn};
       exit_status=$?
       if [ $exit_status -eq 0 ]; then
           target_file_arr+=(${pred_target_fn})
@@ -9,17 +9,20 @@
 # Initialize variables
 arg_output_dir_name=""
 python_script=""
+arg_model_dir=""
 
 # Display help message
 usage() {
     echo "Usage: $0 -O <output_directory> -p <python_script> [-e <editor_type>]"
     echo "  -O Specify the output directory."
     echo "  -p Specify the Python script to execute."
+    echo "  -m (DNABERT-2 scripts only) Keep the model in this directory loaded in one"
+    echo "     pred_rna_offtarget_server.py process shared by all target files."
     echo "  -h Display this help message."
 }
 
 # Parse command-line arguments
-while getopts "O:p:h" opt; do
+while getopts "O:p:m:h" opt; do
   case $opt in
     O)
       arg_output_dir_name="${OPTARG}"
@@ -27,6 +30,9 @@ while getopts "O:p:h" opt; do
     p)
       python_script="${OPTARG}"
       ;;
+    m)
+      arg_model_dir="${OPTARG}"
+      ;;
     h)
       usage
       exit 0
@@ -52,6 +58,23 @@ if [ ! -f "${python_script}" ]; then
   exit 1
 fi
 
+# Start a persistent prediction server so the model is loaded only once
+if [ -n "${arg_model_dir}" ]; then
+  server_socket="$(mktemp -u "${TMPDIR:-/tmp}/protectio_server.XXXXXX.sock")"
+  python pred_rna_offtarget_server.py "${arg_model_dir}" --socket "${server_socket}" &
+  server_pid=$!
+  trap 'kill ${server_pid} 2>/dev/null' EXIT
+  echo "Waiting for the prediction server to load ${arg_model_dir}..."
+  while [ ! -S "${server_socket}" ]; do
+    if ! kill -0 ${server_pid} 2>/dev/null; then
+      echo "Error: The prediction server failed to start." >&2
+      exit 1
+    fi
+    sleep 1
+  done
+  export PROTECTIO_SERVER_SOCKET="${server_socket}"
+fi
+
 # Get the list of target files
 target_files=$(find "${arg_output_dir_name}/prediction_targets" -type f -name "target.csv")
 
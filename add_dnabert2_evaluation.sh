@@ -88,6 +88,32 @@ target_files=$(find "${arg_output_dir_name}/prediction_targets" -type f -name "t
 total_eval_target_num=$(echo "$target_files" | wc -l | xargs)
 echo "Found ${total_eval_target_num} target files."
 
+# Collect the target files that still need a prediction and evaluate them all in a
+# single pred_rna_offtarget_server.py process, so the model is loaded only once.
+eval_target_counter=0
+pending_requests=""
+for dna_fasta in ${target_files}; do
+    eval_target_counter=$((eval_target_counter + 1))
+    eval_res="$(dirname ${dna_fasta})/${arg_label}_eval_res.csv"
+    if [ ! -f "${eval_res}" ]; then
+        if [ -s "${dna_fasta}" ]; then
+            pending_requests="${pending_requests}${dna_fasta}"$'\t'"${eval_res}"$'\n'
+        else
+            echo "${eval_target_counter}/${total_eval_target_num} The file ${dna_fasta} is empty. Skipping."
+        fi
+    else
+        echo "${eval_target_counter}/${total_eval_target_num} ${eval_res} already exists. Skipping."
+    fi
+done
+
+if [ -n "${pending_requests}" ]; then
+    pending_num=$(printf "%s" "${pending_requests}" | wc -l | xargs)
+    echo "Running RNA-offtarget prediction for ${pending_num} target files"
+    printf "%s" "${pending_requests}" \
+    | python pred_rna_offtarget_server.py "${arg_model_dir}" --stdin \
+    | awk -F'\t' -v total="${pending_num}" '{ n++; if ($1 == "OK") print n "/" total " Saved " $2; else print n "/" total " Error: " $2 > "/dev/stderr" }'
+fi
+
 # Initialize counter
 eval_target_counter=0
 
@@ -101,19 +127,6 @@ for dna_fasta in ${target_files}; do
     density_file="$(dirname ${dna_fasta})/${arg_label}_density.csv"
     table_file="$(dirname ${dna_fasta})/${arg_label}_table.csv"
     
-    # Predict RNA offtargeting if eval_res doesn't exist
-    if [ ! -f "${eval_res}" ]; then
-        if [ -s "${dna_fasta}" ]; then
-            echo "Running RNA-offtarget prediction for ${dna_fasta}"
-            python pred_rna_offtarget_batch.py "${dna_fasta}" "${arg_model_dir}" "${eval_res}"
-        else
-            echo "The file ${dna_fasta} is empty. Skipping."
-            continue
-        fi
-    else
-        echo "${eval_res} already exists. Skipping."
-    fi
-    
     # Calculate effective substrate density and generate new density and table files
     if [ ! -f "${density_file}" ]; then
         if [ -f "${eval_res}" ]; then
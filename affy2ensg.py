@@ -1,9 +1,10 @@
 import pandas as pd
-import requests
+import asyncio
 import json
-import time
 import sys
 
+from rest_client import convert_togoid_ids, RestClientError
+
 __authors__ = ["Kazuki Nakamae", "Takayuki Suzuki"]
 __version__ = "1.0.0"
 
@@ -21,14 +22,15 @@ def affy2ensg(RefEx_db, output_fn):
     print("Expectd time: "+str(len(id_split) * 0.5))
 
     print("[<Affymetrix probeset ID>, <Ensembl transcript ID>]")
-    affyprobe_enst_list = []
-    for i in id_split:
-        input = ','.join(i)
-        url = f'https://api.togoid.dbcls.jp/convert?ids={input}&route=affy_probeset,ensembl_transcript&report=all&format=json'
-        r = requests.get(url)
-        print(r.json()["results"])
-        affyprobe_enst_list.append(r.json())
-        time.sleep(0.5)
+    # Chunks are requested concurrently over shared connections; the client retries
+    # rate-limited and failed requests instead of aborting the whole conversion.
+    try:
+        affyprobe_enst_list = asyncio.run(convert_togoid_ids(id_split, 'affy_probeset,ensembl_transcript'))
+    except RestClientError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    for result in affyprobe_enst_list:
+        print(result["results"])
 
     # write out a json file
     with open(output_fn, 'w') as f:
@@ -1,9 +1,10 @@
 import os
 import pandas as pd
-import matplotlib.pyplot as plt
 import seaborn as sns
 import argparse
 
+from plot_rendering import PLOT_MODES, new_figure, render_plots
+
 def collect_values_by_refseqid(filtered_refex_df, base_dir, prefix):
     raw_data_records = []
     # Iterate over the filtered rows
@@ -36,8 +37,92 @@ def collect_values_by_refseqid(filtered_refex_df, base_dir, prefix):
                     })
     return raw_data_records
 
+def collect_scores_by_refseqid(filtered_refex_df, base_dir, prefix, threshold=None, expected=False):
+    # Same records as collect_values_by_refseqid, recalculated from the window scores of each transcript
+    from calc_eff_substrate_density import read_transcript_scores, batch_density
+    from window_store import SubstrateMatrix, MATRIX_FILE
+    # Databases predicted with --matrix keep their scores in the substrate matrix only
+    matrix = SubstrateMatrix(base_dir) if os.path.isfile(os.path.join(base_dir, MATRIX_FILE)) else None
+    frames = []
+    transcripts = []
+    for ncbi_refseq_id in filtered_refex_df['NCBI_RefSeqID']:
+        ncbi_dir_path = os.path.join(base_dir, 'prediction_targets', ncbi_refseq_id)
+        if not os.path.exists(ncbi_dir_path):
+            continue
+        for enst_dir in [f for f in os.listdir(ncbi_dir_path) if not f.startswith('.')]:
+            try:
+                windows_df = read_transcript_scores(os.path.join(ncbi_dir_path, enst_dir), prefix, threshold, expected, matrix)
+            except Exception as e:
+                print(f"Error reading the scores of {ncbi_refseq_id}/{enst_dir}: {e}")
+                continue
+            if windows_df is not None and len(windows_df) > 0:
+                frames.append(windows_df.assign(transcript=len(transcripts)))
+                transcripts.append((ncbi_refseq_id, enst_dir))
+    if not frames:
+        return pd.DataFrame([])
+    density_df = batch_density(pd.concat(frames, ignore_index=True))
+    density_df.insert(0, 'ENST_ID', [transcripts[i][1] for i in density_df.index])
+    density_df.insert(0, 'NCBI_RefSeqID', [transcripts[i][0] for i in density_df.index])
+    return density_df.reset_index(drop=True)
+
+def load_density_records(refex_df, base_dir, prefix, store=None, threshold=None, expected=False):
+    # Read the ESD record of every transcript once, from the consolidated store or from the density files.
+    # With a score threshold or expected counts the records are recalculated from the window scores instead.
+    rescore = threshold is not None or expected
+    if store is not None:
+        if rescore:
+            from calc_eff_substrate_density import store_density
+            return store_density(store, prefix, threshold, expected)
+        from esd_store import load_density
+        return load_density(store, prefix)
+    unique_refex_df = refex_df.drop_duplicates(subset='NCBI_RefSeqID')
+    if rescore:
+        return collect_scores_by_refseqid(unique_refex_df, base_dir, prefix, threshold, expected)
+    return pd.DataFrame(collect_values_by_refseqid(unique_refex_df, base_dir, prefix))
+
+def group_density_records(refex_df, tissue_columns, density_df):
+    # Join the ESD records to the RefEx tissue matrix in long form: one row per (group, transcript).
+    # Rows keep the order of the per-group collection (RefEx row, then ENST directory).
+    refex_long_df = refex_df[['NCBI_RefSeqID'] + tissue_columns].assign(refex_row=range(len(refex_df)))
+    refex_long_df = refex_long_df.melt(id_vars=['refex_row', 'NCBI_RefSeqID'], value_vars=tissue_columns, var_name='group', value_name='expressed')
+    refex_long_df = refex_long_df[refex_long_df['expressed'] == 1].drop(columns='expressed')
+    all_df = refex_df[['NCBI_RefSeqID']].assign(refex_row=range(len(refex_df)), group='All')
+    refex_long_df = pd.concat([all_df, refex_long_df], ignore_index=True)
+    refex_long_df['group'] = pd.Categorical(refex_long_df['group'], categories=['All'] + tissue_columns)
+
+    density_df = density_df.assign(enst_row=range(len(density_df)))
+    long_df = refex_long_df.merge(density_df, on='NCBI_RefSeqID', how='inner')
+    long_df = long_df.sort_values(['group', 'refex_row', 'enst_row'], kind='stable')
+    return long_df.drop(columns=['refex_row', 'enst_row'])
+
+def draw_violinplot(values, value_column, title):
+    # Create a violin plot for the column
+    fig, ax = new_figure((10, 6))
+    sns.violinplot(x=values, ax=ax)
+    ax.set_title(f'{value_column} Distribution in {title}')
+    ax.set_xlabel(value_column)
+    return fig
+
+def write_group_outputs(raw_data_df, group_name, title, output_dir, plot_jobs):
+    # Save raw data to CSV for the current group
+    raw_data_df.to_csv(os.path.join(output_dir, f'rawdata_{group_name}.csv'), index=False)
+    value_columns = raw_data_df.columns[2:]
+
+    for value_column in value_columns:
+        values = raw_data_df[value_column].to_list()
+        if values:
+            # Queue a violin plot for the column (saved as a PNG by render_plots)
+            plot_jobs.append((draw_violinplot, (values, value_column, title), os.path.join(output_dir, f'{group_name}_{value_column}_violinplot.png')))
+
+        # Compute statistical summary
+        density_series = pd.Series(values)
+        stats = density_series.describe()
+
+        # Save stats to CSV for the current group and column
+        stats.to_csv(os.path.join(output_dir, f'{group_name}_{value_column}_stat.csv'), header=['Value'])
+
 # Function to process data
-def process_density_data(refex_file, base_dir, output_dir, prefix):
+def process_density_data(refex_file, base_dir, output_dir, prefix, store=None, plots='publication', processes=None, threshold=None, expected=False):
     # Make output directory
     os.makedirs(output_dir, exist_ok=False)
 
@@ -50,89 +135,39 @@ def process_density_data(refex_file, base_dir, output_dir, prefix):
     tissue_columns = [t.replace('/', '_') for t in tissue_columns]
     refex_df.columns = refex_df.columns[:2].to_list() + tissue_columns
 
-    all_tissue_specific_transcripts_cnt = len(refex_df)
-    print(f'All tissue-specific {all_tissue_specific_transcripts_cnt} transcripts are expressing...')
-    if all_tissue_specific_transcripts_cnt > 0:
-        all_raw_data_records = collect_values_by_refseqid(refex_df, base_dir, prefix)
-        # Convert raw data to DataFrame and save raw data to CSV for the current tissue
-        all_raw_data_df = pd.DataFrame(all_raw_data_records)
-        all_raw_data_df.to_csv(os.path.join(output_dir, f'rawdata_All.csv'), index=False)
-        all_value_columns = all_raw_data_df.columns[2:]
-
-        # Create violin plots for each column in the current tissue's data
-        for value_column in all_value_columns:
-            values = all_raw_data_df[value_column].to_list()
-            if values:
-                # Calculate min and max values
-                # min_value = min(values)
-                # max_value = max(values)
-
-                # Create a violin plot for the column
-                plt.figure(figsize=(10, 6))
-                sns.violinplot(x=values)
-                plt.title(f'{value_column} Distribution in all tissue specific transcripts')
-                plt.xlabel(value_column)
-
-                # Set x-axis limits based on min and max values
-                # plt.xlim([min_value, max_value])
-
-                # Save the plot as a 350dpi PNG
-                plt.savefig(os.path.join(output_dir, f'All_{value_column}_violinplot.png'), dpi=350)
-                plt.close()
-
-            # Compute statistical summary
-            density_series = pd.Series(values)
-            stats = density_series.describe()
-
-            # Save stats to CSV for the current tissue and column
-            stats.to_csv(os.path.join(output_dir, f'All_{value_column}_stat.csv'), header=['Value'])
+    # Read all ESD records once and split them by group instead of re-reading them for every tissue
+    density_df = load_density_records(refex_df, base_dir, prefix, store, threshold, expected)
+    if len(density_df) > 0:
+        grouped_records = dict(iter(group_density_records(refex_df, tissue_columns, density_df).groupby('group', observed=True, sort=False)))
     else:
-        print(f'Skipping')
-    
-    # Iterate over each tissue column
-    for tissue_column in tissue_columns:
-        # Filter rows where the current tissue column has a value of 1
-        filtered_refex_df = refex_df[refex_df[tissue_column] == 1]
-        tissue_specific_transcripts_cnt = len(filtered_refex_df)
-        print(f'{tissue_column}:Tissue-specific {tissue_specific_transcripts_cnt} transcripts are expressing...')
-
-        if tissue_specific_transcripts_cnt > 0:
-            raw_data_records = collect_values_by_refseqid(filtered_refex_df, base_dir, prefix)
-            # Convert raw data to DataFrame and save raw data to CSV for the current tissue
-            raw_data_df = pd.DataFrame(raw_data_records)
-            raw_data_df.to_csv(os.path.join(output_dir, f'rawdata_{tissue_column}.csv'), index=False)
-            value_columns = raw_data_df.columns[2:]
-
-            # Create violin plots for each column in the current tissue's data
-            for value_column in value_columns:
-                values = raw_data_df[value_column].to_list()
-                if values:
-                    # Calculate min and max values
-                    # min_value = min(values)
-                    # max_value = max(values)
-
-                    # Create a violin plot for the column
-                    plt.figure(figsize=(10, 6))
-                    sns.violinplot(x=values)
-                    plt.title(f'{value_column} Distribution in {tissue_column}')
-                    plt.xlabel(value_column)
-
-                    # Set x-axis limits based on min and max values
-                    # plt.xlim([min_value, max_value])
-
-                    # Save the plot as a 350dpi PNG
-                    plt.savefig(os.path.join(output_dir, f'{tissue_column}_{value_column}_violinplot.png'), dpi=350)
-                    plt.close()
-
-                # Compute statistical summary
-                density_series = pd.Series(values)
-                stats = density_series.describe()
-
-                # Save stats to CSV for the current tissue and column
-                stats.to_csv(os.path.join(output_dir, f'{tissue_column}_{value_column}_stat.csv'), header=['Value'])
+        grouped_records = {}
+
+    # Number of tissue-specific transcripts in each group
+    transcript_counts = {'All': len(refex_df)}
+    transcript_counts.update((refex_df[tissue_columns] == 1).sum().to_dict())
+
+    plot_jobs = []
+    for group_name in ['All'] + tissue_columns:
+        if group_name == 'All':
+            print(f'All tissue-specific {transcript_counts[group_name]} transcripts are expressing...')
+            title = 'all tissue specific transcripts'
+        else:
+            print(f'{group_name}:Tissue-specific {transcript_counts[group_name]} transcripts are expressing...')
+            title = group_name
+
+        if transcript_counts[group_name] > 0:
+            if group_name in grouped_records:
+                raw_data_df = grouped_records[group_name].drop(columns='group').reset_index(drop=True)
+            else:
+                # No ESD record for any transcript of this group
+                raw_data_df = pd.DataFrame([])
+            write_group_outputs(raw_data_df, group_name, title, output_dir, plot_jobs)
         else:
             print(f'Skipping')
 
+    # Draw all violin plots at the end, in parallel
+    render_plots(plot_jobs, plots, processes)
+
     print(f"Processing complete. Outputs saved in: {output_dir}")
 
 # Main entry point
@@ -145,9 +180,14 @@ if __name__ == "__main__":
     parser.add_argument('--base_dir', required=True, help="Base directory containing NM/NRxxxxxx directories.")
     parser.add_argument('--output_dir', required=True, help="Directory to save output files (plots and stats).")
     parser.add_argument('--prefix', required=False, default="", help="Directory to save output files (plots and stats).")
+    parser.add_argument('--plots', required=False, default='publication', choices=PLOT_MODES, help="Plot output: none (statistics only), fast (72-dpi previews) or publication (350-dpi PNG, default).")
+    parser.add_argument('--processes', required=False, type=int, default=None, help="Worker processes for plotting (default: number of CPUs).")
+    parser.add_argument('--store', required=False, default=None, help="Consolidated ESD store (protectio.py consolidate) to read instead of the density.csv files.")
+    parser.add_argument('--threshold', required=False, type=float, default=None, help="Recalculate the ESD from the window scores, counting windows with LABEL_1 probability >= THRESHOLD as effective.")
+    parser.add_argument('--expected', action='store_true', help="Recalculate the ESD from the window scores as expected counts (sum of LABEL_1 probabilities).")
     
     # Parse arguments
     args = parser.parse_args()
     
     # Call the processing function with parsed arguments
-    process_density_data(args.refex_file, args.base_dir, args.output_dir, args.prefix)
+    process_density_data(args.refex_file, args.base_dir, args.output_dir, args.prefix, args.store, args.plots, args.processes, args.threshold, args.expected)
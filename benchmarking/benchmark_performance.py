@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+
+import numpy as np
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# protectio.py invocation and output file prefix of every predictor stage
+PREDICTORS = {
+    'acw': (['motif', '--motif', 'ACW'], 'pred_motif_acw_'),
+    'wcw': (['motif', '--motif', 'WCW'], 'pred_motif_wcw_'),
+    'stl': (['predict', '--predictor', 'pred_dnabert2_cbe_sv1.py'], 'pred_dnabert2_cbe_sv1_'),
+    'snl': (['predict', '--predictor', 'pred_dnabert2_cbe_snv1.py'], 'pred_dnabert2_cbe_snv1_'),
+    # Same models with dynamic int8 quantisation (protectio.py predict --backend int8)
+    'stl_int8': (['predict', '--predictor', 'pred_dnabert2_cbe_sv1.py', '--backend', 'int8', '--label', 'pred_dnabert2_cbe_sv1_int8'], 'pred_dnabert2_cbe_sv1_int8_'),
+    'snl_int8': (['predict', '--predictor', 'pred_dnabert2_cbe_snv1.py', '--backend', 'int8', '--label', 'pred_dnabert2_cbe_snv1_int8'], 'pred_dnabert2_cbe_snv1_int8_'),
+}
+DEFAULT_PREDICTORS = ['acw', 'wcw', 'stl', 'snl']
+
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+_STOP_CODONS = {"TAA", "TAG", "TGA"}
+# Sense codons; the C->T stop-creatable codons (CAA, CAG, CGA) are drawn more often so
+# that every transcript has substrates, as in real CDSs
+_SENSE_CODONS = [a + b + c for a in "ACGT" for b in "ACGT" for c in "ACGT" if a + b + c not in _STOP_CODONS]
+_CODON_WEIGHTS = np.array([4.0 if codon in ("CAA", "CAG", "CGA") else 1.0 for codon in _SENSE_CODONS])
+_CODON_WEIGHTS /= _CODON_WEIGHTS.sum()
+_COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+def random_sequence(rng, length):
+    return rng.choice(_BASES, size=length).tobytes().decode()
+
+def random_cds(rng, codon_num):
+    codons = rng.choice(len(_SENSE_CODONS), size=codon_num - 2, p=_CODON_WEIGHTS)
+    return "ATG" + "".join(_SENSE_CODONS[i] for i in codons) + "TAA"
+
+def split_exons(rng, length, exon_num):
+    """Split a CDS of the given length into exon_num non-empty segment lengths."""
+    cuts = np.sort(rng.choice(np.arange(1, length), size=exon_num - 1, replace=False))
+    return np.diff(np.concatenate(([0], cuts, [length]))).tolist()
+
+def write_synthetic_data(work_dir, transcript_num, codon_num, exon_num, tissue_num, seed):
+    """
+    Write a synthetic RefEx table, TogoID conversion and Ensembl transcriptome.
+
+    The GTF and genome FASTA stand in for Ensembl (protectio.py extract --gtf/--genome),
+    the CDS FASTA for Homo_sapiens.GRCh38.cds.all.fa (protectio.py scan) and the JSON for
+    refseq2ensg.py, so no stage needs network access.
+
+    Returns:
+        dict: Paths of the written files.
+    """
+    rng = np.random.default_rng(seed)
+    paths = {
+        'refex': os.path.join(work_dir, 'fltr_RefEx_synthetic.tsv'),
+        'ids': os.path.join(work_dir, 'refseq_enst.json'),
+        'gtf': os.path.join(work_dir, 'synthetic.1.gtf'),
+        'genome': os.path.join(work_dir, 'synthetic_genome.fa'),
+        'cds': os.path.join(work_dir, 'synthetic.cds.all.fa'),
+    }
+
+    id_pairs = []
+    genome_parts = []
+    position = 1
+    with open(paths['gtf'], 'w') as gtf, open(paths['cds'], 'w') as cds_fasta:
+        for i in range(transcript_num):
+            refseq_id = f"NM_{9000000 + i}"
+            transcript_id = f"ENSTSYN{i:08d}"
+            id_pairs.append([refseq_id, transcript_id])
+            cds = random_cds(rng, codon_num)
+            strand = 1 if i % 2 == 0 else -1
+
+            # Exons in transcript order separated by introns, as the + strand of the pre-mRNA
+            exon_offsets = []
+            pre_mrna = []
+            cds_start = 0
+            for exon_index, exon_length in enumerate(split_exons(rng, len(cds), exon_num)):
+                if exon_index > 0:
+                    pre_mrna.append(random_sequence(rng, int(rng.integers(100, 500))))
+                exon_offsets.append((sum(len(part) for part in pre_mrna), exon_length))
+                pre_mrna.append(cds[cds_start:cds_start + exon_length])
+                cds_start += exon_length
+            pre_mrna = "".join(pre_mrna)
+
+            genome_parts.append(random_sequence(rng, 200))
+            region_start = position + 200
+            if strand == 1:
+                genome_parts.append(pre_mrna)
+            else:
+                genome_parts.append(pre_mrna.translate(_COMPLEMENT)[::-1])
+            for offset, exon_length in exon_offsets:
+                if strand == 1:
+                    start = region_start + offset
+                else:
+                    start = region_start + len(pre_mrna) - offset - exon_length
+                gtf.write(f"1\tsynthetic\tCDS\t{start}\t{start + exon_length - 1}\t.\t{'+' if strand == 1 else '-'}\t0\t"
+                          f"gene_id \"GSYN{i:08d}\"; transcript_id \"{transcript_id}\"; transcript_version \"1\";\n")
+            position = region_start + len(pre_mrna)
+            cds_fasta.write(f">{transcript_id}.1 cds chromosome:synthetic:1\n")
+            cds_fasta.write("\n".join(cds[j:j + 60] for j in range(0, len(cds), 60)) + "\n")
+    genome_parts.append(random_sequence(rng, 200))
+
+    genome = "".join(genome_parts)
+    with open(paths['genome'], 'w') as genome_fasta:
+        genome_fasta.write(">1 synthetic\n")
+        genome_fasta.write("\n".join(genome[j:j + 60] for j in range(0, len(genome), 60)) + "\n")
+
+    with open(paths['ids'], 'w') as f:
+        json.dump([{'results': id_pairs}], f)
+
+    # Every transcript is over- or under-expressed in at least one tissue, like the filtered RefEx table
+    tissues = [f"v{j + 1}_tissue{j + 1}" for j in range(tissue_num)]
+    values = rng.choice([0, 0, 0, 1, -1], size=(transcript_num, tissue_num))
+    values[np.arange(transcript_num), rng.integers(0, tissue_num, size=transcript_num)] = 1
+    with open(paths['refex'], 'w') as f:
+        f.write("\t".join(['NCBI_RefSeqID', 'Gene_symbol'] + tissues) + "\n")
+        for (refseq_id, _), row in zip(id_pairs, values.tolist()):
+            f.write("\t".join([refseq_id, f"SYN{refseq_id[3:]}"] + [str(value) for value in row]) + "\n")
+    return paths
+
+def count_files(path):
+    return sum(len(files) for _, _, files in os.walk(path)) if os.path.isdir(path) else 0
+
+def count_windows(db_dir):
+    """Return (number of transcripts with windows, number of windows) of a database."""
+    transcript_num = 0
+    window_num = 0
+    targets_dir = os.path.join(db_dir, 'prediction_targets')
+    if not os.path.isdir(targets_dir):
+        return 0, 0
+    for root, _, files in os.walk(targets_dir):
+        if 'target.csv' in files:
+            with open(os.path.join(root, 'target.csv'), 'rb') as f:
+                rows = sum(1 for line in f if line.strip())
+            if rows:
+                transcript_num += 1
+                window_num += rows
+    return transcript_num, window_num
+
+def run_stage(name, command, log_dir, env=None):
+    """
+    Run one stage as a child process and measure it.
+
+    Returns:
+        dict: Command, return code, wall time and peak RSS of the child.
+    """
+    log_file = os.path.join(log_dir, f"{name}.log")
+    print(f"[{name}] {' '.join(command)}")
+    with open(log_file, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=REPO_DIR, stdout=log, stderr=subprocess.STDOUT, env=env)
+        # wait4 gives the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    result = {
+        'name': name,
+        'command': command,
+        'returncode': process.returncode,
+        'seconds': round(seconds, 3),
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        'peak_rss_mb': round(usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'log': log_file,
+    }
+    print(f"[{name}] {'ok' if process.returncode == 0 else 'failed'} in {seconds:.1f} s, peak RSS {result['peak_rss_mb']} MB")
+    return result
+
+def add_rates(result, transcript_num, window_num):
+    if result['returncode'] == 0 and result['seconds'] > 0:
+        result['transcripts_per_second'] = round(transcript_num / result['seconds'], 2)
+        result['windows_per_second'] = round(window_num / result['seconds'], 2)
+    return result
+
+def run_benchmark(work_dir, transcript_num=1000, codon_num=400, exon_num=4, tissue_num=10, predictors=None,
+                  extraction='extract', plots='none', seed=0, workers=None):
+    """
+    Build a synthetic database and time every stage of the PROTECTiO pipeline on it.
+
+    Args:
+        work_dir (str): Empty or missing directory for the synthetic inputs and outputs.
+        transcript_num (int): Transcripts (one per RefSeq ID).
+        codon_num (int): Codons per CDS, including the start and stop codons.
+        exon_num (int): CDS exons per transcript.
+        tissue_num (int): RefEx tissue columns.
+        predictors (list): Keys of PREDICTORS to time (default: all; DNABERT-2 models run on CPU).
+        extraction (str): 'extract' (local GTF and genome) or 'scan' (CDS FASTA).
+        plots (str): Plot mode of the aggregation and summary stages.
+        seed (int): Random seed of the synthetic data.
+        workers (int): Pinned worker processes of the predict stages (protectio.py predict --workers).
+
+    Returns:
+        dict: Benchmark report.
+    """
+    predictors = predictors or DEFAULT_PREDICTORS
+    if os.path.exists(work_dir) and os.listdir(work_dir):
+        raise FileExistsError(f"{work_dir} is not empty.")
+    log_dir = os.path.join(work_dir, 'logs')
+    db_dir = os.path.join(work_dir, 'db')
+    os.makedirs(log_dir)
+    os.makedirs(db_dir)
+
+    start = time.perf_counter()
+    paths = write_synthetic_data(work_dir, transcript_num, codon_num, exon_num, tissue_num, seed)
+    print(f"Synthetic data of {transcript_num} transcripts written in {time.perf_counter() - start:.1f} s")
+
+    python = sys.executable
+    protectio = os.path.join(REPO_DIR, 'protectio.py')
+    # Classifier throughput is measured on CPU
+    cpu_env = dict(os.environ, CUDA_VISIBLE_DEVICES="")
+    stages = []
+
+    if extraction == 'scan':
+        command = [python, protectio, 'scan', '--db', db_dir, '--ids', paths['ids'], '--fasta', paths['cds']]
+    else:
+        command = [python, protectio, 'extract', '--db', db_dir, '--ids', paths['ids'], '--gtf', paths['gtf'], '--genome', paths['genome']]
+    result = run_stage(extraction, command, log_dir)
+    substrate_transcript_num, window_num = count_windows(db_dir)
+    stages.append(add_rates(result, transcript_num, window_num))
+    stages[-1]['file_count'] = count_files(db_dir)
+
+    for predictor in predictors:
+        arguments, prefix = PREDICTORS[predictor]
+        if workers is not None and arguments[0] == 'predict':
+            arguments = arguments + ['--workers', str(workers)]
+        result = run_stage(predictor, [python, protectio] + arguments + ['--db', db_dir], log_dir, cpu_env)
+        stages.append(add_rates(result, substrate_transcript_num, window_num))
+        stages[-1]['file_count'] = count_files(db_dir)
+
+    # Densities of the first predictor again, from its existing predictions
+    arguments, prefix = PREDICTORS[predictors[0]]
+    density_files = [os.path.join(root, prefix + 'density.csv') for root, _, files in os.walk(db_dir) if prefix + 'density.csv' in files]
+    for density_file in density_files:
+        os.remove(density_file)
+    result = run_stage('density', [python, protectio] + arguments + ['--db', db_dir], log_dir, cpu_env)
+    stages.append(add_rates(result, substrate_transcript_num, window_num))
+    stages[-1]['file_count'] = count_files(db_dir)
+
+    aggregated_dir = os.path.join(work_dir, 'aggregated')
+    result = run_stage('aggregation', [python, os.path.join(REPO_DIR, 'aggregate_density_by_tissue.py'),
+                                       '--refex_file', paths['refex'], '--base_dir', db_dir, '--output_dir', aggregated_dir,
+                                       '--prefix', prefix, '--plots', plots], log_dir)
+    stages.append(add_rates(result, substrate_transcript_num, window_num))
+    stages[-1]['file_count'] = count_files(aggregated_dir)
+
+    summary_dir = os.path.join(work_dir, 'summary')
+    result = run_stage('summary', [python, os.path.join(REPO_DIR, 'summary_density_by_tissue.py'),
+                                   '--input_dir', aggregated_dir, '--output_dir', summary_dir, '--plots', plots], log_dir)
+    stages.append(result)
+    stages[-1]['file_count'] = count_files(summary_dir)
+
+    return {
+        'version': __version__,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'transcripts': transcript_num,
+            'codons_per_transcript': codon_num,
+            'exons_per_transcript': exon_num,
+            'tissues': tissue_num,
+            'predictors': predictors,
+            'extraction': extraction,
+            'plots': plots,
+            'seed': seed,
+            'workers': workers,
+        },
+        'transcripts_with_substrates': substrate_transcript_num,
+        'windows': window_num,
+        'total_seconds': round(sum(stage['seconds'] for stage in stages), 3),
+        'stages': stages,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the PROTECTiO database build and prediction stages on synthetic data.")
+    parser.add_argument('--work_dir', required=True, help="Directory for the synthetic data and outputs (must be empty or missing)")
+    parser.add_argument('--output', default=None, help="JSON report (default: <work_dir>/benchmark.json)")
+    parser.add_argument('--transcripts', type=int, default=1000, help="Number of synthetic transcripts (default: 1000)")
+    parser.add_argument('--codons', type=int, default=400, help="Codons per CDS (default: 400)")
+    parser.add_argument('--exons', type=int, default=4, help="CDS exons per transcript (default: 4)")
+    parser.add_argument('--tissues', type=int, default=10, help="RefEx tissue columns (default: 10)")
+    parser.add_argument('--predictor', action='append', choices=sorted(PREDICTORS), default=None,
+                        help="Predictor to time (repeat for several; default: acw, wcw, stl and snl)")
+    parser.add_argument('--extraction', choices=['extract', 'scan'], default='extract',
+                        help="Extract from the local GTF and genome (default) or scan the CDS FASTA")
+    parser.add_argument('--plots', choices=['none', 'fast', 'publication'], default='none', help="Plot mode of aggregation and summary (default: none)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument('--keep', action='store_true', help="Keep the synthetic database after the run")
+    parser.add_argument('--workers', type=int, default=None, help="Pinned worker processes of the DNABERT-2 stages (default: one process)")
+    args = parser.parse_args()
+
+    if args.exons < 1 or args.codons < max(3, args.exons):
+        parser.error("--codons must be at least 3 and at least --exons")
+    report = run_benchmark(args.work_dir, args.transcripts, args.codons, args.exons, args.tissues, args.predictor,
+                           args.extraction, args.plots, args.seed, args.workers)
+    output = args.output or os.path.join(args.work_dir, 'benchmark.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if not args.keep:
+        shutil.rmtree(os.path.join(args.work_dir, 'db'))
+    print(f"Benchmark report saved to {output}")
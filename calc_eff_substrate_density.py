@@ -1,41 +1,263 @@
+import os
 import pandas as pd
+import numpy as np
 import argparse
 
-def merge_and_calculate_density(eval_res_path, table_path, output_path):
-    # Load the two CSV files
+from esd_store import DENSITY_COLUMNS
+from window_store import DEFAULT_THRESHOLD
+
+def read_window_labels(eval_res_path, table_path):
+    # Load the two CSV files; row i of eval_res.csv is the prediction for row i of table.csv
     eval_res_df = pd.read_csv(eval_res_path)
     table_df = pd.read_csv(table_path)
+    if len(eval_res_df) != len(table_df) or (eval_res_df['flanking_sequence'].to_numpy() != table_df['flanking_sequence'].to_numpy()).any():
+        raise ValueError(f"{eval_res_path} does not follow the window order of {table_path}.")
+    return pd.DataFrame({
+        'effective': (eval_res_df['pred'] == 'LABEL_1').to_numpy(),
+        'amino_acid_len': table_df['amino_acid_len'].to_numpy(),
+        'rel_amino_acid_pos': table_df['rel_amino_acid_pos'].to_numpy(),
+    })
+
+def packed_window_labels(windows, label_ids):
+    # Same columns from the packed windows and labels (window_store.py); rows are aligned by construction
+    return pd.DataFrame({
+        'effective': np.asarray(label_ids) == 1,
+        'amino_acid_len': np.asarray(windows['amino_acid_len'], dtype=np.int64),
+        'rel_amino_acid_pos': np.asarray(windows['rel_amino_acid_pos']),
+    })
+
+def effective_from_scores(scores, threshold=None, expected=False):
+    # LABEL_1 probability -> effective column: scores >= threshold (bool), or the probabilities themselves as expected counts
+    scores = np.asarray(scores, dtype=np.float64)
+    if expected:
+        return scores
+    return scores >= (DEFAULT_THRESHOLD if threshold is None else threshold)
 
-    # Merging the two dataframes based on 'flanking_sequence' column
-    merged_df = pd.merge(eval_res_df, table_df, on='flanking_sequence', how='inner')
+def read_window_scores(scores_path, table_path, threshold=None, expected=False):
+    # Same columns as read_window_labels from a <prefix>scores.npy aligned to table.csv
+    from window_store import read_scores
+    scores = read_scores(scores_path, mmap=False)
+    table_df = pd.read_csv(table_path)
+    if len(scores) != len(table_df):
+        raise ValueError(f"{scores_path} does not have one score per window of {table_path}.")
+    return pd.DataFrame({
+        'effective': effective_from_scores(scores, threshold, expected),
+        'amino_acid_len': table_df['amino_acid_len'].to_numpy(),
+        'rel_amino_acid_pos': table_df['rel_amino_acid_pos'].to_numpy(),
+    })
 
-    # Calculating scalar values
-    total_label_1_count = merged_df[merged_df['pred'] == 'LABEL_1'].shape[0]
-    total_flanking_sequence_count = merged_df.shape[0]
-    amino_acid_len = merged_df['amino_acid_len'].iloc[0]
+def packed_window_scores(windows, scores, threshold=None, expected=False):
+    # Same columns from the packed windows (window_store.py) and a scores.npy
+    windows_df = packed_window_labels(windows, np.zeros(len(windows), dtype=np.uint8))
+    windows_df['effective'] = effective_from_scores(scores, threshold, expected)
+    return windows_df
 
-    # Scalar value 1: (LABEL_1 count) / (flanking_sequence total count) / (amino_acid_len)
-    eff_substrate_dens = round(total_label_1_count / total_flanking_sequence_count / amino_acid_len, 5)
+def read_transcript_scores(target_dir, prefix, threshold=None, expected=False, matrix=None):
+    """
+    Read the windows of one transcript directory with effective set from the predictor's scores.
 
-    # Scalar value 2: Mean of rel_amino_acid_pos for all rows
-    mean_rel_amino_acid_pos_all = round(merged_df['rel_amino_acid_pos'].mean(), 5)
+    Predictors without probabilities (motifs, custom scripts) fall back to their labels
+    as 0/1 scores, so any threshold in (0, 1] reproduces their labels.
 
-    # Scalar value 3: Mean of rel_amino_acid_pos for rows with LABEL_1
-    mean_rel_amino_acid_pos_label_1 = round(merged_df[merged_df['pred'] == 'LABEL_1']['rel_amino_acid_pos'].mean(), 5)
+    Args:
+        target_dir (str): Transcript directory.
+        prefix (str): Predictor prefix.
+        threshold (float): Minimum LABEL_1 probability of an effective substrate (default: 0.5).
+        expected (bool): Weight every window by its probability instead of thresholding.
+        matrix (SubstrateMatrix): Substrate matrix of the database; predictions written by
+            predict/motif --matrix are read from its slice of the transcript.
 
-    # Creating a DataFrame to store the results
+    Returns:
+        DataFrame: effective, amino_acid_len and rel_amino_acid_pos, or None if the
+            transcript has no prediction of the predictor.
+    """
+    from window_store import WINDOWS_FILE, LABELS_SUFFIX, SCORES_SUFFIX, read_windows, read_labels, read_scores
+
+    table_path = os.path.join(target_dir, 'table.csv')
+    windows_path = os.path.join(target_dir, WINDOWS_FILE)
+    scores_path = os.path.join(target_dir, f"{prefix}{SCORES_SUFFIX}")
+    eval_res_path = os.path.join(target_dir, f"{prefix}eval_res.csv")
+    labels_path = os.path.join(target_dir, f"{prefix}{LABELS_SUFFIX}")
+    if os.path.isfile(scores_path) and os.path.isfile(table_path):
+        return read_window_scores(scores_path, table_path, threshold, expected)
+    if os.path.isfile(scores_path) and os.path.isfile(windows_path):
+        # Transcripts packed by protectio.py pack
+        return packed_window_scores(read_windows(windows_path), read_scores(scores_path), threshold, expected)
+    if os.path.isfile(eval_res_path):
+        windows_df = read_window_labels(eval_res_path, table_path)
+    elif os.path.isfile(labels_path):
+        windows_df = packed_window_labels(read_windows(windows_path), read_labels(labels_path))
+    elif matrix is not None:
+        return read_matrix_scores(matrix, target_dir, prefix, threshold, expected)
+    else:
+        return None
+    windows_df['effective'] = effective_from_scores(windows_df['effective'], threshold, expected)
+    return windows_df
+
+def read_matrix_scores(matrix, target_dir, prefix, threshold=None, expected=False):
+    # Same columns from the transcript's rows of <prefix>matrix_scores.npy (or matrix_labels.npy)
+    from window_store import read_labels, read_scores
+    refseq_dir, enst_id = os.path.split(os.path.normpath(target_dir))
+    key = (os.path.basename(refseq_dir), enst_id)
+    if key not in matrix.offsets:
+        return None
+    start, end = matrix.offsets[key]
+    if os.path.isfile(matrix.scores_file(prefix)):
+        return packed_window_scores(matrix.windows[start:end], read_scores(matrix.scores_file(prefix))[start:end], threshold, expected)
+    if os.path.isfile(matrix.labels_file(prefix)):
+        windows_df = packed_window_labels(matrix.windows[start:end], read_labels(matrix.labels_file(prefix))[start:end])
+        windows_df['effective'] = effective_from_scores(windows_df['effective'], threshold, expected)
+        return windows_df
+    return None
+
+def batch_density(windows_df):
+    """
+    Calculate the ESD metrics of many transcripts with one groupby.
+
+    Windows are joined to their predictions by (transcript, row), so a window that
+    appears twice in a transcript is counted twice, not four times.
+
+    Args:
+        windows_df (DataFrame): One row per window with transcript (any key), effective
+            (bool, or float LABEL_1 probability for expected counts), amino_acid_len and
+            rel_amino_acid_pos.
+
+    Returns:
+        DataFrame: DENSITY_COLUMNS indexed by transcript, in order of first appearance.
+    """
+    if windows_df['effective'].dtype != bool:
+        return expected_density(windows_df)
+    grouped = windows_df.groupby('transcript', sort=False).agg(
+        total=('effective', 'size'),
+        effective=('effective', 'sum'),
+        amino_acid_len=('amino_acid_len', 'first'),
+    )
+    grouped['mean_all'] = transcript_means(windows_df)
+    grouped['mean_effective'] = transcript_means(windows_df[windows_df['effective'].to_numpy()]).reindex(grouped.index)
     density_df = pd.DataFrame({
-        'Total substrate': [total_flanking_sequence_count],
-        'Effective substrate': [total_label_1_count],
-        'Peptide length': [amino_acid_len],
-        'Effective substrate density': [eff_substrate_dens],
-        'Mean position of Substrate': [mean_rel_amino_acid_pos_all],
-        'Mean position of Effective substrate': [mean_rel_amino_acid_pos_label_1]
+        # Scalar value 1: (LABEL_1 count) / (flanking_sequence total count) / (amino_acid_len)
+        'Total substrate': grouped['total'].astype(np.int64),
+        'Effective substrate': grouped['effective'].astype(np.int64),
+        'Peptide length': grouped['amino_acid_len'],
+        'Effective substrate density': (grouped['effective'] / grouped['total'] / grouped['amino_acid_len']).round(5),
+        # Scalar value 2: Mean of rel_amino_acid_pos for all rows
+        'Mean position of Substrate': grouped['mean_all'].round(5),
+        # Scalar value 3: Mean of rel_amino_acid_pos for rows with LABEL_1
+        'Mean position of Effective substrate': grouped['mean_effective'].round(5),
     })
+    return density_df[DENSITY_COLUMNS]
+
+def transcript_means(windows_df):
+    # Mean rel_amino_acid_pos of every transcript with Series.mean, as the per-transcript script
+    # computed it: the groupby mean sums in another order and can round the 5th decimal differently
+    return windows_df.groupby('transcript', sort=False)['rel_amino_acid_pos'].agg(lambda positions: positions.mean())
+
+def expected_density(windows_df):
+    # batch_density with every window weighted by its LABEL_1 probability: the effective
+    # substrate is the expected number of effective windows and its mean position is weighted
+    windows_df = windows_df.assign(weighted_pos=windows_df['rel_amino_acid_pos'] * windows_df['effective'])
+    grouped = windows_df.groupby('transcript', sort=False).agg(
+        total=('effective', 'size'),
+        effective=('effective', 'sum'),
+        weighted_pos=('weighted_pos', 'sum'),
+        amino_acid_len=('amino_acid_len', 'first'),
+    )
+    grouped['mean_all'] = transcript_means(windows_df)
+    density_df = pd.DataFrame({
+        'Total substrate': grouped['total'].astype(np.int64),
+        'Effective substrate': grouped['effective'].round(5),
+        'Peptide length': grouped['amino_acid_len'],
+        'Effective substrate density': (grouped['effective'] / grouped['total'] / grouped['amino_acid_len']).round(5),
+        'Mean position of Substrate': grouped['mean_all'].round(5),
+        # NaN for a transcript without any probability mass, like a transcript without LABEL_1
+        'Mean position of Effective substrate': (grouped['weighted_pos'] / grouped['effective'].where(grouped['effective'] > 0)).round(5),
+    })
+    return density_df[DENSITY_COLUMNS]
+
+def write_density_files(density_df, output_paths):
+    # Save one single-row density.csv per transcript
+    for transcript, output_path in output_paths.items():
+        density_df.loc[[transcript]].to_csv(output_path, index=False)
+        print(f"Density calculations saved to {output_path}")
+
+def batch_calculate_density(jobs, write_files=True):
+    """
+    Calculate the ESD of many transcripts from their eval_res.csv and table.csv files.
+
+    Args:
+        jobs (list): (eval_res.csv, table.csv, density.csv or None) tuples.
+        write_files (bool): Write the density.csv of every job that names one.
+
+    Returns:
+        tuple: (DataFrame of DENSITY_COLUMNS indexed by job position, {job position: error})
+    """
+    frames = []
+    errors = {}
+    for job_id, (eval_res_path, table_path, _) in enumerate(jobs):
+        try:
+            frames.append(read_window_labels(eval_res_path, table_path).assign(transcript=job_id))
+        except Exception as e:
+            errors[job_id] = e
+    density_df = batch_density(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame(columns=DENSITY_COLUMNS)
+
+    # A transcript without windows has no density
+    for job_id in range(len(jobs)):
+        if job_id not in errors and job_id not in density_df.index:
+            errors[job_id] = ValueError("No substrate window to calculate the density from.")
+    if write_files:
+        write_density_files(density_df, {job_id: output_path for job_id, (_, _, output_path) in enumerate(jobs)
+                                         if output_path is not None and job_id in density_df.index})
+    return density_df, errors
+
+def calculate_single_density(windows_df, output_path):
+    density_df = batch_density(windows_df.assign(transcript=0))
+    if len(density_df) == 0:
+        raise ValueError("No substrate window to calculate the density from.")
+    write_density_files(density_df, {0: output_path})
+
+def merge_and_calculate_density(eval_res_path, table_path, output_path):
+    calculate_single_density(read_window_labels(eval_res_path, table_path), output_path)
+
+def calculate_packed_density(windows_path, labels_path, output_path):
+    # Load the packed windows and labels (window_store.py) instead of the CSV files
+    from window_store import read_windows, read_labels
+    calculate_single_density(packed_window_labels(read_windows(windows_path), read_labels(labels_path)), output_path)
+
+def store_density(store_path, prefix, threshold=None, expected=False):
+    # ESD of every transcript of a consolidated store (protectio.py consolidate --windows);
+    # from the stored labels, or from the stored scores when a threshold or expected counts are asked for
+    from esd_store import load_window_labels, load_window_scores
+    if threshold is None and not expected:
+        windows_df = load_window_labels(store_path, prefix)
+    else:
+        windows_df = load_window_scores(store_path, prefix)
+        windows_df['effective'] = effective_from_scores(windows_df.pop('score'), threshold, expected)
+    transcript_ids, transcripts = pd.factorize(pd.MultiIndex.from_arrays([windows_df['refseq_id'], windows_df['enst_id']]))
+    density_df = batch_density(windows_df.assign(transcript=transcript_ids))
+    density_df.insert(0, 'ENST_ID', transcripts.get_level_values(1)[density_df.index])
+    density_df.insert(0, 'NCBI_RefSeqID', transcripts.get_level_values(0)[density_df.index])
+    return density_df.reset_index(drop=True)
+
+def calculate_score_density(scores_path, table_path, windows_path, output_path, threshold=None, expected=False):
+    # Density from a scores.npy with table.csv (or the packed windows.npy)
+    if table_path is not None:
+        windows_df = read_window_scores(scores_path, table_path, threshold, expected)
+    else:
+        from window_store import read_windows, read_scores
+        windows_df = packed_window_scores(read_windows(windows_path), read_scores(scores_path), threshold, expected)
+    calculate_single_density(windows_df, output_path)
 
-    # Saving the result to a CSV file
-    density_df.to_csv(output_path, index=False)
-    print(f"Density calculations saved to {output_path}")
+def calculate_store_density(store_path, prefix, output_path=None, threshold=None, expected=False):
+    # Calculate the ESD of every transcript of a consolidated store; only the label-based
+    # densities replace the predictor's records, threshold/expected ones go to output_path
+    from esd_store import save_density
+    density_df = store_density(store_path, prefix, threshold, expected)
+    if threshold is None and not expected:
+        save_density(store_path, prefix, density_df)
+        print(f"Density of {len(density_df)} transcripts saved to {store_path}")
+    if output_path is not None:
+        density_df.to_csv(output_path, index=False)
+        print(f"Density calculations saved to {output_path}")
 
 if __name__ == "__main__":
     # Argument parser for command-line arguments
@@ -43,9 +265,23 @@ if __name__ == "__main__":
     parser.add_argument('-e', '--eval_res', type=str, help='Path to the eval_res.csv file')
     parser.add_argument('-t', '--table', type=str, help='Path to the table.csv file')
     parser.add_argument('-d', '--output', type=str, help='Output path for the density.csv file')
+    parser.add_argument('-w', '--windows', type=str, help='Path to the windows.npy file (instead of -t)')
+    parser.add_argument('-l', '--labels', type=str, help='Path to the labels.npy file (instead of -e)')
+    parser.add_argument('-s', '--store', type=str, help='Consolidated ESD store with windows (protectio.py consolidate --windows); -d writes a summary CSV')
+    parser.add_argument('-p', '--prefix', type=str, default='', help='Predictor prefix in the store (default: "")')
+    parser.add_argument('-c', '--scores', type=str, help='Path to the scores.npy file (instead of -e/-l) with the LABEL_1 probabilities')
+    parser.add_argument('--threshold', type=float, default=None, help=f'Minimum LABEL_1 probability of an effective substrate (default: predicted labels, or {DEFAULT_THRESHOLD} with -c)')
+    parser.add_argument('--expected', action='store_true', help='Count every window by its LABEL_1 probability (expected effective substrates)')
 
     # Parse the arguments
     args = parser.parse_args()
 
     # Call the function with the provided arguments
-    merge_and_calculate_density(args.eval_res, args.table, args.output)
+    if args.store is not None:
+        calculate_store_density(args.store, args.prefix, args.output, args.threshold, args.expected)
+    elif args.scores is not None:
+        calculate_score_density(args.scores, args.table, args.windows, args.output, args.threshold, args.expected)
+    elif args.windows is not None and args.labels is not None:
+        calculate_packed_density(args.windows, args.labels, args.output)
+    else:
+        merge_and_calculate_density(args.eval_res, args.table, args.output)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import asyncio
+import hashlib
+import sqlite3
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+MANIFEST_FILE = 'manifest.sqlite'
+
+# Files of a transcript directory written by extraction; a change invalidates every prediction
+EXTRACTION_FILES = ('target.csv', 'table.csv', 'windows.npy')
+# Per-predictor files, keyed by their suffix after the predictor prefix
+PREDICTION_SUFFIXES = ('eval_res.csv', 'labels.npy', 'scores.npy', 'density.csv')
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS transcripts ("
+    "refseq_id TEXT NOT NULL, enst_id TEXT NOT NULL, release TEXT, cds_checksum TEXT, "
+    "PRIMARY KEY (refseq_id, enst_id)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS outputs ("
+    "refseq_id TEXT NOT NULL, enst_id TEXT NOT NULL, file_name TEXT NOT NULL, sha256 TEXT NOT NULL, "
+    "PRIMARY KEY (refseq_id, enst_id, file_name)) WITHOUT ROWID",
+    # Tab-separated tissue columns of every RefEx row, to find the tissues whose members changed
+    "CREATE TABLE IF NOT EXISTS refex (refseq_id TEXT PRIMARY KEY, tissue_values TEXT NOT NULL)",
+    # Predictor runs (protectio.py predict / motif) replayed by protectio.py rebuild
+    "CREATE TABLE IF NOT EXISTS predictors (prefix TEXT PRIMARY KEY, command TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)",
+]
+
+def open_manifest(db_dir):
+    """Open (and create if needed) the manifest of a PROTECTiO database."""
+    connection = sqlite3.connect(os.path.join(db_dir, MANIFEST_FILE))
+    for statement in _SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+    return connection
+
+def file_sha256(path):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cds_checksum(mappings):
+    """
+    Checksum the CDS segments of a transcript.
+
+    Segments are sorted by position, so the REST (transcript order) and local GTF
+    (position order) backends give the same checksum for the same CDS.
+
+    Args:
+        mappings (list): CDS segments in the Ensembl REST map/cds format.
+
+    Returns:
+        str: SHA-256 hex digest, or None if the transcript has no CDS.
+    """
+    if not mappings:
+        return None
+    segments = sorted((m['seq_region_name'], m['start'], m['end'], m['strand']) for m in mappings)
+    return hashlib.sha256(json.dumps(segments).encode()).hexdigest()
+
+def fetch_cds_checksums(transcript_ids, local_genome=None):
+    """
+    Checksum the current CDS of every transcript.
+
+    Args:
+        transcript_ids (list): Ensembl transcript IDs.
+        local_genome (LocalGenome): Local GTF/genome backend; the Ensembl REST API
+            (batched POST lookup/id) is used if None.
+
+    Returns:
+        dict: {transcript ID: checksum or None}
+    """
+    if local_genome is not None:
+        return {transcript_id: cds_checksum(local_genome.get_cds_mappings(transcript_id)) for transcript_id in transcript_ids}
+
+    from rest_client import AsyncRestClient
+    from extract_codon_sequence_with_exons import lookup_exon_info_async
+
+    async def run():
+        async with AsyncRestClient() as client:
+            return await lookup_exon_info_async(client, list(transcript_ids))
+
+    exon_info = asyncio.run(run())
+    return {transcript_id: cds_checksum(mappings) for transcript_id, mappings in exon_info.items()}
+
+def fetch_release(gtf_file=None):
+    """
+    Return the Ensembl release the substrates are extracted from.
+
+    Args:
+        gtf_file (str): Local GTF file (e.g. Homo_sapiens.GRCh38.112.gtf.gz). The release
+            is read from its name; the Ensembl REST API is asked if None.
+
+    Returns:
+        str: Release, e.g. "112".
+    """
+    if gtf_file is not None:
+        match = re.search(r'\.(\d+)\.gtf', os.path.basename(gtf_file))
+        return match.group(1) if match else os.path.basename(gtf_file)
+
+    from rest_client import AsyncRestClient, RestClientError, ENSEMBL_REST_SERVER
+
+    async def run():
+        async with AsyncRestClient() as client:
+            return await client.get_json(f"{ENSEMBL_REST_SERVER}/info/data")
+
+    status, data = asyncio.run(run())
+    if status != 200 or not data or not data.get('releases'):
+        raise RestClientError("Unable to retrieve the Ensembl release")
+    return str(max(data['releases']))
+
+def read_refex_rows(refex_file):
+    """
+    Read the tissue columns of every RefEx row.
+
+    Returns:
+        tuple: (tissue names, {RefSeq ID: tab-separated tissue values})
+    """
+    import pandas as pd
+
+    refex_df = pd.read_csv(refex_file, sep='\t', dtype=str, keep_default_na=False)
+    tissues = refex_df.columns[2:].tolist()
+    rows = {}
+    for refseq_id, values in zip(refex_df['NCBI_RefSeqID'], refex_df[tissues].itertuples(index=False, name=None)):
+        # A RefSeq ID listed twice keeps every row
+        rows[refseq_id] = rows[refseq_id] + '\n' + '\t'.join(values) if refseq_id in rows else '\t'.join(values)
+    return tissues, rows
+
+def changed_tissues(old_rows, new_rows, tissues):
+    """
+    List the tissues whose tissue-specific transcripts changed between two RefEx versions.
+
+    Args:
+        old_rows (dict): {RefSeq ID: tissue values} recorded in the manifest.
+        new_rows (dict): {RefSeq ID: tissue values} of the new RefEx file.
+        tissues (list): Tissue columns of the new RefEx file.
+
+    Returns:
+        list: Tissue names, plus "All" if any transcript was added or removed.
+    """
+    changed = set()
+    for refseq_id in set(old_rows) | set(new_rows):
+        old_values = old_rows.get(refseq_id)
+        new_values = new_rows.get(refseq_id)
+        if old_values == new_values:
+            continue
+        if old_values is None or new_values is None:
+            changed.add('All')
+        old_lines = [line.split('\t') for line in old_values.split('\n')] if old_values else []
+        new_lines = [line.split('\t') for line in new_values.split('\n')] if new_values else []
+        for i, tissue in enumerate(tissues):
+            if [line[i] if i < len(line) else None for line in old_lines] != [line[i] for line in new_lines]:
+                changed.add(tissue)
+    return [tissue for tissue in ['All'] + tissues if tissue in changed]
+
+def record_predictor(db_dir, prefix, command):
+    """
+    Remember how a predictor was run, so protectio.py rebuild can run it again.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        prefix (str): Output file prefix of the predictor.
+        command (dict): Keyword arguments of protectio.predict_db or protectio.motif_db.
+    """
+    connection = open_manifest(db_dir)
+    connection.execute("INSERT OR REPLACE INTO predictors VALUES (?, ?)", (prefix, json.dumps(command, sort_keys=True)))
+    connection.commit()
+    connection.close()
+
+def recorded_predictors(connection):
+    """Return {prefix: command} of every predictor recorded in the manifest."""
+    return {prefix: json.loads(command) for prefix, command in connection.execute("SELECT prefix, command FROM predictors ORDER BY prefix")}
+
+def hash_outputs(target_dir):
+    """Return {file name: SHA-256} of the extraction and prediction files of a transcript."""
+    hashes = {}
+    for file_name in sorted(os.listdir(target_dir)):
+        if file_name in EXTRACTION_FILES or file_name.endswith(PREDICTION_SUFFIXES):
+            hashes[file_name] = file_sha256(os.path.join(target_dir, file_name))
+    return hashes
+
+def stale_outputs(target_dir, recorded_hashes):
+    """
+    Compare the files of a transcript with the hashes recorded in the manifest.
+
+    A recorded file that was modified or deleted is stale.
+
+    Args:
+        target_dir (str): Transcript directory.
+        recorded_hashes (dict): {file name: SHA-256} from the manifest.
+
+    Returns:
+        tuple: (extraction changed, set of predictor prefixes whose files changed)
+    """
+    extraction_changed = False
+    stale_prefixes = set()
+    current_hashes = hash_outputs(target_dir) if os.path.isdir(target_dir) else {}
+    # Files written after the last rebuild (e.g. by add_custom_predictor_eval.sh) are not stale
+    for file_name in recorded_hashes:
+        if recorded_hashes.get(file_name) == current_hashes.get(file_name):
+            continue
+        if file_name in EXTRACTION_FILES:
+            extraction_changed = True
+        else:
+            suffix = next(suffix for suffix in PREDICTION_SUFFIXES if file_name.endswith(suffix))
+            stale_prefixes.add(file_name[:-len(suffix)])
+    return extraction_changed, stale_prefixes
+
+def remove_prediction_files(target_dir, prefix):
+    """Delete the eval_res, labels, scores and density files of one predictor."""
+    for suffix in PREDICTION_SUFFIXES:
+        path = os.path.join(target_dir, prefix + suffix)
+        if os.path.isfile(path):
+            os.remove(path)
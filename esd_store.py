@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import math
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from window_store import SCORES_SUFFIX, SCORE_DTYPE, MATRIX_FILE, MATRIX_LABELS_SUFFIX, MATRIX_SCORES_SUFFIX, SubstrateMatrix, read_labels, read_scores, unpack_windows
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# Columns of <prefix>density.csv, in file order
+DENSITY_COLUMNS = [
+    'Total substrate',
+    'Effective substrate',
+    'Peptide length',
+    'Effective substrate density',
+    'Mean position of Substrate',
+    'Mean position of Effective substrate',
+]
+_DENSITY_FIELDS = ['total_substrate', 'effective_substrate', 'peptide_length', 'esd', 'mean_pos_substrate', 'mean_pos_effective']
+_DENSITY_TYPES = [int, int, int, float, float, float]
+
+_SCHEMA = [
+    # enst_order keeps the os.listdir() order of the ENST directories, which is the
+    # row order of the rawdata_<tissue>.csv files written from the directory tree.
+    "CREATE TABLE IF NOT EXISTS density ("
+    "refseq_id TEXT NOT NULL, enst_id TEXT NOT NULL, predictor TEXT NOT NULL, enst_order INTEGER NOT NULL, "
+    "total_substrate INTEGER, effective_substrate INTEGER, peptide_length INTEGER, "
+    "esd REAL, mean_pos_substrate REAL, mean_pos_effective REAL, "
+    "PRIMARY KEY (refseq_id, enst_id, predictor)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS substrates ("
+    "refseq_id TEXT NOT NULL, enst_id TEXT NOT NULL, row INTEGER NOT NULL, "
+    "flanking_sequence TEXT, amino_acid TEXT, codon TEXT, pos INTEGER, amino_acid_len INTEGER, rel_amino_acid_pos REAL, "
+    "PRIMARY KEY (refseq_id, enst_id, row)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS predictions ("
+    "refseq_id TEXT NOT NULL, enst_id TEXT NOT NULL, predictor TEXT NOT NULL, row INTEGER NOT NULL, "
+    "flanking_sequence TEXT, pred TEXT, "
+    "PRIMARY KEY (refseq_id, enst_id, predictor, row)) WITHOUT ROWID",
+    # <prefix>scores.npy of a transcript as a float16 array, one LABEL_1 probability per row
+    "CREATE TABLE IF NOT EXISTS scores ("
+    "refseq_id TEXT NOT NULL, enst_id TEXT NOT NULL, predictor TEXT NOT NULL, scores BLOB NOT NULL, "
+    "PRIMARY KEY (refseq_id, enst_id, predictor)) WITHOUT ROWID",
+]
+
+def _parse_value(value, value_type):
+    # pandas writes NaN (e.g. no effective substrate) as an empty field
+    if value == '':
+        return None
+    number = float(value)
+    if math.isnan(number):
+        return None
+    return int(number) if value_type is int else number
+
+def read_density_file(density_file):
+    """
+    Read the single data row of a density.csv file.
+
+    Args:
+        density_file (str): Path to <prefix>density.csv.
+
+    Returns:
+        list: Six values in DENSITY_COLUMNS order (None for NaN), or None if the file is empty.
+    """
+    with open(density_file, 'r', newline='') as f:
+        rows = list(csv.reader(f))
+    if len(rows) < 2:
+        return None
+    values = dict(zip(rows[0], rows[1]))
+    return [_parse_value(values[column], value_type) for column, value_type in zip(DENSITY_COLUMNS, _DENSITY_TYPES)]
+
+def open_store(store_path):
+    """Open (and create if needed) a consolidated ESD store."""
+    connection = sqlite3.connect(store_path)
+    for statement in _SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+    return connection
+
+def consolidate_db(db_dir, store_path, include_windows=False):
+    """
+    Gather every <prefix>density.csv of a PROTECTiO database into one SQLite table.
+
+    The predictor key is the file prefix ("" for the default STL model,
+    "pred_motif_acw_" for the ACW motif, ...). Existing rows are replaced, so the
+    store can be refreshed after new predictors have been added.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        store_path (str): SQLite file to write.
+        include_windows (bool): Also store every table.csv and <prefix>eval_res.csv row
+            and every <prefix>scores.npy (for transcripts predicted with --matrix, their
+            rows of <prefix>matrix_labels.npy and <prefix>matrix_scores.npy).
+
+    Returns:
+        int: Number of density records stored.
+    """
+    connection = open_store(store_path)
+    density_rows = []
+    substrate_rows = []
+    prediction_rows = []
+    score_rows = []
+
+    targets_dir = os.path.join(db_dir, 'prediction_targets')
+    for refseq_entry in sorted(os.scandir(targets_dir), key=lambda entry: entry.name):
+        if refseq_entry.name.startswith('.') or not refseq_entry.is_dir():
+            continue
+        enst_names = [name for name in os.listdir(refseq_entry.path) if not name.startswith('.')]
+        for enst_order, enst_id in enumerate(enst_names):
+            enst_dir = os.path.join(refseq_entry.path, enst_id)
+            if not os.path.isdir(enst_dir):
+                continue
+            for file_name in os.listdir(enst_dir):
+                path = os.path.join(enst_dir, file_name)
+                if file_name.endswith('density.csv'):
+                    values = read_density_file(path)
+                    if values is None:
+                        print(f"Warning: {path} is empty. Skipping.")
+                        continue
+                    predictor = file_name[:-len('density.csv')]
+                    density_rows.append([refseq_entry.name, enst_id, predictor, enst_order] + values)
+                elif include_windows and file_name == 'table.csv':
+                    with open(path, 'r', newline='') as f:
+                        reader = csv.reader(f)
+                        next(reader, None)
+                        for row, fields in enumerate(reader):
+                            substrate_rows.append([refseq_entry.name, enst_id, row] + fields[:6])
+                elif include_windows and file_name.endswith('eval_res.csv'):
+                    predictor = file_name[:-len('eval_res.csv')]
+                    with open(path, 'r', newline='') as f:
+                        reader = csv.reader(f)
+                        next(reader, None)
+                        for row, fields in enumerate(reader):
+                            prediction_rows.append([refseq_entry.name, enst_id, predictor, row] + fields[:2])
+                elif include_windows and file_name.endswith(SCORES_SUFFIX):
+                    predictor = file_name[:-len(SCORES_SUFFIX)]
+                    score_rows.append([refseq_entry.name, enst_id, predictor, np.load(path).astype(SCORE_DTYPE).tobytes()])
+
+    if include_windows and os.path.isfile(os.path.join(db_dir, MATRIX_FILE)):
+        matrix_predictions, matrix_scores = matrix_window_rows(SubstrateMatrix(db_dir), {tuple(row[:3]) for row in prediction_rows},
+                                                               {tuple(row[:3]) for row in score_rows})
+        prediction_rows += matrix_predictions
+        score_rows += matrix_scores
+
+    connection.executemany("INSERT OR REPLACE INTO density VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", density_rows)
+    connection.executemany("INSERT OR REPLACE INTO substrates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", substrate_rows)
+    connection.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)", prediction_rows)
+    connection.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)", score_rows)
+    connection.commit()
+    connection.close()
+    return len(density_rows)
+
+def matrix_window_rows(matrix, stored_predictions, stored_scores):
+    # Prediction and score rows of the transcripts predicted with --matrix, cut from every
+    # <prefix>matrix_labels.npy / matrix_scores.npy; a transcript's own eval_res.csv or
+    # scores.npy (already in stored_predictions / stored_scores) takes precedence
+    prediction_rows = []
+    score_rows = []
+    for file_name in sorted(os.listdir(matrix.db_dir)):
+        if file_name.endswith(MATRIX_LABELS_SUFFIX):
+            predictor = file_name[:-len(MATRIX_LABELS_SUFFIX)]
+            values = read_labels(os.path.join(matrix.db_dir, file_name))
+        elif file_name.endswith(MATRIX_SCORES_SUFFIX):
+            predictor = file_name[:-len(MATRIX_SCORES_SUFFIX)]
+            values = read_scores(os.path.join(matrix.db_dir, file_name))
+        else:
+            continue
+        if len(values) != len(matrix):
+            print(f"Warning: {file_name} does not match the substrate matrix. Skipping.")
+            continue
+        for refseq_id, enst_id, start, end in matrix.entries:
+            key = (refseq_id, enst_id, predictor)
+            if file_name.endswith(MATRIX_SCORES_SUFFIX):
+                if key not in stored_scores:
+                    score_rows.append([refseq_id, enst_id, predictor, np.asarray(values[start:end], dtype=SCORE_DTYPE).tobytes()])
+            elif key not in stored_predictions:
+                sequences = unpack_windows(matrix.windows['seq'][start:end])
+                prediction_rows += [[refseq_id, enst_id, predictor, row, sequence, f"LABEL_{label_id}"]
+                                    for row, (sequence, label_id) in enumerate(zip(sequences, values[start:end].tolist()))]
+    return prediction_rows, score_rows
+
+def load_density(store_path, prefix=""):
+    """
+    Load the ESD records of one predictor.
+
+    Args:
+        store_path (str): Consolidated ESD store.
+        prefix (str): Predictor prefix, as given to aggregate_density_by_tissue.py --prefix.
+
+    Returns:
+        DataFrame: NCBI_RefSeqID, ENST_ID and the density.csv columns, with one row per
+            transcript in database directory order.
+    """
+    if not os.path.isfile(store_path):
+        raise FileNotFoundError(f"The ESD store {store_path} does not exist.")
+    connection = sqlite3.connect(store_path)
+    density_df = pd.read_sql_query(
+        f"SELECT refseq_id, enst_id, {', '.join(_DENSITY_FIELDS)} FROM density "
+        "WHERE predictor = ? ORDER BY refseq_id, enst_order",
+        connection,
+        params=(prefix,),
+    )
+    connection.close()
+    density_df.columns = ['NCBI_RefSeqID', 'ENST_ID'] + DENSITY_COLUMNS
+    return density_df
+
+def load_window_labels(store_path, prefix=""):
+    """
+    Load the windows of every transcript joined to one predictor's labels by row index.
+
+    Requires a store consolidated with include_windows.
+
+    Args:
+        store_path (str): Consolidated ESD store.
+        prefix (str): Predictor prefix.
+
+    Returns:
+        DataFrame: refseq_id, enst_id, effective, amino_acid_len and rel_amino_acid_pos,
+            one row per window.
+    """
+    if not os.path.isfile(store_path):
+        raise FileNotFoundError(f"The ESD store {store_path} does not exist.")
+    connection = sqlite3.connect(store_path)
+    windows_df = pd.read_sql_query(
+        "SELECT s.refseq_id, s.enst_id, p.pred = 'LABEL_1' AS effective, s.amino_acid_len, s.rel_amino_acid_pos "
+        "FROM substrates s JOIN predictions p "
+        "ON p.refseq_id = s.refseq_id AND p.enst_id = s.enst_id AND p.row = s.row AND p.predictor = ? "
+        "ORDER BY s.refseq_id, s.enst_id, s.row",
+        connection,
+        params=(prefix,),
+    )
+    connection.close()
+    windows_df['effective'] = windows_df['effective'].astype(bool)
+    return windows_df
+
+def load_window_scores(store_path, prefix=""):
+    """
+    Load the windows of every transcript with one predictor's LABEL_1 probabilities.
+
+    Transcripts stored without scores (motif and custom predictors) get their labels
+    as 0/1 scores. Requires a store consolidated with include_windows.
+
+    Args:
+        store_path (str): Consolidated ESD store.
+        prefix (str): Predictor prefix.
+
+    Returns:
+        DataFrame: refseq_id, enst_id, score, amino_acid_len and rel_amino_acid_pos,
+            one row per window.
+    """
+    windows_df = load_window_labels(store_path, prefix)
+    scores = windows_df.pop('effective').to_numpy(dtype=np.float64)
+    connection = sqlite3.connect(store_path)
+    stored_scores = {
+        (refseq_id, enst_id): blob for refseq_id, enst_id, blob in
+        connection.execute("SELECT refseq_id, enst_id, scores FROM scores WHERE predictor = ?", (prefix,))
+    }
+    connection.close()
+    if stored_scores:
+        for transcript, rows in windows_df.groupby(['refseq_id', 'enst_id'], sort=False).indices.items():
+            if transcript in stored_scores:
+                transcript_scores = np.frombuffer(stored_scores[transcript], dtype=SCORE_DTYPE)
+                if len(transcript_scores) != len(rows):
+                    raise ValueError(f"The scores of {'/'.join(transcript)} do not match its {len(rows)} windows.")
+                scores[rows] = transcript_scores
+    windows_df.insert(2, 'score', scores)
+    return windows_df
+
+def save_density(store_path, prefix, density_df):
+    """
+    Store the ESD records of one predictor calculated from the store's windows.
+
+    Args:
+        store_path (str): Consolidated ESD store.
+        prefix (str): Predictor prefix.
+        density_df (DataFrame): NCBI_RefSeqID, ENST_ID and DENSITY_COLUMNS.
+    """
+    connection = open_store(store_path)
+    rows = []
+    for values in density_df[['NCBI_RefSeqID', 'ENST_ID'] + DENSITY_COLUMNS].itertuples(index=False, name=None):
+        refseq_id, enst_id = values[:2]
+        fields = [None if pd.isna(value) else value_type(value) for value, value_type in zip(values[2:], _DENSITY_TYPES)]
+        # Keep the directory order already known from another predictor of the transcript
+        enst_order = connection.execute(
+            "SELECT MIN(enst_order) FROM density WHERE refseq_id = ? AND enst_id = ?", (refseq_id, enst_id)
+        ).fetchone()[0]
+        rows.append([refseq_id, enst_id, prefix, enst_order or 0] + fields)
+    connection.executemany("INSERT OR REPLACE INTO density VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+def remove_transcripts(store_path, transcripts):
+    """
+    Delete every row of the given transcripts, e.g. before a rebuilt database is consolidated again.
+
+    Args:
+        store_path (str): Consolidated ESD store.
+        transcripts (list): (RefSeq ID, ENST ID) tuples.
+    """
+    connection = open_store(store_path)
+    for table in ('density', 'substrates', 'predictions', 'scores'):
+        connection.executemany(f"DELETE FROM {table} WHERE refseq_id = ? AND enst_id = ?", transcripts)
+    connection.commit()
+    connection.close()
+
+def list_predictors(store_path):
+    """Return the predictor prefixes stored with their number of transcripts."""
+    connection = sqlite3.connect(store_path)
+    rows = connection.execute("SELECT predictor, COUNT(*) FROM density GROUP BY predictor ORDER BY predictor").fetchall()
+    connection.close()
+    return rows
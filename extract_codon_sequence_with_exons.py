@@ -1,39 +1,264 @@
-import requests
 from Bio.Seq import Seq
 from Bio.Data import CodonTable
 import argparse
+import asyncio
+import bisect
 import sys
 import os
 
+from rest_client import AsyncRestClient, RestClientError, ENSEMBL_REST_SERVER
+
 # 標準的なコドン表を取得
 codon_table = CodonTable.unambiguous_dna_by_id[1]
 
-def get_exon_info(transcript_id):
-    """Ensembl APIを使って指定されたトランスクリプトIDのエクソン情報を取得する"""
-    url = f"https://rest.ensembl.org/map/cds/{transcript_id}/1..99999999?content-type=application/json"
-    response = requests.get(url)
-    if response.status_code != 200:
-        print(f"Error: Unable to retrieve exon information for transcript ID {transcript_id}")
-        sys.exit(1)
+# Ensembl REST APIのPOSTで1リクエストに指定できるIDおよび領域の上限
+LOOKUP_POST_LIMIT = 1000
+SEQUENCE_POST_LIMIT = 50
 
-    exon_data = response.json()
+async def get_exon_info_async(client, transcript_id):
+    """Ensembl APIを使って指定されたトランスクリプトIDのエクソン情報を取得する（非同期版）"""
+    url = f"{ENSEMBL_REST_SERVER}/map/cds/{transcript_id}/1..99999999"
+    status, exon_data = await client.get_json(url)
+    if status != 200 or exon_data is None:
+        raise RestClientError(f"Unable to retrieve exon information for transcript ID {transcript_id}")
 
     if not exon_data['mappings']:
-        print(f"Error: No exon data found for transcript ID {transcript_id}")
-        sys.exit(1)
-    
+        raise RestClientError(f"No exon data found for transcript ID {transcript_id}")
+
     return exon_data['mappings']
 
+async def get_genomic_sequence_async(client, region):
+    """指定されたゲノム領域（例: 1:1000..2000:1）から配列を取得する（非同期版）"""
+    url = f"{ENSEMBL_REST_SERVER}/sequence/region/human/{region}"
+    status, sequence_data = await client.get_json(url)
+    if status != 200 or sequence_data is None:
+        raise RestClientError(f"Unable to retrieve sequence for region {region}")
+    return sequence_data['seq']
+
+def run_rest_call(fetch, *args, exit_on_error=True):
+    """非同期版の取得関数を1回だけ実行する。exit_on_errorの場合、失敗時は従来通りエラーを表示して終了する"""
+    async def run():
+        async with AsyncRestClient() as client:
+            return await fetch(client, *args)
+
+    try:
+        return asyncio.run(run())
+    except RestClientError as e:
+        if not exit_on_error:
+            raise
+        print(f"Error: {e}")
+        sys.exit(1)
+
+def get_exon_info(transcript_id):
+    """Ensembl APIを使って指定されたトランスクリプトIDのエクソン情報を取得する"""
+    return run_rest_call(get_exon_info_async, transcript_id)
+
 def get_genomic_sequence(region):
     """指定されたゲノム領域（例: 1:1000..2000:1）から配列を取得する"""
-    url = f"https://rest.ensembl.org/sequence/region/human/{region}?content-type=application/json"
-    response = requests.get(url)
-    if response.status_code != 200:
-        print(f"Error: Unable to retrieve sequence for region {region}")
-        sys.exit(1)
-    return response.json()['seq']
+    return run_rest_call(get_genomic_sequence_async, region)
+
+class PaddedExonSequences:
+    """
+    ゲノム配列をエクソンごとに前後paddingnt付きで一度だけ取得し、以降の領域はメモリ上から切り出す
+
+    get()はget_genomic_sequence()と同じ領域表記を受け取るため、そのまま置き換えられる。
+    コドン周辺の40nt配列は必ずエクソン±20ntの範囲に収まるため、トランスクリプトあたりの
+    リクエスト数はコドン数ではなくエクソン数に比例する。
+    """
+
+    def __init__(self, fetch_sequence=get_genomic_sequence, padding=20):
+        self.fetch_sequence = fetch_sequence
+        self.padding = padding
+        self.segments = []  # (chrom, start, forward-strand sequence)
+
+    def _slice(self, chrom, start, end):
+        for seg_chrom, seg_start, seg_sequence in self.segments:
+            if seg_chrom == chrom and seg_start <= start and end < seg_start + len(seg_sequence):
+                return seg_sequence[start - seg_start:end - seg_start + 1]
+        return None
 
-def extract_cds_from_exons(exon_data, log_file):
+    def padded_region(self, chrom, start, end):
+        """エクソンを前後paddingnt広げた順鎖の領域表記を返す"""
+        return f"{chrom}:{max(1, start - self.padding)}..{end + self.padding}:1"
+
+    def add(self, padded_region, padded_sequence):
+        """padded_region()の領域について取得済みの配列を登録する"""
+        chrom, coordinates, _ = padded_region.rsplit(':', 2)
+        self.segments.append((chrom, int(coordinates.split('..')[0]), padded_sequence))
+
+    def get(self, region):
+        """指定されたゲノム領域（例: 1:1000..2000:1）の配列を返す"""
+        chrom, coordinates, strand = region.rsplit(':', 2)
+        start, end = (int(x) for x in coordinates.split('..'))
+
+        sequence = self._slice(chrom, start, end)
+        if sequence is None:
+            padded_region = self.padded_region(chrom, start, end)
+            self.add(padded_region, self.fetch_sequence(padded_region))
+            sequence = self._slice(chrom, start, end)
+            if sequence is None:
+                # 染色体末端で切り詰められた場合は従来通り直接取得する
+                return self.fetch_sequence(region)
+
+        if int(strand) == -1:
+            sequence = str(Seq(sequence).reverse_complement())
+        return sequence
+
+async def fetch_transcript_async(client, transcript_id, padded_sequences):
+    """
+    エクソン情報を取得し、全エクソンの前後padding付き配列を1つの接続プール上で並行して取得する
+
+    取得した配列はpadded_sequencesに登録され、以降のエクソン・コドン周辺配列の取得は
+    メモリ上からの切り出しになる。
+    """
+    exon_data = await get_exon_info_async(client, transcript_id)
+    padded_regions = list(dict.fromkeys(
+        padded_sequences.padded_region(exon['seq_region_name'], exon['start'], exon['end']) for exon in exon_data
+    ))
+    sequences = await asyncio.gather(*(get_genomic_sequence_async(client, region) for region in padded_regions))
+    for region, sequence in zip(padded_regions, sequences):
+        padded_sequences.add(region, sequence)
+    return exon_data
+
+def cds_mappings_from_lookup(transcript):
+    """lookup/id（expand=1）のトランスクリプト情報から、map/cdsと同じ形式のCDS領域を作る"""
+    translation = transcript.get('Translation')
+    if not translation:
+        return []
+
+    # 翻訳領域（終止コドンを含む）と重なる部分だけをエクソンから切り出す
+    mappings = []
+    for exon in transcript['Exon']:
+        start = max(exon['start'], translation['start'])
+        end = min(exon['end'], translation['end'])
+        if start <= end:
+            mappings.append({'seq_region_name': exon['seq_region_name'], 'start': start, 'end': end, 'strand': exon['strand']})
+    return mappings
+
+async def lookup_exon_info_async(client, transcript_ids):
+    """POST lookup/idで複数トランスクリプトのCDS領域をまとめて取得する。取得できなかったIDは空リストになる"""
+    exon_info = {}
+    for i in range(0, len(transcript_ids), LOOKUP_POST_LIMIT):
+        chunk = transcript_ids[i:i + LOOKUP_POST_LIMIT]
+        status, data = await client.post_json(f"{ENSEMBL_REST_SERVER}/lookup/id", {'ids': chunk, 'expand': 1})
+        if status != 200 or data is None:
+            raise RestClientError(f"Unable to look up transcripts {chunk[0]}..{chunk[-1]}")
+        for transcript_id in chunk:
+            transcript = data.get(transcript_id)
+            exon_info[transcript_id] = cds_mappings_from_lookup(transcript) if transcript else []
+    return exon_info
+
+async def get_genomic_sequences_async(client, regions):
+    """POST sequence/regionで最大50領域ずつ並行して配列を取得し、{領域: 配列}を返す"""
+    async def fetch(chunk):
+        status, data = await client.post_json(f"{ENSEMBL_REST_SERVER}/sequence/region/human", {'regions': chunk})
+        if status != 200 or data is None:
+            raise RestClientError(f"Unable to retrieve sequences for regions {chunk[0]}..{chunk[-1]}")
+        return data
+
+    chunks = [regions[i:i + SEQUENCE_POST_LIMIT] for i in range(0, len(regions), SEQUENCE_POST_LIMIT)]
+    sequences = {}
+    for data in await asyncio.gather(*(fetch(chunk) for chunk in chunks)):
+        for entry in data:
+            sequences[entry['query']] = entry['seq']
+    return sequences
+
+async def fetch_transcripts_batch_async(client, transcript_ids, padding=20):
+    """
+    複数トランスクリプトのCDS領域と前後padding付きエクソン配列を、バッチ化したPOSTでまとめて取得する
+
+    Returns:
+        dict: {トランスクリプトID: (エクソン情報, PaddedExonSequences)}
+    """
+    exon_info = await lookup_exon_info_async(client, transcript_ids)
+
+    # 応答に無い領域の個別取得が失敗しても、バッチ全体は終了させない
+    fetch_sequence = lambda region: run_rest_call(get_genomic_sequence_async, region, exit_on_error=False)
+    padded = {transcript_id: PaddedExonSequences(fetch_sequence, padding) for transcript_id in transcript_ids}
+    transcript_regions = {
+        transcript_id: [
+            padded[transcript_id].padded_region(exon['seq_region_name'], exon['start'], exon['end'])
+            for exon in exon_info[transcript_id]
+        ]
+        for transcript_id in transcript_ids
+    }
+    regions = list(dict.fromkeys(region for regions in transcript_regions.values() for region in regions))
+    sequences = await get_genomic_sequences_async(client, regions)
+
+    # 応答を各トランスクリプトに振り分ける（応答に無い領域はget()が個別に取得する）
+    for transcript_id, regions in transcript_regions.items():
+        for region in regions:
+            if region in sequences:
+                padded[transcript_id].add(region, sequences[region])
+    return {transcript_id: (exon_info[transcript_id], padded[transcript_id]) for transcript_id in transcript_ids}
+
+def extract_transcripts_batch(jobs):
+    """
+    複数トランスクリプトの基質配列をまとめて取得し、それぞれの出力ディレクトリに書き出す
+
+    Args:
+        jobs (list): (Ensembl transcript ID, 出力ディレクトリ) のリスト
+    """
+    transcript_ids = list(dict.fromkeys(transcript_id for transcript_id, _ in jobs))
+
+    async def run():
+        async with AsyncRestClient() as client:
+            return await fetch_transcripts_batch_async(client, transcript_ids)
+
+    transcripts = asyncio.run(run())
+
+    for transcript_id, output_dir in jobs:
+        exon_data, padded_sequences = transcripts[transcript_id]
+        write_transcript(transcript_id, output_dir, exon_data, padded_sequences.get)
+
+def extract_transcripts_local(jobs, local_genome):
+    """
+    ローカルのGTF・ゲノムFASTAから複数トランスクリプトの基質配列を書き出す
+
+    Args:
+        jobs (list): (Ensembl transcript ID, 出力ディレクトリ) のリスト
+        local_genome (LocalGenome): インデックス済みのGTF・ゲノムFASTA
+    """
+    for transcript_id, output_dir in jobs:
+        try:
+            exon_data = local_genome.get_cds_mappings(transcript_id)
+        except Exception as e:
+            print(f"Error: {transcript_id}: {e}")
+            continue
+        padded_sequences = PaddedExonSequences(local_genome.get_genomic_sequence)
+        write_transcript(transcript_id, output_dir, exon_data, padded_sequences.get)
+
+def write_transcript(transcript_id, output_dir, exon_data, fetch_sequence):
+    """
+    1トランスクリプトの基質配列を出力ディレクトリに書き出す
+
+    取得に失敗したトランスクリプト（REST APIのエラー、FASTAに無い染色体など）はエラーを表示して
+    空のtarget.csvを残し、他のトランスクリプトの処理は続ける
+
+    Returns:
+        bool: 書き出せた場合True
+    """
+    log_file, flanking_file, table_file = open_output_files(output_dir)
+    failed = False
+    try:
+        if exon_data:
+            write_substrates(exon_data, fetch_sequence, log_file, flanking_file, table_file)
+        else:
+            # map/cdsと同様、CDSを持たないトランスクリプトは空のtarget.csvを残す
+            print(f"Error: Unable to retrieve exon information for transcript ID {transcript_id}")
+    except Exception as e:
+        print(f"Error: {transcript_id}: {e}")
+        failed = True
+    finally:
+        log_file.close()
+        flanking_file.close()
+        table_file.close()
+    if failed:
+        # 途中まで書いたtarget.csvを空にし、再実行時に取得し直させる
+        open(os.path.join(output_dir, "target.csv"), "w").close()
+    return not failed
+
+def extract_cds_from_exons(exon_data, log_file, fetch_sequence=get_genomic_sequence):
     """エクソン情報をもとにゲノム配列からCDS配列を構築する"""
     strand = exon_data[0]['strand']
     sorted_exons = sorted(exon_data, key=lambda x: x['start'], reverse=(strand == -1))
@@ -49,7 +274,7 @@ def extract_cds_from_exons(exon_data, log_file):
         exon_number += 1
         
         region = f"{chrom}:{start}..{end}:{strand}"
-        exon_sequence = get_genomic_sequence(region)
+        exon_sequence = fetch_sequence(region)
         exon_regions.append((chrom, start, end, strand))
 
         # エクソン座標と配列をログに書き込む
@@ -60,28 +285,38 @@ def extract_cds_from_exons(exon_data, log_file):
     
     return cds_sequence, exon_regions
 
-def map_residue_to_genomic_position(residue_position, exon_regions):
+def build_cds_offsets(exon_regions):
+    """各エクソン末端までの累積CDS長のリストを作成する"""
+    cds_offsets = []
+    current_cds_position = 0
+    for chrom, start, end, strand in exon_regions:
+        current_cds_position += end - start + 1
+        cds_offsets.append(current_cds_position)
+    return cds_offsets
+
+def map_residue_to_genomic_position(residue_position, exon_regions, cds_offsets=None):
     """アミノ酸の位置をエクソンのゲノム座標にマッピングする"""
+    if cds_offsets is None:
+        cds_offsets = build_cds_offsets(exon_regions)
     codon_start_in_cds = residue_position * 3
-    current_cds_position = 0
 
-    for chrom, start, end, strand in exon_regions:
-        exon_length = end - start + 1
-        if current_cds_position + exon_length >= codon_start_in_cds + 3:
-            codon_start_in_exon = codon_start_in_cds - current_cds_position
-            genomic_start = start + codon_start_in_exon
-            genomic_end = genomic_start + 2  # コドンは3塩基
-
-            if strand == -1:
-                genomic_start, genomic_end = end - codon_start_in_exon - 2, end - codon_start_in_exon
-            
-            return chrom, genomic_start, genomic_end, strand
+    # コドン末端を含む最初のエクソンを二分探索で求める
+    exon_index = bisect.bisect_left(cds_offsets, codon_start_in_cds + 3)
+    if exon_index == len(exon_regions):
+        raise ValueError("Residue position out of range for the provided exon regions")
 
-        current_cds_position += exon_length
+    chrom, start, end, strand = exon_regions[exon_index]
+    current_cds_position = cds_offsets[exon_index] - (end - start + 1)
+    codon_start_in_exon = codon_start_in_cds - current_cds_position
+    genomic_start = start + codon_start_in_exon
+    genomic_end = genomic_start + 2  # コドンは3塩基
 
-    raise ValueError("Residue position out of range for the provided exon regions")
+    if strand == -1:
+        genomic_start, genomic_end = end - codon_start_in_exon - 2, end - codon_start_in_exon
+    
+    return chrom, genomic_start, genomic_end, strand
 
-def get_flanking_sequence(chrom, codon_start, codon, strand):
+def get_flanking_sequence(chrom, codon_start, codon, strand, fetch_sequence=get_genomic_sequence):
     """指定されたゲノム領域の前後20ntの配列を取得し、左から数えて21番目にコドン内のCが来るように調整"""
     c_position_in_codon = codon.find('C')
     
@@ -98,7 +333,7 @@ def get_flanking_sequence(chrom, codon_start, codon, strand):
         flanking_end = c_position_in_genome + 20
     
     region = f"{chrom}:{flanking_start}..{flanking_end}:{strand}"
-    flanking_sequence = get_genomic_sequence(region)
+    flanking_sequence = fetch_sequence(region)
 
     return flanking_sequence
 
@@ -112,29 +347,25 @@ def codon_changes_amino_acid(codon, onlystop=False):
     else:
       return (codon in ["CAA", "CAG", "CGA"])
 
-def main():
-    parser = argparse.ArgumentParser(description='Extract codon and surrounding sequence for residues where C->T mutation affects amino acid.')
-    parser.add_argument('transcript_id', type=str, help='Ensembl Transcript ID (e.g., ENST00000357654)')
-    parser.add_argument('output_dir', type=str, help='Output directory for result files')
-    
-    args = parser.parse_args()
-
+def open_output_files(output_dir):
+    """出力ディレクトリを作成し、log.txt・target.csv・table.csvを開く（table.csvにはヘッダを書き込む）"""
     # ディレクトリ作成
-    os.makedirs(args.output_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
 
     # ファイルハンドルを開く
-    log_file = open(os.path.join(args.output_dir, "log.txt"), "w")
-    flanking_file = open(os.path.join(args.output_dir, "target.csv"), "w")
-    table_file = open(os.path.join(args.output_dir, "table.csv"), "w")
+    log_file = open(os.path.join(output_dir, "log.txt"), "w")
+    flanking_file = open(os.path.join(output_dir, "target.csv"), "w")
+    table_file = open(os.path.join(output_dir, "table.csv"), "w")
 
     # ヘッダを書き込む
     table_file.write("flanking_sequence,amino_acid,codon,pos,amino_acid_len,rel_amino_acid_pos\n")
+    return log_file, flanking_file, table_file
 
-    # エクソン情報を取得
-    exon_data = get_exon_info(args.transcript_id)
-
+def write_substrates(exon_data, fetch_sequence, log_file, flanking_file, table_file):
+    """エクソン情報からCDSを構築し、C->T変換でアミノ酸が変わるコドンの周辺配列を書き出す"""
     # ゲノム配列からエクソン情報を基にCDS配列を構築
-    cds_sequence, exon_regions = extract_cds_from_exons(exon_data, log_file)
+    cds_sequence, exon_regions = extract_cds_from_exons(exon_data, log_file, fetch_sequence)
+    cds_offsets = build_cds_offsets(exon_regions)
 
     # CDS配列を翻訳してアミノ酸配列を確認
     log_file.write(f"Merged CDS sequence: {cds_sequence}\n")
@@ -151,9 +382,9 @@ def main():
         if 'C' in codon and codon_changes_amino_acid(codon, onlystop=True):
             log_file.write(f"\nResidue at position {int(pos + 1)} ({amino_acid_sequence[pos]}) with codon {codon} is affected by C->T mutation:\n")
 
-            chrom, genomic_start, genomic_end, strand = map_residue_to_genomic_position(pos, exon_regions)
+            chrom, genomic_start, genomic_end, strand = map_residue_to_genomic_position(pos, exon_regions, cds_offsets)
 
-            flanking_sequence = get_flanking_sequence(chrom, genomic_start, codon, strand)
+            flanking_sequence = get_flanking_sequence(chrom, genomic_start, codon, strand, fetch_sequence)
             
             if flanking_sequence:
                 log_file.write(f"Genomic coordinates for substrate sequence: {chrom}:{genomic_start}..{genomic_end} (strand: {strand})\n")
@@ -166,6 +397,40 @@ def main():
 
                 table_file.write(f"{flanking_sequence},{amino_acid_sequence[pos]},{codon},{pos},{amino_acid_len},{rel_amino_acid_pos}\n")
 
+def main():
+    parser = argparse.ArgumentParser(description='Extract codon and surrounding sequence for residues where C->T mutation affects amino acid.')
+    parser.add_argument('transcript_id', type=str, help='Ensembl Transcript ID (e.g., ENST00000357654)')
+    parser.add_argument('output_dir', type=str, help='Output directory for result files')
+    parser.add_argument('--gtf', type=str, default=None, help='Local Ensembl GTF file (use with --genome instead of the REST API)')
+    parser.add_argument('--genome', type=str, default=None, help='Local genome FASTA indexed with samtools faidx (use with --gtf)')
+    
+    args = parser.parse_args()
+
+    # Ensembl REST APIか、ローカルのGTF・ゲノムFASTAのどちらから取得するかを選択
+    if (args.gtf is None) != (args.genome is None):
+        parser.error("--gtf and --genome must be given together")
+    # エクソンごとに前後20nt付きで一度だけ取得し、コドン周辺配列はメモリ上から切り出す
+    if args.gtf is not None:
+        from local_genome import LocalGenome
+        local_genome = LocalGenome(args.gtf, args.genome)
+        padded_sequences = PaddedExonSequences(local_genome.get_genomic_sequence)
+        fetch_exon_info = local_genome.get_exon_info
+    else:
+        padded_sequences = PaddedExonSequences(get_genomic_sequence)
+
+        def fetch_exon_info(transcript_id):
+            # エクソン情報と全エクソン配列を1つの接続プール上で並行して取得する
+            return run_rest_call(fetch_transcript_async, transcript_id, padded_sequences)
+    fetch_sequence = padded_sequences.get
+
+    # 出力ファイルを開く
+    log_file, flanking_file, table_file = open_output_files(args.output_dir)
+
+    # エクソン情報を取得
+    exon_data = fetch_exon_info(args.transcript_id)
+
+    write_substrates(exon_data, fetch_sequence, log_file, flanking_file, table_file)
+
     log_file.close()
     flanking_file.close()
     table_file.close()
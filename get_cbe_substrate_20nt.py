@@ -1,66 +1,159 @@
 #!/usr/bin/env python3
-import regex as re
 import sys
-import csv
 import os
+import argparse
+
+import numpy as np
 
 __authors__ = ["Kazuki Nakamae"]
-__version__ = "1.0.0"
+__version__ = "1.1.0"
 
-def get_cbe_substrate_20nt(cdna_seq, output_fn):
-    def extract_context(text):
-        # パターンの前後20文字を抜き出す正規表現
-        patt = re.compile(r"[ATCG]{20}C[ATCG]{19}")
-        return patt.findall(text, overlapped=True)
+# CBE substrate: NNNNNNNNNNNNNNNNNNNNCNNNNNNNNNNNNNNNNNNN (target C at index 20)
+WINDOW_LENGTH = 40
+TARGET_INDEX = 20
+# Sequence read at a time; memory use does not depend on the record length
+BLOCK_SIZE = 1 << 20
 
-    text = cdna_seq.upper()
-    results = extract_context(text)
+_VALID_BASES = np.zeros(256, dtype=bool)
+_VALID_BASES[np.frombuffer(b"ACGT", dtype=np.uint8)] = True
+_WHITESPACE = b" \t\r\n"
 
-    data = [{"sequence": result} for result in results]
+def read_fasta(handle, block_size=BLOCK_SIZE):
+    """
+    Stream the records of a FASTA file (or of a bare sequence without header).
 
-    field_names = ["sequence"]
-    with open(output_fn, "w") as output_file:
-        writer = csv.DictWriter(output_file, fieldnames=field_names, delimiter=',')
-        # writer.writeheader()
-        writer.writerows(data)
+    Args:
+        handle: Binary file object.
+        block_size (int): Maximum number of bytes read at a time.
 
-    sys.exit(0)
+    Yields:
+        tuple: (record ID, None) at the start of every record, then (record ID, chunk)
+            with uppercase sequence bytes without line breaks.
+    """
+    record_id = None
+    at_line_start = True
+    while True:
+        line = handle.readline(block_size)
+        if not line:
+            break
+        if at_line_start and line.startswith(b">"):
+            header = line
+            # Read the rest of a header longer than block_size
+            while not header.endswith(b"\n"):
+                rest = handle.readline(block_size)
+                if not rest:
+                    break
+                header += rest
+            fields = header[1:].split()
+            record_id = fields[0].decode() if fields else ""
+            yield record_id, None
+            at_line_start = True
+            continue
+        at_line_start = line.endswith(b"\n")
+        chunk = line.translate(None, _WHITESPACE).upper()
+        if not chunk:
+            continue
+        if record_id is None:
+            # A file without header is one record
+            record_id = "sequence"
+            yield record_id, None
+        yield record_id, chunk
 
-def print_usage():
-    print(f"Usage: {sys.argv[0]} <cDNA sequence file> <output csv filename>")
-    print("Options:")
-    print("  -h, --help    Show this help message and exit")
-    print("  -v, --version Show version information and exit")
+def find_substrates(buffer):
+    """
+    Find the CBE substrate windows of a sequence.
 
-def print_version():
-    print(f"{sys.argv[0]} version {__version__}")
-    print("Authors:", ", ".join(__authors__))
+    A window is 40 nt of A/C/G/T with C at index 20; overlapping windows are all reported.
 
-if __name__ == "__main__":
-    if len(sys.argv) == 2 and sys.argv[1] in ("-h", "--help"):
-        print_usage()
-        sys.exit(0)
-    
-    if len(sys.argv) == 2 and sys.argv[1] in ("-v", "--version"):
-        print_version()
-        sys.exit(0)
-    
-    if len(sys.argv) != 3:
-        print_usage()
-        sys.exit(1)
+    Args:
+        buffer (bytes): Uppercase sequence.
+
+    Returns:
+        ndarray: Start position of every window.
+    """
+    window_num = len(buffer) - WINDOW_LENGTH + 1
+    if window_num <= 0:
+        return np.zeros(0, dtype=np.int64)
+    sequence = np.frombuffer(buffer, dtype=np.uint8)
+    invalid_num = np.concatenate(([0], np.cumsum(~_VALID_BASES[sequence])))
+    valid = invalid_num[WINDOW_LENGTH:] == invalid_num[:window_num]
+    target_c = sequence[TARGET_INDEX:TARGET_INDEX + window_num] == ord("C")
+    return np.flatnonzero(valid & target_c)
+
+def record_file_name(record_id):
+    """Output file name of a record in split mode."""
+    return record_id.replace(os.sep, "_") + ".csv"
+
+def get_cbe_substrate_20nt(input_handle, output_fn, with_id=False, split=False, block_size=BLOCK_SIZE):
+    """
+    Write the CBE substrate windows of every FASTA record as they are found.
 
-    cdna_file = sys.argv[1]
-    output_fn = sys.argv[2]
+    Only the last 39 nt of the current record are kept between blocks, so a whole
+    transcriptome or a full-length pre-mRNA is scanned in constant memory.
 
-    if not os.path.isfile(cdna_file):
-        print(f"Error: The file {cdna_file} does not exist.")
+    Args:
+        input_handle: Binary file object with FASTA records or a bare sequence.
+        output_fn (str): Output CSV file, or output directory if split.
+        with_id (bool): Prefix every window with its record ID.
+        split (bool): Write one <record ID>.csv per record into output_fn.
+        block_size (int): Maximum number of bytes read at a time.
+
+    Returns:
+        tuple: (number of records, number of windows)
+    """
+    record_num = 0
+    window_num = 0
+    carry = b""
+    output_file = None
+    if split:
+        os.makedirs(output_fn, exist_ok=True)
+    else:
+        output_file = open(output_fn, "w", newline="")
+    try:
+        for record_id, chunk in read_fasta(input_handle, block_size):
+            if chunk is None:
+                record_num += 1
+                carry = b""
+                if split:
+                    if output_file is not None:
+                        output_file.close()
+                    output_file = open(os.path.join(output_fn, record_file_name(record_id)), "w", newline="")
+                continue
+            buffer = carry + chunk
+            # Windows crossing the block boundary start in the carried 39 nt and were not reported yet
+            starts = find_substrates(buffer)
+            if len(starts):
+                line_prefix = f"{record_id}," if with_id else ""
+                output_file.write("".join(
+                    f"{line_prefix}{buffer[start:start + WINDOW_LENGTH].decode()}\r\n" for start in starts.tolist()
+                ))
+                window_num += len(starts)
+            carry = buffer[-(WINDOW_LENGTH - 1):]
+    finally:
+        if output_file is not None:
+            output_file.close()
+    return record_num, window_num
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract CBE substrate windows (20 nt + C + 19 nt) from FASTA records.")
+    parser.add_argument("input", help="FASTA file or bare sequence file ('-' reads stdin)")
+    parser.add_argument("output", help="Output CSV file (a directory with --split)")
+    parser.add_argument("--with_id", action="store_true", help="Add the record ID as the first column")
+    parser.add_argument("--split", action="store_true", help="Write one <record ID>.csv per record into the output directory")
+    parser.add_argument("-v", "--version", action="version", version=f"%(prog)s version {__version__}\nAuthors: {', '.join(__authors__)}")
+    args = parser.parse_args()
+
+    if args.input != "-" and not os.path.isfile(args.input):
+        print(f"Error: The file {args.input} does not exist.")
         sys.exit(1)
 
     try:
-        with open(cdna_file, 'r') as file:
-            cdna_seq = file.read()
+        if args.input == "-":
+            get_cbe_substrate_20nt(sys.stdin.buffer, args.output, args.with_id, args.split)
+        else:
+            with open(args.input, "rb") as input_handle:
+                get_cbe_substrate_20nt(input_handle, args.output, args.with_id, args.split)
     except Exception as e:
-        print(f"Error reading the file {cdna_file}: {e}")
+        print(f"Error reading the file {args.input}: {e}")
         sys.exit(1)
-
-    get_cbe_substrate_20nt(cdna_seq, output_fn)
+    sys.exit(0)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import os
+import multiprocessing
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# Target files handed to a worker at a time; also the unit of resume
+DEFAULT_SHARD_SIZE = 200
+
+# Predictor loaded once by every worker process (see _init_worker), or the error raised while loading it
+_predict_files = None
+_init_error = None
+
+def available_cpus():
+    """Return the CPU cores this process may run on, in ascending order."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+def worker_cpu_sets(workers, threads=None):
+    """
+    Split the available cores into one disjoint set per worker.
+
+    Args:
+        workers (int): Number of worker processes.
+        threads (int): Cores (intra-op threads) per worker. Defaults to an even split.
+
+    Returns:
+        list: One list of core IDs per worker. Sets wrap around (and share cores)
+            only when workers * threads exceeds the available cores.
+    """
+    cpus = available_cpus()
+    if threads is None:
+        threads = max(1, len(cpus) // workers)
+    if workers * threads > len(cpus):
+        print(f"Warning: {workers} workers x {threads} threads exceed the {len(cpus)} available cores.")
+    return [[cpus[(worker * threads + i) % len(cpus)] for i in range(threads)] for worker in range(workers)]
+
+def shard_target_dirs(target_dirs, shard_size=DEFAULT_SHARD_SIZE):
+    """Cut the sorted target directories of a database into fixed, reproducible shards."""
+    return [target_dirs[start:start + shard_size] for start in range(0, len(target_dirs), shard_size)]
+
+def _init_worker(cpu_sets, worker_counter, predictor, model_dir, batch_size, cache_path, backend):
+    # Pin this worker to its own cores before torch starts its thread pool.
+    # Workers restarted by the pool cycle through the same core sets.
+    global _predict_files, _init_error
+    with worker_counter.get_lock():
+        cpus = cpu_sets[worker_counter.value % len(cpu_sets)]
+        worker_counter.value += 1
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[variable] = str(len(cpus))
+
+    try:
+        from protectio import import_predictor, load_predictor
+
+        module = import_predictor(predictor)
+        if model_dir is not None or hasattr(module, 'MODEL_DIR'):
+            import torch
+            # One process per core set: no inter-op pool competing with the other workers
+            torch.set_num_interop_threads(1)
+        _predict_files = load_predictor(module, model_dir, batch_size, len(cpus), cache_path, backend)
+    except (Exception, SystemExit) as e:
+        # An initializer that raises is restarted by the pool forever; report it with every job of the shards instead
+        _init_error = f"Worker could not load {predictor}: {type(e).__name__}: {e}"
+
+def _predict_shard(shard):
+    shard_id, jobs = shard
+    if _init_error is not None:
+        # Failed like any other job, so the remaining shards run and the run can be resumed
+        return shard_id, [(target_file, None, _init_error) for target_file, _ in jobs]
+    results = []
+    for target_file, eval_res, error in _predict_files(jobs):
+        results.append((target_file, eval_res, None if error is None else f"{type(error).__name__}: {error}"))
+    return shard_id, results
+
+def predict_shards(shards, predictor, workers, threads=None, model_dir=None, batch_size=None, cache_path=None, backend='fp32'):
+    """
+    Evaluate shards of target files in pinned worker processes.
+
+    Every worker loads the predictor once, is pinned to its own set of cores with
+    threads intra-op threads, and takes the next shard from a shared queue, so fast
+    workers are never left idle behind a shard of long transcripts. Each eval_res.csv
+    is written by the worker that predicted it; the caller merges the results.
+
+    Args:
+        shards (list): (shard ID, list of (target file, eval_res file)) tuples.
+        predictor (str): Predictor script (module name or path).
+        workers (int): Number of worker processes.
+        threads (int): Cores and intra-op threads per worker (default: an even split).
+        model_dir (str): DNABERT-2 model directory overriding the predictor's MODEL_DIR.
+        batch_size (int): DNABERT-2 windows per forward pass.
+        cache_path (str): DNABERT-2 prediction cache shared by all workers.
+        backend (str): DNABERT-2 inference backend (fp32, int8 or onnx; see model_export.py).
+
+    Yields:
+        tuple: (shard ID, list of (target file, eval_res file, error message or None)),
+            in the order the shards finish.
+    """
+    workers = min(workers, len(shards))
+    if workers == 0:
+        return
+    # Workers start from a fresh interpreter so no torch thread pool is inherited
+    context = multiprocessing.get_context('spawn')
+    worker_counter = context.Value('i', 0)
+    initargs = (worker_cpu_sets(workers, threads), worker_counter, predictor, model_dir, batch_size, cache_path, backend)
+    with context.Pool(workers, _init_worker, initargs) as pool:
+        yield from pool.imap_unordered(_predict_shard, shards)
+        pool.close()
+        pool.join()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import gzip
+import sqlite3
+import argparse
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+_COMPLEMENT = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+
+def reverse_complement(sequence):
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+def _open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+def _strip_version(transcript_id):
+    return transcript_id.split('.')[0]
+
+def build_cds_index(gtf_file, index_file):
+    """
+    Build an SQLite index of the coding segments of every transcript in a GTF file.
+
+    CDS and stop_codon features are stored together, because the Ensembl REST
+    endpoint map/cds also includes the stop codon in the CDS.
+
+    Args:
+        gtf_file (str): Ensembl/GENCODE GTF file (optionally gzipped).
+        index_file (str): Path to the SQLite index to create.
+    """
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    connection = sqlite3.connect(tmp_file)
+    connection.execute("CREATE TABLE cds (transcript_id TEXT, chrom TEXT, start INTEGER, end INTEGER, strand INTEGER)")
+
+    rows = []
+    with _open_text(gtf_file) as gtf:
+        for line in gtf:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9 or fields[2] not in ('CDS', 'stop_codon'):
+                continue
+            attributes = fields[8]
+            key = 'transcript_id "'
+            start = attributes.find(key)
+            if start == -1:
+                continue
+            start += len(key)
+            transcript_id = _strip_version(attributes[start:attributes.index('"', start)])
+            strand = 1 if fields[6] == '+' else -1
+            rows.append((transcript_id, fields[0], int(fields[3]), int(fields[4]), strand))
+            if len(rows) >= 100000:
+                connection.executemany("INSERT INTO cds VALUES (?, ?, ?, ?, ?)", rows)
+                rows = []
+    connection.executemany("INSERT INTO cds VALUES (?, ?, ?, ?, ?)", rows)
+    connection.execute("CREATE INDEX cds_transcript ON cds (transcript_id)")
+    connection.commit()
+    connection.close()
+    os.replace(tmp_file, index_file)
+
+class FastaIndex:
+    """
+    Random access to an indexed genome FASTA.
+
+    Plain FASTA files are read through their samtools-compatible .fai index, which is
+    created on first use if missing. bgzip-compressed FASTA files need pysam.
+    """
+
+    def __init__(self, fasta_file):
+        self.fasta_file = fasta_file
+        self.pysam_fasta = None
+        self.index = {}
+
+        if fasta_file.endswith('.gz'):
+            try:
+                import pysam
+            except ImportError:
+                print("Error: Reading a bgzip-compressed genome requires pysam (conda install -c bioconda pysam).")
+                sys.exit(1)
+            self.pysam_fasta = pysam.FastaFile(fasta_file)
+            self.names = set(self.pysam_fasta.references)
+            return
+
+        fai_file = fasta_file + '.fai'
+        if not os.path.isfile(fai_file):
+            self.build_fai(fasta_file, fai_file)
+        with open(fai_file, 'r') as fai:
+            for line in fai:
+                name, length, offset, line_bases, line_width = line.split('\t')[:5]
+                self.index[name] = (int(length), int(offset), int(line_bases), int(line_width))
+        self.names = set(self.index)
+        self.handle = open(fasta_file, 'rb')
+
+    @staticmethod
+    def build_fai(fasta_file, fai_file):
+        """Write a samtools-compatible .fai index for a plain FASTA file."""
+        entries = []
+        with open(fasta_file, 'rb') as fasta:
+            offset = 0
+            entry = None
+            for line in fasta:
+                if line.startswith(b'>'):
+                    if entry is not None:
+                        entries.append(entry)
+                    name = line[1:].split()[0].decode()
+                    entry = [name, 0, offset + len(line), 0, 0]
+                elif entry is not None and line.strip():
+                    if entry[3] == 0:
+                        entry[3] = len(line.rstrip(b'\r\n'))
+                        entry[4] = len(line)
+                    entry[1] += len(line.rstrip(b'\r\n'))
+                offset += len(line)
+            if entry is not None:
+                entries.append(entry)
+        with open(fai_file, 'w') as fai:
+            for entry in entries:
+                fai.write('\t'.join(str(x) for x in entry) + '\n')
+
+    def resolve(self, chrom):
+        """Match Ensembl ('1') and UCSC ('chr1') style chromosome names."""
+        if chrom in self.names:
+            return chrom
+        if 'chr' + chrom in self.names:
+            return 'chr' + chrom
+        if chrom.startswith('chr') and chrom[3:] in self.names:
+            return chrom[3:]
+        raise KeyError(f"Sequence {chrom} not found in {self.fasta_file}")
+
+    def fetch(self, chrom, start, end):
+        """
+        Return the forward-strand sequence of chrom:start..end (1-based, inclusive).
+        """
+        chrom = self.resolve(chrom)
+        if self.pysam_fasta is not None:
+            return self.pysam_fasta.fetch(chrom, start - 1, end).upper()
+
+        length, offset, line_bases, line_width = self.index[chrom]
+        start = max(1, start)
+        end = min(length, end)
+        if end < start:
+            return ""
+        first = offset + (start - 1) // line_bases * line_width + (start - 1) % line_bases
+        last = offset + (end - 1) // line_bases * line_width + (end - 1) % line_bases
+        self.handle.seek(first)
+        raw = self.handle.read(last - first + 1)
+        return raw.replace(b'\n', b'').replace(b'\r', b'').decode().upper()
+
+class LocalGenome:
+    """
+    Offline replacement for the Ensembl REST calls used by extract_codon_sequence_with_exons.py.
+
+    get_exon_info and get_genomic_sequence return the same structures as their REST
+    counterparts, so target.csv, table.csv and log.txt are identical.
+    """
+
+    def __init__(self, gtf_file, fasta_file):
+        index_file = gtf_file + '.cds.sqlite'
+        if not os.path.isfile(index_file):
+            print(f"Indexing CDS features of {gtf_file}...")
+            build_cds_index(gtf_file, index_file)
+        self.connection = sqlite3.connect(index_file)
+        self.fasta = FastaIndex(fasta_file)
+
+    def get_exon_info(self, transcript_id):
+        """Return the CDS segments of a transcript like Ensembl REST map/cds."""
+        mappings = self.get_cds_mappings(transcript_id)
+        if not mappings:
+            print(f"Error: Unable to retrieve exon information for transcript ID {transcript_id}")
+            sys.exit(1)
+        return mappings
+
+    def get_cds_mappings(self, transcript_id):
+        """Return the CDS segments of a transcript, or an empty list if it has none."""
+        rows = self.connection.execute(
+            "SELECT chrom, start, end, strand FROM cds WHERE transcript_id = ? ORDER BY start",
+            (_strip_version(transcript_id),),
+        ).fetchall()
+
+        # A stop codon next to the last CDS feature (or split by an intron) is merged
+        # into the neighbouring segment, as map/cds reports it.
+        mappings = []
+        for chrom, start, end, strand in rows:
+            if mappings and chrom == mappings[-1]['seq_region_name'] and start <= mappings[-1]['end'] + 1:
+                mappings[-1]['end'] = max(mappings[-1]['end'], end)
+                continue
+            mappings.append({'seq_region_name': chrom, 'start': start, 'end': end, 'strand': strand})
+        return mappings
+
+    def get_genomic_sequence(self, region):
+        """Return the sequence of a region written as chrom:start..end:strand."""
+        chrom, coordinates, strand = region.rsplit(':', 2)
+        start, end = coordinates.split('..')
+        sequence = self.fasta.fetch(chrom, int(start), int(end))
+        if int(strand) == -1:
+            sequence = reverse_complement(sequence)
+        return sequence
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index a GTF file (and genome FASTA) for offline substrate extraction.')
+    parser.add_argument('gtf', type=str, help='Ensembl GTF file (e.g. Homo_sapiens.GRCh38.112.gtf.gz)')
+    parser.add_argument('--genome', type=str, default=None, help='Genome FASTA; a missing .fai index is created as well')
+    args = parser.parse_args()
+
+    build_cds_index(args.gtf, args.gtf + '.cds.sqlite')
+    print(f"CDS index saved to {args.gtf}.cds.sqlite")
+    if args.genome is not None and not args.genome.endswith('.gz') and not os.path.isfile(args.genome + '.fai'):
+        FastaIndex.build_fai(args.genome, args.genome + '.fai')
+        print(f"FASTA index saved to {args.genome}.fai")
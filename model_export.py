@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import time
+import shutil
+import inspect
+from types import SimpleNamespace
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# Inference backends of pred_rna_offtarget_batch.load_model:
+#   fp32: PyTorch eager mode (GPU if available)
+#   int8: PyTorch with the Linear layers dynamically quantised to int8 at load time (CPU)
+#   onnx: ONNX Runtime on a directory written by export_onnx (CPU)
+BACKENDS = ('fp32', 'int8', 'onnx')
+DEFAULT_BACKEND = 'fp32'
+
+ONNX_FILE = 'model.onnx'
+DEFAULT_OPSET = 14
+# Files of a model directory that are replaced by model.onnx in an exported directory
+_WEIGHT_EXTENSIONS = ('.bin', '.safetensors', '.pt', '.pth', '.ckpt', '.h5', '.msgpack')
+
+def quantize_model(model):
+    """Quantise the Linear layers of a loaded PyTorch model to int8 (dynamic activation scales)."""
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+    return quantize_dynamic(model.cpu(), {torch.nn.Linear}, dtype=torch.qint8)
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError("The onnx backend requires ONNX Runtime (pip install onnxruntime).")
+    return onnxruntime
+
+class OnnxClassifier:
+    """
+    DNABERT-2 classifier exported by export_onnx, run with ONNX Runtime.
+
+    Called like the PyTorch model (model(input_ids=..., attention_mask=...).logits),
+    so the micro-batching of pred_rna_offtarget_batch is shared by both backends.
+    """
+
+    def __init__(self, model_dir, num_threads=None):
+        from transformers import AutoConfig
+
+        onnxruntime = _import_onnxruntime()
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, ONNX_FILE), options, providers=['CPUExecutionProvider'])
+        self.config = AutoConfig.from_pretrained(model_dir, trust_remote_code=True)
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask):
+        import torch
+        logits = self.session.run(['logits'], {
+            'input_ids': input_ids.cpu().numpy(),
+            'attention_mask': attention_mask.cpu().numpy(),
+        })[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+def export_onnx(model_dir, output_dir, int8=False, opset=DEFAULT_OPSET):
+    """
+    Export a DNABERT-2 classifier to an ONNX model directory.
+
+    The tokenizer, configuration and remote code of model_dir are copied next to
+    model.onnx, so the output directory is used like the original with --backend onnx
+    (and gets its own prediction cache version).
+
+    Args:
+        model_dir (str): DNABERT-2 model directory.
+        output_dir (str): Directory to write (created if needed).
+        int8 (bool): Quantise the weights of model.onnx to int8 with ONNX Runtime.
+        opset (int): ONNX opset version.
+
+    Returns:
+        str: Path of the written model.onnx.
+    """
+    import torch
+    from pred_rna_offtarget_batch import load_model
+
+    class LogitsOnly(torch.nn.Module):
+        # The exported graph returns the logits tensor instead of a ModelOutput
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    if int8:
+        _import_onnxruntime()
+    os.makedirs(output_dir, exist_ok=True)
+    for file_name in os.listdir(model_dir):
+        path = os.path.join(model_dir, file_name)
+        if os.path.isfile(path) and not file_name.endswith(_WEIGHT_EXTENSIONS):
+            shutil.copy2(path, os.path.join(output_dir, file_name))
+
+    tokenizer, model, _ = load_model(model_dir)
+    model = model.cpu()
+    sample = tokenizer(["ACGT" * 10, "ACGTACGTAC" * 4], return_tensors='pt', padding=True)
+    onnx_file = os.path.join(output_dir, ONNX_FILE)
+    export_file = os.path.join(output_dir, 'model.fp32.onnx') if int8 else onnx_file
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # The TorchScript exporter traces the remote DNABERT-2 code without onnxscript
+        kwargs['dynamo'] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            LogitsOnly(model),
+            (sample["input_ids"], sample["attention_mask"]),
+            export_file,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits'],
+            dynamic_axes={'input_ids': {0: 'batch', 1: 'tokens'}, 'attention_mask': {0: 'batch', 1: 'tokens'}, 'logits': {0: 'batch'}},
+            opset_version=opset,
+            **kwargs,
+        )
+    if int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantize_dynamic(export_file, onnx_file, weight_type=QuantType.QInt8)
+        os.remove(export_file)
+    return onnx_file
+
+def read_reference(eval_res_file):
+    """Read the windows and labels of a reference eval_res.csv (flanking_sequence,pred)."""
+    with open(eval_res_file, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        rows = [row for row in reader if row]
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+def parity_check(eval_res_files, tokenizer, model, device, batch_size=None):
+    """
+    Compare the labels of a model with reference fp32 labels.
+
+    Args:
+        eval_res_files (list): Reference eval_res.csv files, e.g. the snv1pred/sv1pred
+            directories of benchmarking/A_validation_using_rAPOBEC1_test_dataset.
+        tokenizer, model, device: Returned by pred_rna_offtarget_batch.load_model.
+        batch_size (int): Windows per forward pass.
+
+    Returns:
+        list: (eval_res file, number of windows, number of identical labels, seconds) per file.
+    """
+    from pred_rna_offtarget_batch import predict_label_ids, DEFAULT_BATCH_SIZE
+
+    results = []
+    for eval_res_file in eval_res_files:
+        sequences, reference_labels = read_reference(eval_res_file)
+        start = time.perf_counter()
+        y_preds = predict_label_ids(sequences, tokenizer, model, device, batch_size or DEFAULT_BATCH_SIZE)
+        seconds = time.perf_counter() - start
+        labels = [model.config.id2label[x] for x in y_preds.tolist()]
+        identical = sum(label == reference for label, reference in zip(labels, reference_labels))
+        results.append((eval_res_file, len(sequences), identical, seconds))
+    return results
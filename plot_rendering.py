@@ -0,0 +1,58 @@
+import os
+from multiprocessing import Pool
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# none: statistics only, fast: low-resolution preview, publication: 350-dpi PNG as before
+PLOT_MODES = ('none', 'fast', 'publication')
+PLOT_DPI = {'fast': 72, 'publication': 350}
+
+def new_figure(figsize, **subplot_kw):
+    """
+    Create a figure and its axes on the Agg canvas without going through pyplot.
+
+    Figures created this way are not registered in pyplot's global state, so they
+    can be drawn in worker processes and need no plt.close().
+
+    Args:
+        figsize (tuple): Figure size in inches.
+        **subplot_kw: Keyword arguments for add_subplot (e.g. polar=True).
+
+    Returns:
+        tuple: (Figure, Axes)
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(**subplot_kw)
+    return fig, ax
+
+def _render(job):
+    draw, args, output_path, dpi = job
+    fig = draw(*args)
+    fig.savefig(output_path, dpi=dpi)
+    return output_path
+
+def render_plots(plot_jobs, mode='publication', processes=None):
+    """
+    Draw and save plots, in parallel unless processes is 1.
+
+    Args:
+        plot_jobs (list): (draw function, arguments, output path) tuples. The draw
+            function must be defined at module level and return a Figure.
+        mode (str): One of PLOT_MODES. 'none' skips plotting.
+        processes (int): Worker processes (default: number of CPUs).
+    """
+    if mode == 'none' or not plot_jobs:
+        return
+    jobs = [(draw, args, output_path, PLOT_DPI[mode]) for draw, args, output_path in plot_jobs]
+    if processes == 1:
+        for job in jobs:
+            _render(job)
+        return
+    with Pool(min(processes or os.cpu_count(), len(jobs))) as pool:
+        for _ in pool.imap_unordered(_render, jobs):
+            pass
@@ -10,6 +10,9 @@ from transformers import AutoTokenizer, AutoModelForSequenceClassification
 __authors__ = ["Kazuki Nakamae"]
 __version__ = "1.1.0"
 
+# Model evaluated by this predictor (also read by protectio.py)
+MODEL_DIR = "DNABERT-2-CBE_Suzuki_Nakamae_v1/"
+
 def pred_rna_offtarget_batch(dna_sequences, model_dir):
     """
     Predict RNA off-target effects from DNA sequences using a DNABERT-2 model.
@@ -89,12 +92,23 @@ if __name__ == "__main__":
     dna_file = sys.argv[1]
     output_file = sys.argv[2]
     
-    model_dir = "DNABERT-2-CBE_Suzuki_Nakamae_v1/"
+    model_dir = MODEL_DIR
 
     if not os.path.isfile(dna_file):
         print(f"Error: The file {dna_file} does not exist.")
         sys.exit(1)
 
+    # Forward to a running pred_rna_offtarget_server.py instead of loading the model here
+    server_socket = os.environ.get("PROTECTIO_SERVER_SOCKET")
+    if server_socket:
+        from pred_rna_offtarget_server import submit_target
+        status, message = submit_target(server_socket, dna_file, output_file, model_dir)
+        if status != "OK":
+            print(f"Error from prediction server: {message}")
+            sys.exit(1)
+        print(f"Results saved to {message}")
+        sys.exit(0)
+
     try:
         with open(dna_file, 'r') as file:
             dna_sequences = [line.strip() for line in file if line.strip()]
@@ -102,6 +116,13 @@ if __name__ == "__main__":
         print(f"Error reading the file {dna_file}: {e}")
         sys.exit(1)
 
-    results = pred_rna_offtarget_batch(dna_sequences, model_dir)
+    # Reuse predictions stored in the cache named by PROTECTIO_CACHE, if any
+    from prediction_cache import open_cache_from_env
+    cache = open_cache_from_env(model_dir)
+    if cache is not None:
+        labels = cache.predict(dna_sequences, lambda sequences: [label for _, label in pred_rna_offtarget_batch(sequences, model_dir)])
+        results = list(zip(dna_sequences, labels))
+    else:
+        results = pred_rna_offtarget_batch(dna_sequences, model_dir)
 
     save_to_csv(results, output_file)
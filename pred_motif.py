@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import csv
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarking'))
+from generate_benchmarking_data import IUPAC_CODES
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# 0-based start of the motif in a 40-nt window (the target C is at index 20 in ACW/WCW)
+DEFAULT_OFFSET = 19
+
+# Target files loaded into one window matrix at a time
+DEFAULT_FILES_PER_CHUNK = 2000
+
+def motif_table(motif):
+    """
+    Build a lookup table of the bases allowed at every position of an IUPAC motif.
+
+    Args:
+        motif (str): IUPAC motif (e.g. ACW).
+
+    Returns:
+        ndarray: Boolean array of shape (len(motif), 256); row i is True at the byte
+            values of the bases matching motif[i].
+    """
+    table = np.zeros((len(motif), 256), dtype=bool)
+    for i, code in enumerate(motif.upper()):
+        if code not in IUPAC_CODES:
+            raise ValueError(f"{code} in motif {motif} is not an IUPAC nucleotide code.")
+        bases = IUPAC_CODES[code].strip('[]')
+        table[i, np.frombuffer(bases.encode(), dtype=np.uint8)] = True
+    return table
+
+def motif_label(motif, offset=DEFAULT_OFFSET):
+    """Output file prefix of a motif classifier, e.g. pred_motif_acw for ACW at the default offset."""
+    label = f"pred_motif_{motif.lower()}"
+    if offset != DEFAULT_OFFSET:
+        label += f"_{offset}"
+    return label
+
+def sequences_to_windows(sequences):
+    """
+    Convert window sequences into a zero-padded uint8 matrix.
+
+    Returns:
+        tuple: (windows, lengths)
+    """
+    lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64, count=len(sequences))
+    width = int(lengths.max()) if len(sequences) else 0
+    if width == 0:
+        windows = np.zeros((len(sequences), 0), dtype=np.uint8)
+    else:
+        windows = np.array(sequences, dtype=f'S{width}').view(np.uint8).reshape(len(sequences), width)
+    return windows, lengths
+
+def load_windows(target_files):
+    """
+    Read the windows of one or more target.csv files into a uint8 matrix.
+
+    Args:
+        target_files (list): target.csv files (one window per row, sequence in the first column).
+
+    Returns:
+        tuple: (sequences, windows, lengths, file_ends). windows holds one zero-padded
+            row of bytes per sequence; file_ends[i] is the row after the last window of
+            target_files[i].
+    """
+    sequences = []
+    file_ends = []
+    for target_file in target_files:
+        with open(target_file, 'r', newline='') as f:
+            sequences.extend(row[0] for row in csv.reader(f))
+        file_ends.append(len(sequences))
+    windows, lengths = sequences_to_windows(sequences)
+    return sequences, windows, lengths, file_ends
+
+def match_motif(windows, lengths, motif, offset=DEFAULT_OFFSET):
+    """
+    Label every window that carries the motif at the given offset.
+
+    Args:
+        windows (ndarray): uint8 window matrix from load_windows.
+        lengths (ndarray): Length of every window.
+        motif (str): IUPAC motif.
+        offset (int): 0-based start of the motif in the window.
+
+    Returns:
+        ndarray: Boolean mask, False for windows too short to hold the motif.
+    """
+    mask = lengths >= offset + len(motif)
+    if windows.shape[1] < offset + len(motif):
+        return np.zeros(len(lengths), dtype=bool)
+    table = motif_table(motif)
+    for i in range(len(motif)):
+        mask &= table[i, windows[:, offset + i]]
+    return mask
+
+def write_eval_res(output_file, sequences, mask):
+    """Write sequences and their motif labels in the eval_res.csv format."""
+    labels = np.where(mask, 'LABEL_1', 'LABEL_0')
+    with open(output_file, 'w', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['flanking_sequence', 'pred'])
+        writer.writerows(zip(sequences, labels.tolist()))
+
+def predict_motif_files(jobs, motifs, offset=DEFAULT_OFFSET, files_per_chunk=DEFAULT_FILES_PER_CHUNK):
+    """
+    Label the windows of many target files with several motifs in one pass.
+
+    The windows of up to files_per_chunk files are loaded into one matrix, each motif is
+    matched with one mask operation over the whole matrix, and the labels are split back
+    into one eval_res file per target file and motif.
+
+    Args:
+        jobs (list): (target file, {motif: eval_res file}) tuples.
+        motifs (list): IUPAC motifs.
+        offset (int): 0-based start of the motifs in the windows.
+        files_per_chunk (int): Target files loaded at once.
+
+    Yields:
+        tuple: (target file, eval_res file, error) for every written or failed eval_res file.
+    """
+    for start in range(0, len(jobs), files_per_chunk):
+        chunk = jobs[start:start + files_per_chunk]
+        try:
+            sequences, windows, lengths, file_ends = load_windows([target_file for target_file, _ in chunk])
+        except Exception as e:
+            for target_file, eval_res_files in chunk:
+                for eval_res in eval_res_files.values():
+                    yield target_file, eval_res, e
+            continue
+        masks = {motif: match_motif(windows, lengths, motif, offset) for motif in motifs}
+
+        file_start = 0
+        for (target_file, eval_res_files), file_end in zip(chunk, file_ends):
+            for motif, eval_res in eval_res_files.items():
+                try:
+                    write_eval_res(eval_res + ".tmp", sequences[file_start:file_end], masks[motif][file_start:file_end])
+                    os.replace(eval_res + ".tmp", eval_res)
+                except Exception as e:
+                    yield target_file, eval_res, e
+                    continue
+                yield target_file, eval_res, None
+            file_start = file_end
+
+def predict_motif_matrix(matrix, labels_files, offset=DEFAULT_OFFSET, chunk_size=1000000):
+    """
+    Label every window of a whole-database substrate matrix with several motifs.
+
+    Args:
+        matrix (SubstrateMatrix): Matrix built by protectio.py matrix.
+        labels_files (dict): {motif: <prefix>matrix_labels.npy to write}.
+        offset (int): 0-based start of the motifs in the windows.
+        chunk_size (int): Windows unpacked at a time.
+    """
+    from window_store import unpack_window_bytes, WINDOW_LENGTH
+
+    labels = {motif: np.lib.format.open_memmap(labels_file + ".tmp.npy", mode='w+', dtype=np.uint8, shape=(len(matrix),))
+              for motif, labels_file in labels_files.items()}
+    for start, end, packed in matrix.iter_chunks(chunk_size):
+        windows = unpack_window_bytes(packed)
+        lengths = np.full(end - start, WINDOW_LENGTH, dtype=np.int64)
+        for motif in labels_files:
+            labels[motif][start:end] = match_motif(windows, lengths, motif, offset)
+    for motif, labels_file in labels_files.items():
+        labels[motif].flush()
+        del labels[motif]
+        os.replace(labels_file + ".tmp.npy", labels_file)
+
+def main(input_file, output_file, motif, offset=DEFAULT_OFFSET):
+    sequences, windows, lengths, _ = load_windows([input_file])
+    write_eval_res(output_file, sequences, match_motif(windows, lengths, motif, offset))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Label CBE substrate windows carrying IUPAC motifs.")
+    parser.add_argument('target_file', help="target.csv file")
+    parser.add_argument('--motif', required=True, action='append', help="IUPAC motif, e.g. ACW (repeat for several motifs)")
+    parser.add_argument('--offset', type=int, default=DEFAULT_OFFSET, help=f"0-based start of the motif in the window (default: {DEFAULT_OFFSET})")
+    parser.add_argument('--output_dir', default=None, help="Directory of the <label>_eval_res.csv files (default: directory of the target file)")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.target_file))
+    eval_res_files = {motif: os.path.join(output_dir, f"{motif_label(motif, args.offset)}_eval_res.csv") for motif in args.motif}
+    for target_file, eval_res, error in predict_motif_files([(args.target_file, eval_res_files)], args.motif, args.offset):
+        if error is None:
+            print(f"Results saved to {eval_res}")
+        else:
+            print(f"Error evaluating {target_file}: {error}")
+            sys.exit(1)
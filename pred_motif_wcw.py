@@ -1,34 +1,17 @@
 #!/usr/bin/env python3
 
 import sys
-import csv
+
+import pred_motif
 
 __authors__ = ["Kazuki Nakamae"]
-__version__ = "1.1.0"
+__version__ = "1.2.0"
 
-# Function to check if a given sequence matches the "WCW" motif
-def matches_motif(subsequence):
-    iupac_w = {'A', 'T'}
-    return (subsequence[0] in iupac_w) and (subsequence[1] == 'C') and (subsequence[2] in iupac_w)
+# Label windows carrying the "WCW" motif at positions 20 to 22 (0-based index 19)
+MOTIF = "WCW"
 
 def main(input_file, output_file):
-    with open(input_file, 'r') as infile, open(output_file, 'w', newline='') as outfile:
-        reader = csv.reader(infile)
-        writer = csv.writer(outfile)
-
-        # Write the header to the output file
-        writer.writerow(['flanking_sequence', 'pred'])
-
-        # Process each row in the input file
-        for row in reader:
-            sequence = row[0]  # Assuming the DNA sequence is in the first column
-            if len(sequence) >= 22:
-                subsequence = sequence[19:22]  # Extract positions 20 to 22 (0-based indexing)
-                label = 'LABEL_1' if matches_motif(subsequence) else 'LABEL_0'
-            else:
-                label = 'LABEL_0'  # Default to LABEL_0 if the sequence is too short
-
-            writer.writerow([sequence, label])
+    pred_motif.main(input_file, output_file, MOTIF, pred_motif.DEFAULT_OFFSET)
 
 if __name__ == "__main__":
     if len(sys.argv) != 3:
@@ -3,41 +3,254 @@
 import sys
 import os
 import csv
+import json
+import hashlib
 import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
+from window_store import SCORE_DTYPE, DEFAULT_THRESHOLD
+
 __authors__ = ["Kazuki Nakamae"]
-__version__ = "1.1.0"
+__version__ = "1.2.0"
+
+# Windows per forward pass, and windows pooled across target files before scoring
+DEFAULT_BATCH_SIZE = 128
+DEFAULT_POOL_SIZE = 16384
 
-def pred_rna_offtarget_batch(dna_sequences, model_dir):
+def load_model(model_dir, num_threads=None, backend='fp32'):
     """
-    Predict RNA off-target effects from DNA sequences using a DNABERT-2 model.
-    
+    Load the DNABERT-2 tokenizer and classification model.
+
     Args:
-        dna_sequences (list): List of DNA sequences.
-        model_dir (str): Directory containing the DNABERT-2 model.
-    
+        model_dir (str): Directory containing the DNABERT-2 model (an ONNX export for backend 'onnx').
+        num_threads (int): Number of intra-op CPU threads for torch (default: torch's choice).
+        backend (str): 'fp32' (PyTorch), 'int8' (PyTorch, dynamically quantised on the CPU)
+            or 'onnx' (ONNX Runtime on the CPU); see model_export.py.
+
     Returns:
-        list: List of tuples containing the DNA sequence and its predicted label.
+        tuple: (tokenizer, model, device). The model is already in inference mode.
     """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
     try:
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
-        model = AutoModelForSequenceClassification.from_pretrained(model_dir, trust_remote_code=True).to(device)
+        if backend == 'onnx':
+            from model_export import OnnxClassifier
+            device = torch.device("cpu")
+            model = OnnxClassifier(model_dir, num_threads)
+        elif backend == 'int8':
+            from model_export import quantize_model
+            device = torch.device("cpu")
+            model = quantize_model(AutoModelForSequenceClassification.from_pretrained(model_dir, trust_remote_code=True))
+        else:
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            model = AutoModelForSequenceClassification.from_pretrained(model_dir, trust_remote_code=True).to(device)
     except Exception as e:
         print(f"Error loading model from {model_dir}: {e}")
         sys.exit(1)
 
-    inputs = tokenizer(dna_sequences, return_tensors='pt', padding=True, truncation=True)
     model.eval()
+    return tokenizer, model, device
+
+def iter_micro_batches(encoded_ids, batch_size):
+    """
+    Group windows into micro-batches of similar token length.
+
+    Args:
+        encoded_ids (list): Token ID lists, one per window.
+        batch_size (int): Maximum number of windows per micro-batch.
+
+    Yields:
+        list: Indices into encoded_ids forming one micro-batch.
+    """
+    order = sorted(range(len(encoded_ids)), key=lambda i: len(encoded_ids[i]))
+    for start in range(0, len(order), batch_size):
+        yield order[start:start + batch_size]
+
+def load_models(model_dirs, num_threads=None, backend='fp32'):
+    """
+    Load several DNABERT-2 models, sharing one tokenizer between models whose vocabularies match.
+
+    Args:
+        model_dirs (list): Directories containing the DNABERT-2 models.
+        num_threads (int): Number of intra-op CPU threads for torch (default: torch's choice).
+        backend (str): Inference backend of every model (see load_model).
+
+    Returns:
+        tuple: (list of (tokenizer, model) in the order of model_dirs, device)
+    """
+    models = []
+    tokenizers = []
+    device = None
+    for model_dir in model_dirs:
+        tokenizer, model, device = load_model(model_dir, num_threads, backend)
+        for shared_tokenizer in tokenizers:
+            if type(shared_tokenizer) is type(tokenizer) and shared_tokenizer.get_vocab() == tokenizer.get_vocab():
+                tokenizer = shared_tokenizer
+                break
+        else:
+            tokenizers.append(tokenizer)
+        models.append((tokenizer, model))
+    return models, device
+
+def predict_label_scores(dna_sequences, tokenizer, model, device, batch_size=DEFAULT_BATCH_SIZE, encoded_ids=None):
+    """
+    Predict class IDs and LABEL_1 probabilities for DNA sequences in length-bucketed micro-batches.
+
+    Sorting the windows by token length keeps padding (and wasted compute) small,
+    and batch_size bounds the memory used by a single forward pass.
+
+    Args:
+        dna_sequences (list): List of DNA sequences.
+        tokenizer: Tokenizer returned by load_model.
+        model: Model returned by load_model.
+        device (torch.device): Device returned by load_model.
+        batch_size (int): Maximum number of windows per forward pass.
+        encoded_ids (list): Token IDs of dna_sequences already produced by the same tokenizer.
+
+    Returns:
+        tuple: (predicted class ID, softmax probability of class 1 as float16) arrays, in input order.
+    """
+    y_preds = np.zeros(len(dna_sequences), dtype=np.int64)
+    y_scores = np.zeros(len(dna_sequences), dtype=SCORE_DTYPE)
+    if not dna_sequences:
+        return y_preds, y_scores
+
+    if encoded_ids is None:
+        encoded_ids = tokenizer(list(dna_sequences), padding=False, truncation=True)["input_ids"]
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+
     with torch.no_grad():
-        outputs = model(
-            input_ids=inputs["input_ids"].to(device),
-            attention_mask=inputs["attention_mask"].to(device),
-        )
-    
-    y_preds = np.argmax(outputs.logits.cpu().detach().numpy(), axis=1)
+        for batch_indices in iter_micro_batches(encoded_ids, batch_size):
+            max_len = max(len(encoded_ids[i]) for i in batch_indices)
+            input_ids = np.full((len(batch_indices), max_len), pad_token_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch_indices), max_len), dtype=np.int64)
+            for row, i in enumerate(batch_indices):
+                input_ids[row, :len(encoded_ids[i])] = encoded_ids[i]
+                attention_mask[row, :len(encoded_ids[i])] = 1
+            y_preds[batch_indices], y_scores[batch_indices] = _forward(model, device, input_ids, attention_mask)
+
+    return y_preds, y_scores
+
+def _forward(model, device, input_ids, attention_mask):
+    # One forward pass: class IDs and softmax probability of class 1
+    outputs = model(
+        input_ids=torch.from_numpy(input_ids).to(device),
+        attention_mask=torch.from_numpy(attention_mask).to(device),
+    )
+    logits = outputs.logits.float()
+    probabilities = torch.softmax(logits, dim=1)[:, min(1, logits.shape[1] - 1)].cpu().numpy()
+    y_scores = probabilities.astype(SCORE_DTYPE)
+    # float16 rounds probabilities just below 0.5 up to 0.5; keep them below the default
+    # threshold so that thresholding the stored scores reproduces the labels
+    y_scores[(probabilities < DEFAULT_THRESHOLD) & (y_scores >= DEFAULT_THRESHOLD)] = np.nextafter(SCORE_DTYPE(DEFAULT_THRESHOLD), SCORE_DTYPE(0))
+    return torch.argmax(logits, dim=1).cpu().numpy(), y_scores
+
+def predict_token_scores(input_ids, lengths, model, device, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Predict class IDs and LABEL_1 probabilities from pre-tokenized windows (see tokenize_matrix).
+
+    Args:
+        input_ids (numpy.ndarray): Right-padded token IDs, one row per window.
+        lengths (numpy.ndarray): Number of tokens of every row.
+        model: Model returned by load_model.
+        device (torch.device): Device returned by load_model.
+        batch_size (int): Maximum number of windows per forward pass.
+
+    Returns:
+        tuple: (predicted class ID, softmax probability of class 1 as float16) arrays, in row order.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    y_preds = np.zeros(len(lengths), dtype=np.int64)
+    y_scores = np.zeros(len(lengths), dtype=SCORE_DTYPE)
+    # Same length-bucketed micro-batches as iter_micro_batches
+    order = np.argsort(lengths, kind='stable')
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            max_len = int(lengths[batch_indices].max())
+            batch_ids = np.asarray(input_ids[batch_indices, :max_len], dtype=np.int64)
+            attention_mask = (np.arange(max_len) < lengths[batch_indices, None]).astype(np.int64)
+            y_preds[batch_indices], y_scores[batch_indices] = _forward(model, device, batch_ids, attention_mask)
+    return y_preds, y_scores
+
+def tokenizer_key(tokenizer):
+    """Short fingerprint of a tokenizer's vocabulary; models sharing a tokenizer share its tokens."""
+    vocab = json.dumps(sorted(tokenizer.get_vocab().items()))
+    return hashlib.sha1(f"{type(tokenizer).__name__}\n{tokenizer.pad_token_id}\n{vocab}".encode()).hexdigest()[:16]
+
+def tokenize_matrix(matrix, tokenizer, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Tokenize every window of a substrate matrix once into memory-mapped arrays.
+
+    The token IDs are right-padded to a fixed width (int16 when the vocabulary allows)
+    next to the token count of every row, from which the attention mask follows. They
+    are written to <db_dir>/matrix_tokens_<tokenizer key>.npy and ..._lengths.npy.
+
+    Args:
+        matrix (SubstrateMatrix): Matrix built by protectio.py matrix.
+        tokenizer: Tokenizer returned by load_model.
+        pool_size (int): Number of windows tokenized at a time.
+
+    Yields:
+        int: Number of windows tokenized so far, after every chunk.
+    """
+    from window_store import unpack_windows, WINDOW_LENGTH
+
+    ids_file, lengths_file = matrix.tokens_files(tokenizer_key(tokenizer))
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    dtype = np.int16 if len(tokenizer.get_vocab()) <= np.iinfo(np.int16).max else np.int32
+    # Subword tokens never outnumber the bases; leave room for the special tokens
+    width = WINDOW_LENGTH + 8
+    input_ids = np.lib.format.open_memmap(ids_file + ".tmp.npy", mode='w+', dtype=dtype, shape=(len(matrix), width))
+    lengths = np.lib.format.open_memmap(lengths_file + ".tmp.npy", mode='w+', dtype=np.uint8, shape=(len(matrix),))
+    for start, end, packed in matrix.iter_chunks(pool_size):
+        encoded_ids = tokenizer(unpack_windows(packed), padding=False, truncation=True)["input_ids"]
+        chunk = np.full((end - start, width), pad_token_id, dtype=dtype)
+        for row, ids in enumerate(encoded_ids):
+            if len(ids) > width:
+                raise ValueError(f"A window has {len(ids)} tokens, more than the {width} stored per row.")
+            chunk[row, :len(ids)] = ids
+        input_ids[start:end] = chunk
+        lengths[start:end] = [len(ids) for ids in encoded_ids]
+        yield end
+    input_ids.flush()
+    lengths.flush()
+    del input_ids, lengths
+    os.replace(ids_file + ".tmp.npy", ids_file)
+    # The lengths file marks the tokens as finished
+    os.replace(lengths_file + ".tmp.npy", lengths_file)
+
+def predict_label_ids(dna_sequences, tokenizer, model, device, batch_size=DEFAULT_BATCH_SIZE, encoded_ids=None):
+    """
+    Predict class IDs for DNA sequences (see predict_label_scores).
+
+    Returns:
+        numpy.ndarray: Predicted class ID for each sequence, in input order.
+    """
+    return predict_label_scores(dna_sequences, tokenizer, model, device, batch_size, encoded_ids)[0]
+
+def _scored_labels(model, y_preds, y_scores):
+    """(label, score) tuples, as stored by PredictionCache with_scores."""
+    return [(model.config.id2label[x], score) for x, score in zip(y_preds.tolist(), y_scores.tolist())]
+
+def predict_labels(dna_sequences, tokenizer, model, device, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Predict RNA off-target effects with an already loaded DNABERT-2 model.
+
+    Args:
+        dna_sequences (list): List of DNA sequences.
+        tokenizer: Tokenizer returned by load_model.
+        model: Model returned by load_model.
+        device (torch.device): Device returned by load_model.
+        batch_size (int): Maximum number of windows per forward pass.
+
+    Returns:
+        list: List of tuples containing the DNA sequence and its predicted label.
+    """
+    y_preds = predict_label_ids(dna_sequences, tokenizer, model, device, batch_size)
     
     def id2label(x):
         return model.config.id2label[x]
@@ -46,6 +259,214 @@ def pred_rna_offtarget_batch(dna_sequences, model_dir):
     
     return list(zip(dna_sequences, y_dash))
 
+def predict_models(dna_sequences, models, device, batch_size=DEFAULT_BATCH_SIZE, caches=None):
+    """
+    Predict the same windows with several DNABERT-2 models.
+
+    The windows are tokenized once per distinct tokenizer (see load_models), and every
+    model scores them from the shared token IDs.
+
+    Args:
+        dna_sequences (list): List of DNA sequences.
+        models (list): (tokenizer, model) tuples returned by load_models.
+        device (torch.device): Device returned by load_models.
+        batch_size (int): Maximum number of windows per forward pass.
+        caches (list): PredictionCache or None for every model.
+
+    Returns:
+        list: (labels, LABEL_1 probabilities) of every model, each in input order.
+    """
+    # Token IDs of every distinct window, per distinct tokenizer; filled only for windows a model scores
+    encodings = {}
+
+    def encode(tokenizer, sequences):
+        encoding = encodings.setdefault(id(tokenizer), {})
+        new_sequences = [sequence for sequence in dict.fromkeys(sequences) if sequence not in encoding]
+        if new_sequences:
+            encoding.update(zip(new_sequences, tokenizer(new_sequences, padding=False, truncation=True)["input_ids"]))
+        return [encoding[sequence] for sequence in sequences]
+
+    all_results = []
+    for (tokenizer, model), cache in zip(models, caches or [None] * len(models)):
+        def predict(sequences, tokenizer=tokenizer, model=model):
+            return _scored_labels(model, *predict_label_scores(sequences, tokenizer, model, device, batch_size, encode(tokenizer, sequences)))
+
+        if cache is None:
+            results = predict(list(dna_sequences))
+        else:
+            results = cache.predict(list(dna_sequences), predict, with_scores=True)
+        all_results.append(([label for label, _ in results], [score for _, score in results]))
+    return all_results
+
+def predict_target_files(jobs, tokenizer, model, device, batch_size=DEFAULT_BATCH_SIZE, pool_size=DEFAULT_POOL_SIZE, cache=None):
+    """
+    Predict many target files, pooling their windows into shared micro-batches.
+
+    Windows from consecutive files are collected until about pool_size windows are
+    pending; the pool is then scored in length-bucketed micro-batches and the labels
+    are scattered back to each file's eval_res.csv (LABEL_1 probabilities to the
+    <prefix>scores.npy next to it). Small files therefore share
+    forward passes, and memory stays bounded by pool_size however large the database is.
+
+    Args:
+        jobs (list): List of (target file, eval_res file) tuples.
+        tokenizer: Tokenizer returned by load_model.
+        model: Model returned by load_model.
+        device (torch.device): Device returned by load_model.
+        batch_size (int): Maximum number of windows per forward pass.
+        pool_size (int): Number of windows collected before the pool is scored.
+        cache (PredictionCache): Optional cache; only windows missing from it are scored.
+
+    Yields:
+        tuple: (target file, eval_res file, error) for every job; error is None on success.
+    """
+    from window_store import scores_file_for, write_scores
+
+    def predict(sequences):
+        return _scored_labels(model, *predict_label_scores(sequences, tokenizer, model, device, batch_size))
+
+    def flush(pool):
+        all_sequences = [seq for _, _, sequences in pool for seq in sequences]
+        if cache is None:
+            all_results = predict(all_sequences)
+        else:
+            all_results = cache.predict(all_sequences, predict, with_scores=True)
+        offset = 0
+        for target_file, output_file, sequences in pool:
+            results = all_results[offset:offset + len(sequences)]
+            offset += len(sequences)
+            try:
+                scores_file = scores_file_for(output_file)
+                write_scores(scores_file + ".tmp.npy", [score for _, score in results])
+                os.replace(scores_file + ".tmp.npy", scores_file)
+                # A partial eval_res.csv must never look finished to the resume logic
+                write_results([(seq, label) for seq, (label, _) in zip(sequences, results)], output_file + ".tmp")
+                os.replace(output_file + ".tmp", output_file)
+            except Exception as e:
+                yield target_file, output_file, e
+                continue
+            yield target_file, output_file, None
+
+    pool = []
+    pooled_windows = 0
+    for target_file, output_file in jobs:
+        try:
+            sequences = read_sequences(target_file)
+        except Exception as e:
+            yield target_file, output_file, e
+            continue
+        pool.append((target_file, output_file, sequences))
+        pooled_windows += len(sequences)
+        if pooled_windows >= pool_size:
+            yield from flush(pool)
+            pool = []
+            pooled_windows = 0
+    if pool:
+        yield from flush(pool)
+
+def predict_matrix(matrix, labels_file, tokenizer, model, device, batch_size=DEFAULT_BATCH_SIZE, pool_size=DEFAULT_POOL_SIZE, cache=None, scores_file=None, tokens=None):
+    """
+    Predict every window of a whole-database substrate matrix in one sequential pass.
+
+    Windows are read from the memory-mapped matrix pool_size rows at a time, so memory
+    stays bounded however large the database is, and the class IDs are written to a
+    memory-mapped uint8 array aligned to the matrix rows.
+
+    Args:
+        matrix (SubstrateMatrix): Matrix built by protectio.py matrix.
+        labels_file (str): Output <prefix>matrix_labels.npy.
+        tokenizer: Tokenizer returned by load_model.
+        model: Model returned by load_model.
+        device (torch.device): Device returned by load_model.
+        batch_size (int): Maximum number of windows per forward pass.
+        pool_size (int): Number of windows read from the matrix at a time.
+        cache (PredictionCache): Optional cache; only windows missing from it are scored.
+        scores_file (str): Optional output <prefix>matrix_scores.npy with the LABEL_1 probabilities.
+        tokens (tuple): Pre-tokenized (input IDs, lengths) of the matrix rows from
+            SubstrateMatrix.read_tokens; the windows are then not tokenized again.
+
+    Yields:
+        int: Number of windows predicted so far, after every chunk.
+    """
+    from window_store import unpack_windows
+    from prediction_cache import label_to_id
+
+    def predict(sequences):
+        return _scored_labels(model, *predict_label_scores(sequences, tokenizer, model, device, batch_size))
+
+    labels = np.lib.format.open_memmap(labels_file + ".tmp.npy", mode='w+', dtype=np.uint8, shape=(len(matrix),))
+    scores = None
+    if scores_file is not None:
+        scores = np.lib.format.open_memmap(scores_file + ".tmp.npy", mode='w+', dtype=SCORE_DTYPE, shape=(len(matrix),))
+    for start, end, packed in matrix.iter_chunks(pool_size):
+        if tokens is not None and cache is None:
+            y_preds, y_scores = predict_token_scores(tokens[0][start:end], tokens[1][start:end], model, device, batch_size)
+            labels[start:end] = y_preds
+            if scores is not None:
+                scores[start:end] = y_scores
+            yield end
+            continue
+        sequences = unpack_windows(packed)
+        if tokens is not None:
+            # Score the windows missing from the cache from their stored tokens
+            rows = {sequence: start + row for row, sequence in enumerate(sequences)}
+
+            def predict(missing):
+                missing_rows = np.array([rows[sequence] for sequence in missing])
+                return _scored_labels(model, *predict_token_scores(tokens[0][missing_rows], tokens[1][missing_rows], model, device, batch_size))
+        if cache is None:
+            y_preds, y_scores = predict_label_scores(sequences, tokenizer, model, device, batch_size)
+        else:
+            results = cache.predict(sequences, predict, with_scores=True)
+            y_preds = [label_to_id(label) for label, _ in results]
+            y_scores = [score for _, score in results]
+        labels[start:end] = y_preds
+        if scores is not None:
+            scores[start:end] = y_scores
+        yield end
+    if scores is not None:
+        scores.flush()
+        del scores
+        os.replace(scores_file + ".tmp.npy", scores_file)
+    labels.flush()
+    del labels
+    # A partial labels file must never look finished to the resume logic
+    os.replace(labels_file + ".tmp.npy", labels_file)
+
+def pred_rna_offtarget_batch(dna_sequences, model_dir, cache=None):
+    """
+    Predict RNA off-target effects from DNA sequences using a DNABERT-2 model.
+    
+    Args:
+        dna_sequences (list): List of DNA sequences.
+        model_dir (str): Directory containing the DNABERT-2 model.
+        cache (PredictionCache): Optional cache. The model is only loaded if some
+            sequences are missing from it.
+    
+    Returns:
+        list: List of tuples containing the DNA sequence and its predicted label.
+    """
+    def predict(sequences):
+        tokenizer, model, device = load_model(model_dir)
+        return [label for _, label in predict_labels(sequences, tokenizer, model, device)]
+
+    if cache is None:
+        return list(zip(dna_sequences, predict(dna_sequences)))
+    return list(zip(dna_sequences, cache.predict(dna_sequences, predict)))
+
+def read_sequences(dna_file):
+    """
+    Read one DNA sequence per line from a target file, skipping blank lines.
+
+    Args:
+        dna_file (str): Path to the target file.
+
+    Returns:
+        list: List of DNA sequences.
+    """
+    with open(dna_file, 'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
 def print_usage():
     print(f"Usage: {sys.argv[0]} <input DNA sequence file> <DNABERT-2 model directory> <output CSV file>")
     print("Options:")
@@ -56,6 +477,19 @@ def print_version():
     print(f"{sys.argv[0]} version {__version__}")
     print("Authors:", ", ".join(__authors__))
 
+def write_results(results, output_file):
+    """
+    Write the DNA sequence prediction results to a CSV file, raising on failure.
+
+    Args:
+        results (list): List of tuples containing the DNA sequence and prediction label.
+        output_file (str): Path to the output CSV file.
+    """
+    with open(output_file, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['flanking_sequence', 'pred'])
+        writer.writerows(results)
+
 def save_to_csv(results, output_file):
     """
     Save the DNA sequence prediction results to a CSV file.
@@ -65,10 +499,7 @@ def save_to_csv(results, output_file):
         output_file (str): Path to the output CSV file.
     """
     try:
-        with open(output_file, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['flanking_sequence', 'pred'])
-            writer.writerows(results)
+        write_results(results, output_file)
         print(f"Results saved to {output_file}")
     except Exception as e:
         print(f"Error writing to {output_file}: {e}")
@@ -95,12 +526,15 @@ if __name__ == "__main__":
         sys.exit(1)
 
     try:
-        with open(dna_file, 'r') as file:
-            dna_sequences = [line.strip() for line in file if line.strip()]
+        dna_sequences = read_sequences(dna_file)
     except Exception as e:
         print(f"Error reading the file {dna_file}: {e}")
         sys.exit(1)
 
-    results = pred_rna_offtarget_batch(dna_sequences, model_dir)
+    # Reuse predictions stored in the cache named by PROTECTIO_CACHE, if any
+    from prediction_cache import open_cache_from_env
+    cache = open_cache_from_env(model_dir)
+
+    results = pred_rna_offtarget_batch(dna_sequences, model_dir, cache)
 
     save_to_csv(results, output_file)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import signal
+import socket
+import socketserver
+import argparse
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# The DNABERT-2 predictor scripts (pred_dnabert2_cbe_*.py) read the environment
+# variable PROTECTIO_SERVER_SOCKET. When it points to the socket of a running
+# server, they forward their target file to it instead of loading the model.
+
+# Line protocol (one request per line, fields separated by a tab):
+#   <target.csv>\t<eval_res.csv>[\t<model directory>]
+#   SHUTDOWN
+# The server answers each request with a single line:
+#   OK\t<eval_res.csv>
+#   ERROR\t<message>
+
+class PredictionWorker:
+    """Hold a DNABERT-2 model in memory and evaluate target files with it."""
+
+    def __init__(self, model_dir, batch_size=None, num_threads=None, backend='fp32', cache_path=None):
+        # torch/transformers are only needed on the server side
+        from pred_rna_offtarget_batch import load_model, DEFAULT_BATCH_SIZE
+        from prediction_cache import PredictionCache
+
+        self.model_dir = os.path.realpath(model_dir)
+        self.batch_size = batch_size or DEFAULT_BATCH_SIZE
+        self.tokenizer, self.model, self.device = load_model(model_dir, num_threads, backend)
+        self.cache = PredictionCache.for_model(cache_path, model_dir, backend) if cache_path else None
+
+    def handle_line(self, line):
+        """
+        Process one protocol line.
+
+        Args:
+            line (str): Request line without the trailing newline.
+
+        Returns:
+            str: Response line without the trailing newline.
+        """
+        from pred_rna_offtarget_batch import predict_target_files, DEFAULT_POOL_SIZE
+
+        fields = line.split('\t')
+        if len(fields) not in (2, 3):
+            return f"ERROR\tMalformed request: {line}"
+
+        target_file, output_file = fields[0], fields[1]
+        if len(fields) == 3 and os.path.realpath(fields[2]) != self.model_dir:
+            return f"ERROR\tServer holds {self.model_dir}, but {fields[2]} was requested"
+
+        # Same path as protectio.py predict: cached windows are reused, and the eval_res.csv
+        # and <prefix>scores.npy are written through temporary files
+        jobs = [(target_file, output_file)]
+        for _, _, error in predict_target_files(jobs, self.tokenizer, self.model, self.device, self.batch_size, DEFAULT_POOL_SIZE, self.cache):
+            if error is not None:
+                return f"ERROR\t{target_file}: {error}"
+
+        return f"OK\t{output_file}"
+
+def serve_stdin(worker):
+    """Read requests from stdin and write one response per line to stdout."""
+    for line in sys.stdin:
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        if line == "SHUTDOWN":
+            break
+        print(worker.handle_line(line), flush=True)
+
+def serve_socket(worker, socket_path):
+    """Serve requests on a Unix domain socket until a SHUTDOWN request arrives."""
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw_line in self.rfile:
+                line = raw_line.decode().rstrip('\n')
+                if not line:
+                    continue
+                if line == "SHUTDOWN":
+                    self.wfile.write(b"OK\tSHUTDOWN\n")
+                    self.server.shutdown_requested = True
+                    return
+                self.wfile.write((worker.handle_line(line) + '\n').encode())
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socketserver.UnixStreamServer(socket_path, RequestHandler)
+    server.shutdown_requested = False
+    # Let `kill` from the shell drivers remove the socket file on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Serving {worker.model_dir} on {socket_path}", flush=True)
+    try:
+        while not server.shutdown_requested:
+            server.handle_request()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def submit_target(socket_path, target_file, output_file, model_dir=None):
+    """
+    Ask a running server to evaluate one target file.
+
+    Args:
+        socket_path (str): Path to the server socket.
+        target_file (str): Path to the target.csv file.
+        output_file (str): Path to the eval_res.csv file to write.
+        model_dir (str): Model directory the caller expects the server to hold.
+
+    Returns:
+        tuple: (status, message) where status is "OK" or "ERROR".
+    """
+    fields = [os.path.abspath(target_file), os.path.abspath(output_file)]
+    if model_dir is not None:
+        fields.append(os.path.abspath(model_dir))
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(('\t'.join(fields) + '\n').encode())
+        client.shutdown(socket.SHUT_WR)
+        response = client.makefile('r').readline().rstrip('\n')
+
+    status, _, message = response.partition('\t')
+    return status, message
+
+def main():
+    from model_export import BACKENDS, DEFAULT_BACKEND
+    from prediction_cache import CACHE_ENV
+
+    parser = argparse.ArgumentParser(description='Keep a DNABERT-2 model loaded and evaluate many target files with it.')
+    parser.add_argument('model_dir', type=str, help='DNABERT-2 model directory')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--socket', type=str, help='Serve requests on this Unix domain socket')
+    mode.add_argument('--stdin', action='store_true', help='Read requests from stdin and answer on stdout')
+    parser.add_argument('--batch_size', type=int, default=None, help='Windows per forward pass (default: 128)')
+    parser.add_argument('--threads', type=int, default=None, help="Intra-op CPU threads (default: torch's choice)")
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help='Inference backend: fp32 (default), int8 or onnx (model_dir written by protectio.py export)')
+    parser.add_argument('--cache', type=str, default=os.environ.get(CACHE_ENV), help=f'SQLite prediction cache (default: ${CACHE_ENV})')
+    parser.add_argument('-v', '--version', action='version', version=f"%(prog)s version {__version__}")
+
+    args = parser.parse_args()
+
+    worker = PredictionWorker(args.model_dir, args.batch_size, args.threads, args.backend, args.cache)
+    if args.stdin:
+        serve_stdin(worker)
+    else:
+        serve_socket(worker, args.socket)
+
+if __name__ == "__main__":
+    main()
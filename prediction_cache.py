@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import hashlib
+import sqlite3
+import argparse
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# Environment variable read by the stand-alone DNABERT-2 predictor scripts
+CACHE_ENV = "PROTECTIO_CACHE"
+
+# 2-bit code of each base, written as a base-4 digit
+_BASE_TO_DIGIT = str.maketrans("ACGT", "0123")
+_DROP_ACGT = str.maketrans("", "", "ACGT")
+
+# SQLite limits the number of bound parameters in a single statement
+_QUERY_CHUNK = 500
+
+def pack_sequence(sequence):
+    """
+    Pack a DNA sequence into 2 bits per base.
+
+    The first byte holds the sequence length, so a 40-nt window takes 11 bytes.
+    The DNABERT-2 tokenizer is case-sensitive, so lowercase bases are not packed:
+    such windows are never cached and always go to the model.
+
+    Args:
+        sequence (str): DNA sequence.
+
+    Returns:
+        bytes: Packed key, or None if the sequence contains anything but uppercase A/C/G/T.
+    """
+    if not sequence or len(sequence) > 255 or sequence.translate(_DROP_ACGT):
+        return None
+    digits = sequence.translate(_BASE_TO_DIGIT)
+    return bytes([len(sequence)]) + int(digits, 4).to_bytes((len(sequence) + 3) // 4, 'big')
+
+def unpack_sequence(key):
+    """
+    Restore a DNA sequence packed by pack_sequence.
+
+    Args:
+        key (bytes): Packed key.
+
+    Returns:
+        str: DNA sequence.
+    """
+    length = key[0]
+    value = int.from_bytes(key[1:], 'big')
+    bases = []
+    for _ in range(length):
+        bases.append("ACGT"[value & 3])
+        value >>= 2
+    return ''.join(reversed(bases))
+
+def label_to_id(label):
+    """Convert a 'LABEL_<n>' prediction to its class ID."""
+    return int(label.rsplit('_', 1)[1])
+
+def id_to_label(label_id):
+    """Convert a class ID to its 'LABEL_<n>' prediction."""
+    return f"LABEL_{label_id}"
+
+def model_fingerprint(model_dir):
+    """
+    Fingerprint a model directory so that a retrained model never hits stale entries.
+
+    Small files (configuration, tokenizer) are hashed in full; large weight files by
+    their size plus the first and last MiB, which avoids reading hundreds of MB on
+    every start.
+
+    Args:
+        model_dir (str): Model directory.
+
+    Returns:
+        str: Hex digest identifying the model version.
+    """
+    digest = hashlib.sha1()
+    chunk = 1 << 20
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if not os.path.isfile(path):
+            continue
+        digest.update(name.encode())
+        size = os.path.getsize(path)
+        digest.update(str(size).encode())
+        with open(path, 'rb') as file:
+            if size <= 2 * chunk:
+                digest.update(file.read())
+            else:
+                digest.update(file.read(chunk))
+                file.seek(-chunk, os.SEEK_END)
+                digest.update(file.read(chunk))
+    return digest.hexdigest()
+
+class PredictionCache:
+    """
+    On-disk prediction cache keyed by (predictor, version, packed 40-nt sequence).
+
+    Transcripts of the same gene share exons, so the same window appears in many
+    target.csv files; each is scored once per predictor version.
+    """
+
+    def __init__(self, path, predictor, version):
+        self.predictor = predictor
+        self.version = version
+        # protectio.py predict --workers writes from several processes at once
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "predictor TEXT NOT NULL, version TEXT NOT NULL, seq BLOB NOT NULL, label INTEGER NOT NULL, score REAL, "
+            "PRIMARY KEY (predictor, version, seq)) WITHOUT ROWID"
+        )
+        # LABEL_1 probability; NULL for windows cached before scores were stored
+        if 'score' not in [row[1] for row in self.connection.execute("PRAGMA table_info(predictions)")]:
+            try:
+                self.connection.execute("ALTER TABLE predictions ADD COLUMN score REAL")
+            except sqlite3.OperationalError:
+                # Another process added the column first
+                if 'score' not in [row[1] for row in self.connection.execute("PRAGMA table_info(predictions)")]:
+                    raise
+        self.connection.commit()
+
+    @classmethod
+    def for_model(cls, path, model_dir, backend='fp32'):
+        """Open the cache for a DNABERT-2 model directory run with the given backend."""
+        predictor = os.path.basename(os.path.normpath(model_dir))
+        version = model_fingerprint(model_dir)
+        # int8 and ONNX labels may differ from fp32 ones, so each backend is its own version
+        if backend != 'fp32':
+            version = f"{version}:{backend}"
+        return cls(path, predictor, version)
+
+    def get_many(self, sequences, with_scores=False):
+        """
+        Look up cached labels.
+
+        Args:
+            sequences (iterable): DNA sequences.
+            with_scores (bool): Return (label, score) and skip windows cached without a score.
+
+        Returns:
+            dict: {sequence: label or (label, score)} for the sequences found in the cache.
+        """
+        keys = {}
+        for sequence in sequences:
+            key = pack_sequence(sequence)
+            if key is not None:
+                keys[key] = sequence
+        key_list = list(keys)
+
+        found = {}
+        for start in range(0, len(key_list), _QUERY_CHUNK):
+            chunk = key_list[start:start + _QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT seq, label, score FROM predictions WHERE predictor = ? AND version = ? AND seq IN ({placeholders})",
+                [self.predictor, self.version] + chunk,
+            )
+            for key, label_id, score in rows:
+                if not with_scores:
+                    found[keys[key]] = id_to_label(label_id)
+                elif score is not None:
+                    found[keys[key]] = (id_to_label(label_id), score)
+        return found
+
+    def put_many(self, results):
+        """
+        Store labels.
+
+        Args:
+            results (iterable): (sequence, label) or (sequence, (label, score)) tuples.
+        """
+        rows = []
+        for sequence, label in results:
+            key = pack_sequence(sequence)
+            if key is not None:
+                label, score = label if isinstance(label, tuple) else (label, None)
+                rows.append((self.predictor, self.version, key, label_to_id(label), None if score is None else float(score)))
+        self.connection.executemany("INSERT OR REPLACE INTO predictions (predictor, version, seq, label, score) VALUES (?, ?, ?, ?, ?)", rows)
+        self.connection.commit()
+
+    def predict(self, sequences, predict_fn, with_scores=False):
+        """
+        Label sequences, running predict_fn only on unique sequences missing from the cache.
+
+        Args:
+            sequences (list): DNA sequences.
+            predict_fn (function): Takes a list of sequences and returns their labels
+                ((label, score) tuples if with_scores).
+            with_scores (bool): Return (label, score) tuples; windows cached without a
+                score are predicted again.
+
+        Returns:
+            list: Label (or (label, score)) for each sequence, in input order.
+        """
+        labels = self.get_many(sequences, with_scores)
+        missing = list(dict.fromkeys(seq for seq in sequences if seq not in labels))
+        if missing:
+            new_labels = list(predict_fn(missing))
+            self.put_many(zip(missing, new_labels))
+            labels.update(zip(missing, new_labels))
+        return [labels[seq] for seq in sequences]
+
+    def count(self):
+        """Return the number of cached windows for this predictor version."""
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM predictions WHERE predictor = ? AND version = ?",
+            (self.predictor, self.version),
+        ).fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+def open_cache_from_env(model_dir):
+    """
+    Open the cache named by PROTECTIO_CACHE for a DNABERT-2 model, if the variable is set.
+
+    Args:
+        model_dir (str): Model directory.
+
+    Returns:
+        PredictionCache: The cache, or None if PROTECTIO_CACHE is not set.
+    """
+    path = os.environ.get(CACHE_ENV)
+    if not path:
+        return None
+    return PredictionCache.for_model(path, model_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Show the number of cached predictions for a DNABERT-2 model.')
+    parser.add_argument('cache', type=str, help='Path to the cache database')
+    parser.add_argument('model_dir', type=str, help='DNABERT-2 model directory')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.cache):
+        print(f"Error: The file {args.cache} does not exist.")
+        sys.exit(1)
+
+    cache = PredictionCache.for_model(args.cache, args.model_dir)
+    print(f"{cache.predictor} ({cache.version}): {cache.count()} cached windows")
+    cache.close()
@@ -25,6 +25,11 @@ usage:
 
     optional arguments:
     -O Output directory (default: <Time_Stamp>_PROTECTiO_output)
+    -g Local Ensembl GTF file (use with -f to extract substrates without the REST API)
+    -f Local genome FASTA indexed with samtools faidx (use with -g)
+    -R Rebuild an existing output directory for new RefEx/Ensembl releases:
+       download RefEx and TogoID again and redo only the transcripts whose inputs changed
+    -w Inference worker processes, each pinned to its own CPU cores (default: one process)
     -h  Display this help and exit
     -v  Output version information and exit
 " >&2
@@ -38,6 +43,8 @@ extract_codon_sequences() {
   arg_output_dir_name=$3
   arg_editor=$4
   arg_cnt=$5
+  arg_gtf=$6
+  arg_genome=$7
 
   echo "${arg_cnt}: Original ID: ${original_id}, Ensembl transcript ID: ${ensembl_transcript_id}"
 
@@ -55,12 +62,16 @@ extract_codon_sequences() {
 
   if [ "${arg_editor}" = "CBE" ]; then
     # echo "Search CAA/CAG/CGA in CCDS sequences of ${ensembl_transcript_id}";
-    python extract_codon_sequence_with_exons.py "${ensembl_transcript_id}" "${arg_output_dir_name}/prediction_targets/${original_id}/${ensembl_transcript_id}"
-    sleep 0.072
-    # REST API is rate-limited at 55,000 requests per hour. 
-    # We set interval so that the 50,000 (<55,000) sequences can be downloaded per hour.
-    # Maximum sequence that can be downloaded within 1 sec: 50,000/60/60 = 13.88888889 [sequences]
-    # 1[sec] / 13.88888889 = 0.072
+    if [ -n "${arg_gtf}" ]; then
+      # Offline: read CDS coordinates and sequences from the local GTF and genome FASTA
+      python extract_codon_sequence_with_exons.py "${ensembl_transcript_id}" "${arg_output_dir_name}/prediction_targets/${original_id}/${ensembl_transcript_id}" \
+      --gtf "${arg_gtf}" --genome "${arg_genome}"
+    else
+      # REST API is rate-limited at 55,000 requests per hour.
+      # rest_client.py paces the requests from the X-RateLimit-* and Retry-After headers
+      # and retries rate-limited requests, so no fixed interval is needed here.
+      python extract_codon_sequence_with_exons.py "${ensembl_transcript_id}" "${arg_output_dir_name}/prediction_targets/${original_id}/${ensembl_transcript_id}"
+    fi
     # CBE substrate: NNNNNNNNNNNNNNNNNNNNCNNNNNNNNNNNNNNNNNNN
   else
     # echo "The ${arg_editor} is not allowed as the input. Aborting."
@@ -75,9 +86,13 @@ export -f extract_codon_sequences
 arg_database=""
 arg_editor=""
 arg_output_dir_name=$(date "+%Y%m%d%H%M%S")"_PROTECTiO_output"
+arg_gtf=""
+arg_genome=""
+arg_rebuild=""
+arg_workers=""
 
 # Get Options
-while getopts d:e:O:hv OPT; do
+while getopts d:e:O:g:f:w:Rhv OPT; do
     case $OPT in
     d) 
         arg_database="${OPTARG}"
@@ -88,6 +103,18 @@ while getopts d:e:O:hv OPT; do
     O) 
         arg_output_dir_name="${OPTARG}"
         ;;
+    g) 
+        arg_gtf="${OPTARG}"
+        ;;
+    f) 
+        arg_genome="${OPTARG}"
+        ;;
+    R) 
+        arg_rebuild="true"
+        ;;
+    w) 
+        arg_workers="${OPTARG}"
+        ;;
     h) 
         usage ; exit 0
         ;;
@@ -133,11 +160,31 @@ else
   exit 1;
 fi
 
+if [ -n "${arg_gtf}" ] || [ -n "${arg_genome}" ]; then
+  if [ -z "${arg_gtf}" ] || [ -z "${arg_genome}" ]; then
+    echo "-g and -f must be given together."
+    echo "prep_PROTECTiO_db.sh aborts..."
+    exit 1;
+  fi
+  echo "Use local annotation ${arg_gtf} and genome ${arg_genome}..."
+  # Build the CDS (and FASTA) index once before the parallel extraction starts
+  if [ ! -f "${arg_gtf}.cds.sqlite" ]; then
+    python local_genome.py "${arg_gtf}" --genome "${arg_genome}"
+  fi
+fi
+
 echo "Make output folder: ${arg_output_dir_name}"
 if [ ! -d "${arg_output_dir_name}" ]; then
   mkdir "${arg_output_dir_name}"
 fi
 
+if [ -n "${arg_rebuild}" ]; then
+  # Fetch the current RefEx table and TogoID conversion; the manifest tells what changed
+  echo "Rebuild ${arg_output_dir_name}: removing the previous RefEx and TogoID files..."
+  rm -rf "${arg_output_dir_name}/refex_db"
+  rm -f "${arg_output_dir_name}/refseq_enst.json" "${arg_output_dir_name}/affyprobe_enst.json"
+fi
+
 echo "---------------------------------------------------------------------"
 echo "|                  Download RefEx databases                         |"
 echo "---------------------------------------------------------------------"
@@ -275,64 +322,54 @@ echo "--------------------------------------------------------------------------
 echo "|                  Prepare substrate sequence from transcripts                   |"
 echo "----------------------------------------------------------------------------------"
 
-mkdir "${arg_output_dir_name}/prediction_targets"
+mkdir -p "${arg_output_dir_name}/prediction_targets"
 # 全体の要素数を取得
 total_id_cnt=$(jq -c '.[] | .results[]' "${id_reference_json}" | wc -l | xargs);
 echo "*********************************";
-echo "Search in ${total_id_cnt} using GNU Parallel"
-# カウンター
-id_counter=0;
-jq -c '.[] | .results[]' "${id_reference_json}" | while read -r result; do
-    id_counter=$((id_counter + 1))
-    original_id=$(echo "$result" | jq -r '.[0]')
-    ensembl_transcript_id=$(echo "$result" | jq -r '.[1]')
-    echo "$original_id $ensembl_transcript_id $arg_output_dir_name $arg_editor ${id_counter}/${total_id_cnt}"
-done | parallel --colsep ' ' -j 12 extract_codon_sequences {1} {2} {3} {4} {5};
+if [ -n "${arg_rebuild}" ]; then
+  # Re-extract and re-predict only the transcripts whose CDS or files changed (manifest.sqlite)
+  echo "Rebuild ${total_id_cnt} transcripts using the manifest"
+  if [ -n "${arg_gtf}" ]; then
+    python protectio.py rebuild --db "${arg_output_dir_name}" --ids "${id_reference_json}" \
+    --refex "${arg_output_dir_name}/refex_db/${fltr_db_data}" --gtf "${arg_gtf}" --genome "${arg_genome}";
+  else
+    python protectio.py rebuild --db "${arg_output_dir_name}" --ids "${id_reference_json}" \
+    --refex "${arg_output_dir_name}/refex_db/${fltr_db_data}";
+  fi
+elif [ -z "${arg_gtf}" ] && [ "${arg_editor}" = "CBE" ]; then
+  # Fetch transcripts from the Ensembl REST API in batches of 100 (POST lookup/id and sequence/region)
+  echo "Search in ${total_id_cnt} using batched Ensembl REST requests"
+  python protectio.py extract --db "${arg_output_dir_name}" --ids "${id_reference_json}";
+else
+  echo "Search in ${total_id_cnt} using GNU Parallel"
+  # カウンター
+  id_counter=0;
+  jq -c '.[] | .results[]' "${id_reference_json}" | while read -r result; do
+      id_counter=$((id_counter + 1))
+      original_id=$(echo "$result" | jq -r '.[0]')
+      ensembl_transcript_id=$(echo "$result" | jq -r '.[1]')
+      echo "$original_id $ensembl_transcript_id $arg_output_dir_name $arg_editor ${id_counter}/${total_id_cnt}"
+  done | parallel --colsep ' ' -j 12 extract_codon_sequences {1} {2} {3} {4} {5} "${arg_gtf}" "${arg_genome}";
+fi
 echo "*********************************";
 
 echo "----------------------------------------------------------------------------------"
 echo "|                  Predict RNA-offtargeting in transcripts                       |"
 echo "----------------------------------------------------------------------------------"
 
-# prediction target filepath
-target_files=$(find "${arg_output_dir_name}/prediction_targets" -type f -name "target.csv")
-# 全体の要素数を取得
-total_eval_target_num=$(echo "$target_files" | wc -l | xargs)
-# カウンター
-eval_target_counter=0;
-# CSV header
-# header="Sequence,Label"
 if [ "${arg_editor}" = "ABE" ]; then
   echo "Sorry... The ${arg_editor} option has not yet been implemented. Please wait for a while."
   echo "prep_PROTECTiO_db.sh aborts..."
   exit 1;
 elif [ "${arg_editor}" = "CBE" ]; then
-  for dna_fasta in ${target_files}; do
-      echo ""
-      eval_target_counter=$((eval_target_counter + 1))
-      # prediction target file
-      echo "${eval_target_counter}/${total_eval_target_num} Target file: ${dna_fasta}";
-      # prediction result file
-      eval_res="$(dirname ${dna_fasta})/eval_res.csv";
-      if [ ! -f "${eval_res}" ]; then
-        if [ -s "${dna_fasta}" ]; then
-          python pred_rna_offtarget_batch.py "${dna_fasta}" "${PWD}/DNABERT-2-CBE_Suzuki_v1/" "${eval_res}";
-        else
-          echo "The ${dna_fasta} is empty. Skipping processing.";
-        fi
-      else
-        echo "${eval_res} already exists. Skipping.";
-      fi
-      # Calculate effective substrate density (effective C substrate / all C substrate / transcript length )
-      if [ ! -f "$(dirname ${dna_fasta})/density.csv" ]; then
-        if [ -f "${eval_res}" ]; then
-          python calc_eff_substrate_density.py \
-          -e "${eval_res}" \
-          -t "$(dirname ${dna_fasta})/table.csv" \
-          -d "$(dirname ${dna_fasta})/density.csv";
-        fi
-      fi
-  done;
+  # Evaluate all target files in one process (eval_res.csv) and
+  # calculate effective substrate density (density.csv) for each of them
+  python protectio.py predict \
+  --db "${arg_output_dir_name}" \
+  --predictor pred_rna_offtarget_batch \
+  --model_dir "${PWD}/DNABERT-2-CBE_Suzuki_v1/" \
+  --label "" \
+  ${arg_workers:+--workers "${arg_workers}"};
 else
   echo "The ${arg_editor} is not allowed as the input. Please check the below help"
   usage
@@ -340,6 +377,18 @@ else
   exit 1;
 fi
 
+if [ -z "${arg_rebuild}" ]; then
+  # Record the Ensembl release, CDS checksums and file hashes so that -R can rebuild incrementally
+  echo "Record the database manifest..."
+  if [ -n "${arg_gtf}" ]; then
+    python protectio.py rebuild --db "${arg_output_dir_name}" --ids "${id_reference_json}" \
+    --refex "${arg_output_dir_name}/refex_db/${fltr_db_data}" --gtf "${arg_gtf}" --genome "${arg_genome}" --adopt;
+  else
+    python protectio.py rebuild --db "${arg_output_dir_name}" --ids "${id_reference_json}" \
+    --refex "${arg_output_dir_name}/refex_db/${fltr_db_data}" --adopt;
+  fi
+fi
+
 echo "--------------------------------------------------------------"
 echo "All processes were successfully done!"
 echo "--------------------------------------------------------------"
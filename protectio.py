@@ -0,0 +1,1077 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import csv
+import json
+import importlib
+import argparse
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# Windows read into memory before protectio.py predict evaluates them with several predictors
+DEFAULT_SWEEP_POOL_SIZE = 16384
+
+def find_target_dirs(db_dir):
+    """
+    List every transcript directory under <db_dir>/prediction_targets.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+
+    Returns:
+        list: Sorted list of prediction_targets/<original ID>/<ENST ID> directories.
+    """
+    targets_dir = os.path.join(db_dir, 'prediction_targets')
+    target_dirs = []
+    for id_entry in os.scandir(targets_dir):
+        if not id_entry.is_dir() or id_entry.name.startswith('.'):
+            continue
+        for enst_entry in os.scandir(id_entry.path):
+            if enst_entry.is_dir() and not enst_entry.name.startswith('.'):
+                target_dirs.append(enst_entry.path)
+    return sorted(target_dirs)
+
+def import_predictor(predictor):
+    """
+    Import a predictor script as a module.
+
+    Args:
+        predictor (str): Module name or path of the script (e.g. pred_motif_acw or pred_motif_acw.py).
+
+    Returns:
+        module: The imported predictor module.
+    """
+    script_dir, script_name = os.path.split(predictor)
+    module_name = os.path.splitext(script_name)[0]
+    if script_dir:
+        sys.path.insert(0, os.path.abspath(script_dir))
+    return importlib.import_module(module_name)
+
+def load_predictor(module, model_dir=None, batch_size=None, num_threads=None, cache_path=None, backend='fp32'):
+    """
+    Build a function that evaluates a list of target files with the given predictor.
+
+    A predictor module either defines MODEL_DIR (DNABERT-2 classifiers, the model is
+    loaded once here and windows of many files share micro-batches) or
+    main(input_file, output_file) (motif classifiers).
+
+    Args:
+        module (module): Predictor module returned by import_predictor.
+        model_dir (str): Model directory overriding the module's MODEL_DIR.
+        batch_size (int): DNABERT-2 windows per forward pass.
+        num_threads (int): DNABERT-2 intra-op CPU threads.
+        cache_path (str): DNABERT-2 prediction cache. Motif classifiers are not cached
+            because matching a motif is cheaper than looking it up.
+        backend (str): DNABERT-2 inference backend (fp32, int8 or onnx; see model_export.py).
+
+    Returns:
+        function: predict_files(jobs) yielding (target file, eval_res file, error) per job.
+    """
+    if model_dir is not None or hasattr(module, 'MODEL_DIR'):
+        from pred_rna_offtarget_batch import load_model, predict_target_files, DEFAULT_BATCH_SIZE, DEFAULT_POOL_SIZE
+        from prediction_cache import PredictionCache
+
+        if model_dir is None:
+            model_dir = module.MODEL_DIR
+        cache = PredictionCache.for_model(cache_path, model_dir, backend) if cache_path else None
+        tokenizer, model, device = load_model(model_dir, num_threads, backend)
+
+        def predict_files(jobs):
+            yield from predict_target_files(jobs, tokenizer, model, device, batch_size or DEFAULT_BATCH_SIZE, DEFAULT_POOL_SIZE, cache)
+
+        return predict_files
+
+    if hasattr(module, 'main'):
+        def predict_files(jobs):
+            for target_file, eval_res in jobs:
+                try:
+                    module.main(target_file, eval_res + ".tmp")
+                    os.replace(eval_res + ".tmp", eval_res)
+                except Exception as e:
+                    yield target_file, eval_res, e
+                    continue
+                yield target_file, eval_res, None
+
+        return predict_files
+
+    print(f"Error: {module.__name__} defines neither MODEL_DIR nor main(input_file, output_file).")
+    print("Use add_custom_predictor_eval.sh to run it as a stand-alone script.")
+    sys.exit(1)
+
+def predict_db(db_dir, predictor, label=None, model_dir=None, batch_size=None, num_threads=None, cache_path=None, matrix=False, backend='fp32',
+               workers=None, shard_size=None):
+    """
+    Evaluate every transcript in a PROTECTiO database in a single process (or in pinned workers).
+
+    Transcripts that already have <label>_eval_res.csv or <label>_density.csv keep them,
+    so an interrupted run can be resumed.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        predictor (str): Predictor script (module name or path).
+        label (str): Output file prefix. Defaults to the predictor name; "" writes eval_res.csv/density.csv.
+        model_dir (str): DNABERT-2 model directory overriding the predictor's MODEL_DIR.
+        batch_size (int): DNABERT-2 windows per forward pass.
+        num_threads (int): DNABERT-2 intra-op CPU threads (per worker with workers).
+        cache_path (str): DNABERT-2 prediction cache shared across transcripts and runs.
+        matrix (bool): Read the windows from the substrate matrix built by protectio.py matrix.
+        backend (str): DNABERT-2 inference backend (fp32, int8 or onnx; see model_export.py).
+        workers (int): Evaluate shards of target files in this many pinned worker processes.
+        shard_size (int): Target directories per shard (default: 200).
+    """
+    module = import_predictor(predictor)
+    if label is None:
+        label = module.__name__
+    prefix = f"{label}_" if label else ""
+
+    from db_manifest import record_predictor
+    record_predictor(db_dir, prefix, {'command': 'predict', 'predictor': predictor, 'label': label, 'model_dir': model_dir,
+                                      'batch_size': batch_size, 'num_threads': num_threads, 'cache_path': cache_path, 'backend': backend,
+                                      'workers': workers, 'shard_size': shard_size})
+
+    if matrix:
+        predict_matrix_db(db_dir, module, prefix, model_dir, batch_size, num_threads, cache_path, backend)
+        return
+
+    target_dirs = find_target_dirs(db_dir)
+    total_eval_target_num = len(target_dirs)
+    print(f"Found {total_eval_target_num} target directories.")
+
+    if workers is not None and workers > 1:
+        predict_sharded_db(target_dirs, predictor, prefix, workers, shard_size, model_dir, batch_size, num_threads, cache_path, backend)
+        calculate_densities(target_dirs, prefix)
+        return
+
+    # Collect the transcripts that still need a prediction
+    jobs = []
+    for target_dir in target_dirs:
+        target_file = os.path.join(target_dir, 'target.csv')
+        eval_res = os.path.join(target_dir, f"{prefix}eval_res.csv")
+        if has_prediction(target_dir, prefix):
+            print(f"{eval_res} already exists. Skipping.")
+        elif os.path.isfile(target_file) and os.path.getsize(target_file) > 0:
+            jobs.append((target_file, eval_res))
+        else:
+            print(f"The file {target_file} is empty. Skipping processing.")
+
+    # Load the predictor only when needed so a fully resumed run does not load a model
+    if jobs:
+        print(f"Predicting {len(jobs)} target files with {module.__name__}...")
+        predict_files = load_predictor(module, model_dir, batch_size, num_threads, cache_path, backend)
+        for eval_target_counter, (target_file, eval_res, error) in enumerate(predict_files(jobs), start=1):
+            if error is None:
+                print(f"{eval_target_counter}/{len(jobs)} Results saved to {eval_res}")
+            else:
+                print(f"{eval_target_counter}/{len(jobs)} Error evaluating {target_file}: {error}")
+
+    calculate_densities(target_dirs, prefix)
+
+def predict_sharded_db(target_dirs, predictor, prefix, workers, shard_size=None, model_dir=None, batch_size=None, num_threads=None, cache_path=None, backend='fp32'):
+    """
+    Evaluate the target files of a database in shards spread over pinned worker processes.
+
+    The sorted target directories are cut into fixed shards, so a resumed run finds the
+    same shards again: finished shards are skipped whole and an interrupted shard only
+    gets its transcripts without <prefix>eval_res.csv.
+
+    Args:
+        target_dirs (list): Target directories returned by find_target_dirs.
+        predictor (str): Predictor script (module name or path).
+        prefix (str): Output file prefix.
+        workers (int): Number of worker processes.
+        shard_size (int): Target directories per shard (default: 200).
+        model_dir (str): DNABERT-2 model directory overriding the predictor's MODEL_DIR.
+        batch_size (int): DNABERT-2 windows per forward pass.
+        num_threads (int): Cores and intra-op threads per worker (default: an even split).
+        cache_path (str): DNABERT-2 prediction cache shared by all workers.
+        backend (str): DNABERT-2 inference backend (fp32, int8 or onnx; see model_export.py).
+    """
+    from inference_workers import shard_target_dirs, predict_shards, DEFAULT_SHARD_SIZE
+
+    all_shards = shard_target_dirs(target_dirs, shard_size or DEFAULT_SHARD_SIZE)
+    shards = []
+    for shard_id, shard_dirs in enumerate(all_shards):
+        jobs = []
+        for target_dir in shard_dirs:
+            target_file = os.path.join(target_dir, 'target.csv')
+            if not has_prediction(target_dir, prefix) and os.path.isfile(target_file) and os.path.getsize(target_file) > 0:
+                jobs.append((target_file, os.path.join(target_dir, f"{prefix}eval_res.csv")))
+        if jobs:
+            shards.append((shard_id, jobs))
+    print(f"{len(all_shards) - len(shards)}/{len(all_shards)} shards already predicted.")
+    if not shards:
+        return
+
+    job_num = sum(len(jobs) for _, jobs in shards)
+    print(f"Predicting {job_num} target files in {len(shards)} shards with {min(workers, len(shards))} workers...")
+    finished_num = 0
+    error_num = 0
+    for shard_counter, (shard_id, results) in enumerate(predict_shards(shards, predictor, workers, num_threads, model_dir, batch_size, cache_path, backend), start=1):
+        for target_file, eval_res, error in results:
+            if error is not None:
+                print(f"Error evaluating {target_file}: {error}")
+                error_num += 1
+        finished_num += len(results)
+        print(f"{shard_counter}/{len(shards)} shards ({finished_num}/{job_num} target files) predicted; shard {shard_id} done")
+    if error_num:
+        print(f"{error_num} target files failed and will be retried on the next run.")
+
+def predict_many_db(db_dir, predictors, batch_size=None, num_threads=None, cache_path=None, pool_size=None, backend='fp32'):
+    """
+    Evaluate every transcript in a PROTECTiO database with several predictors in one sweep.
+
+    Each target.csv and table.csv is read once for all predictors. DNABERT-2 predictors
+    share one tokenization of the windows (pred_rna_offtarget_batch.predict_models),
+    motif predictors share one window matrix, and the <predictor>_density.csv of every
+    predictor is calculated from the labels in memory. DNABERT-2 predictors also write
+    their LABEL_1 probabilities to <predictor>_scores.npy. Other predictors run their
+    main() on each file. Predictions that already exist are kept.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        predictors (list): Predictor scripts (module names or paths); each writes <module name>_*.
+        batch_size (int): DNABERT-2 windows per forward pass.
+        num_threads (int): DNABERT-2 intra-op CPU threads.
+        cache_path (str): DNABERT-2 prediction cache shared across transcripts and runs.
+        pool_size (int): Windows read before the pool is evaluated (default: 16384).
+        backend (str): DNABERT-2 inference backend (fp32, int8 or onnx; see model_export.py).
+    """
+    import numpy as np
+    import pandas as pd
+    from db_manifest import record_predictor
+    from calc_eff_substrate_density import batch_density, write_density_files
+    from window_store import scores_file_for, write_scores
+
+    modules = [import_predictor(predictor) for predictor in predictors]
+    prefixes = [f"{module.__name__}_" for module in modules]
+    for predictor, module, prefix in zip(predictors, modules, prefixes):
+        record_predictor(db_dir, prefix, {'command': 'predict', 'predictor': predictor, 'label': module.__name__, 'model_dir': None,
+                                          'batch_size': batch_size, 'num_threads': num_threads, 'cache_path': cache_path, 'backend': backend})
+    model_indices = [i for i, module in enumerate(modules) if hasattr(module, 'MODEL_DIR')]
+    motif_indices = [i for i, module in enumerate(modules) if i not in model_indices and hasattr(module, 'MOTIF')]
+    other_indices = [i for i in range(len(modules)) if i not in model_indices and i not in motif_indices]
+
+    target_dirs = find_target_dirs(db_dir)
+    print(f"Found {len(target_dirs)} target directories.")
+
+    # Transcripts and the predictors they still need
+    jobs = []
+    for target_dir in target_dirs:
+        target_file = os.path.join(target_dir, 'target.csv')
+        if not os.path.isfile(target_file) or os.path.getsize(target_file) == 0:
+            print(f"The file {target_file} is empty. Skipping processing.")
+            continue
+        missing = [i for i, prefix in enumerate(prefixes) if not has_prediction(target_dir, prefix)]
+        if missing:
+            jobs.append((target_dir, missing))
+    print(f"Predicting {len(jobs)} transcripts with {', '.join(module.__name__ for module in modules)} in one sweep...")
+
+    # Load the models only when needed so a fully resumed run does not load them
+    models = []
+    if any(i in missing for _, missing in jobs for i in model_indices):
+        from pred_rna_offtarget_batch import load_models, predict_models, DEFAULT_BATCH_SIZE
+        from prediction_cache import PredictionCache
+
+        model_dirs = [modules[i].MODEL_DIR for i in model_indices]
+        models, device = load_models(model_dirs, num_threads, backend)
+        caches = [PredictionCache.for_model(cache_path, model_dir, backend) if cache_path else None for model_dir in model_dirs]
+    other_predict_files = {i: load_predictor(modules[i]) for i in other_indices if any(i in missing for _, missing in jobs)}
+
+    def evaluate(pool):
+        # {(pool index, predictor index): labels} of the predictions made in memory
+        pool_labels = {}
+        # Same for the LABEL_1 probabilities of the DNABERT-2 predictors
+        pool_scores = {}
+
+        # One tokenization per group of transcripts missing the same models
+        model_groups = {}
+        for index, (_, missing, _) in enumerate(pool):
+            group = tuple(i for i in model_indices if i in missing)
+            if group:
+                model_groups.setdefault(group, []).append(index)
+        for group, indices in model_groups.items():
+            sequences = [sequence for index in indices for sequence in pool[index][2]]
+            group_models = [models[model_indices.index(i)] for i in group]
+            group_caches = [caches[model_indices.index(i)] for i in group]
+            group_results = predict_models(sequences, group_models, device, batch_size or DEFAULT_BATCH_SIZE, group_caches)
+            for i, (labels, scores) in zip(group, group_results):
+                start = 0
+                for index in indices:
+                    pool_labels[(index, i)] = labels[start:start + len(pool[index][2])]
+                    pool_scores[(index, i)] = scores[start:start + len(pool[index][2])]
+                    start += len(pool[index][2])
+
+        if motif_indices:
+            from pred_motif import sequences_to_windows, match_motif, DEFAULT_OFFSET
+
+            windows, lengths = sequences_to_windows([sequence for _, _, sequences in pool for sequence in sequences])
+            for i in motif_indices:
+                mask = match_motif(windows, lengths, modules[i].MOTIF, getattr(modules[i], 'OFFSET', DEFAULT_OFFSET))
+                labels = np.where(mask, 'LABEL_1', 'LABEL_0').tolist()
+                start = 0
+                for index, (_, missing, sequences) in enumerate(pool):
+                    if i in missing:
+                        pool_labels[(index, i)] = labels[start:start + len(sequences)]
+                    start += len(sequences)
+
+        # Write the eval_res files, then the densities from the labels and one read of each table.csv
+        frames = {i: [] for i in range(len(modules))}
+        output_paths = {i: {} for i in range(len(modules))}
+        for index, (target_dir, missing, sequences) in enumerate(pool):
+            for i in missing:
+                eval_res = os.path.join(target_dir, f"{prefixes[i]}eval_res.csv")
+                if i in other_indices:
+                    for target_file, _, error in other_predict_files[i]([(os.path.join(target_dir, 'target.csv'), eval_res)]):
+                        if error is not None:
+                            print(f"Error evaluating {target_file}: {error}")
+                    continue
+                try:
+                    if (index, i) in pool_scores:
+                        scores_file = scores_file_for(eval_res)
+                        write_scores(scores_file + ".tmp.npy", pool_scores[(index, i)])
+                        os.replace(scores_file + ".tmp.npy", scores_file)
+                    # A partial eval_res.csv must never look finished to the resume logic
+                    with open(eval_res + ".tmp", 'w', newline='') as f:
+                        csv.writer(f).writerows([('flanking_sequence', 'pred')] + list(zip(sequences, pool_labels[(index, i)])))
+                    os.replace(eval_res + ".tmp", eval_res)
+                except Exception as e:
+                    print(f"Error evaluating {os.path.join(target_dir, 'target.csv')}: {e}")
+                    del pool_labels[(index, i)]
+            table_file = os.path.join(target_dir, 'table.csv')
+            needs_density = [i for i in missing if (index, i) in pool_labels and not os.path.isfile(os.path.join(target_dir, f"{prefixes[i]}density.csv"))]
+            if not needs_density or not os.path.isfile(table_file):
+                continue
+            try:
+                table_df = pd.read_csv(table_file, usecols=['flanking_sequence', 'amino_acid_len', 'rel_amino_acid_pos'])
+                if table_df['flanking_sequence'].tolist() != sequences:
+                    raise ValueError(f"{table_file} does not follow the window order of target.csv.")
+            except Exception as e:
+                print(f"Error calculating density for {target_dir}: {e}")
+                continue
+            for i in needs_density:
+                frames[i].append(pd.DataFrame({
+                    'transcript': index,
+                    'effective': np.asarray(pool_labels[(index, i)]) == 'LABEL_1',
+                    'amino_acid_len': table_df['amino_acid_len'].to_numpy(),
+                    'rel_amino_acid_pos': table_df['rel_amino_acid_pos'].to_numpy(),
+                }))
+                output_paths[i][index] = os.path.join(target_dir, f"{prefixes[i]}density.csv")
+        for i in range(len(modules)):
+            if frames[i]:
+                write_density_files(batch_density(pd.concat(frames[i], ignore_index=True)), output_paths[i])
+
+    pool = []
+    pooled_windows = 0
+    for done_num, (target_dir, missing) in enumerate(jobs, start=1):
+        target_file = os.path.join(target_dir, 'target.csv')
+        try:
+            with open(target_file, 'r') as f:
+                sequences = [line.strip() for line in f if line.strip()]
+        except Exception as e:
+            print(f"Error reading {target_file}: {e}")
+            continue
+        pool.append((target_dir, missing, sequences))
+        pooled_windows += len(sequences)
+        if pooled_windows >= (pool_size or DEFAULT_SWEEP_POOL_SIZE):
+            evaluate(pool)
+            print(f"{done_num}/{len(jobs)} transcripts evaluated")
+            pool = []
+            pooled_windows = 0
+    if pool:
+        evaluate(pool)
+        print(f"{len(jobs)}/{len(jobs)} transcripts evaluated")
+
+    # Densities of transcripts predicted earlier, packed or evaluated by main()
+    for prefix in prefixes:
+        calculate_densities(target_dirs, prefix)
+
+def predict_matrix_db(db_dir, module, prefix, model_dir=None, batch_size=None, num_threads=None, cache_path=None, backend='fp32'):
+    """
+    Evaluate the whole substrate matrix of a database in one sequential pass.
+
+    The class IDs are saved in <db_dir>/<prefix>matrix_labels.npy, aligned to the matrix
+    rows, and the density of every transcript is calculated from its slice. DNABERT-2
+    LABEL_1 probabilities are saved alongside in <prefix>matrix_scores.npy. A finished
+    labels file is kept, so an interrupted run only recalculates missing densities.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        module (module): Predictor module returned by import_predictor.
+        prefix (str): Output file prefix.
+        model_dir (str): DNABERT-2 model directory overriding the predictor's MODEL_DIR.
+        batch_size (int): DNABERT-2 windows per forward pass.
+        num_threads (int): DNABERT-2 intra-op CPU threads.
+        cache_path (str): DNABERT-2 prediction cache shared across transcripts and runs.
+        backend (str): DNABERT-2 inference backend (fp32, int8 or onnx; see model_export.py).
+    """
+    from window_store import SubstrateMatrix
+
+    substrate_matrix = SubstrateMatrix(db_dir)
+    labels_file = substrate_matrix.labels_file(prefix)
+    print(f"Found {len(substrate_matrix.entries)} transcripts ({len(substrate_matrix)} windows) in the substrate matrix.")
+
+    if os.path.isfile(labels_file):
+        print(f"{labels_file} already exists. Skipping.")
+    elif model_dir is not None or hasattr(module, 'MODEL_DIR'):
+        from pred_rna_offtarget_batch import load_model, predict_matrix, tokenizer_key, DEFAULT_BATCH_SIZE, DEFAULT_POOL_SIZE
+        from prediction_cache import PredictionCache
+
+        if model_dir is None:
+            model_dir = module.MODEL_DIR
+        cache = PredictionCache.for_model(cache_path, model_dir, backend) if cache_path else None
+        tokenizer, model, device = load_model(model_dir, num_threads, backend)
+        # Windows tokenized by protectio.py tokenize for this tokenizer skip tokenization
+        key = tokenizer_key(tokenizer)
+        tokens = substrate_matrix.read_tokens(key)
+        if tokens is not None:
+            print(f"Reading the tokens of {substrate_matrix.tokens_files(key)[0]}")
+        for predicted_num in predict_matrix(substrate_matrix, labels_file, tokenizer, model, device, batch_size or DEFAULT_BATCH_SIZE, DEFAULT_POOL_SIZE, cache,
+                                            substrate_matrix.scores_file(prefix), tokens):
+            print(f"{predicted_num}/{len(substrate_matrix)} windows predicted")
+    elif hasattr(module, 'MOTIF'):
+        from pred_motif import predict_motif_matrix, DEFAULT_OFFSET
+
+        predict_motif_matrix(substrate_matrix, {module.MOTIF: labels_file}, getattr(module, 'OFFSET', DEFAULT_OFFSET))
+    else:
+        print(f"Error: {module.__name__} defines neither MODEL_DIR nor MOTIF and cannot read the substrate matrix.")
+        sys.exit(1)
+
+    calculate_matrix_densities(substrate_matrix, prefix)
+
+def calculate_matrix_densities(substrate_matrix, prefix):
+    """
+    Calculate <prefix>density.csv of every transcript from the substrate matrix with one groupby.
+
+    Args:
+        substrate_matrix (SubstrateMatrix): Matrix built by protectio.py matrix.
+        prefix (str): Output file prefix of the predictor.
+    """
+    import numpy as np
+    from calc_eff_substrate_density import packed_window_labels, batch_density, write_density_files
+    from window_store import read_labels
+
+    windows_df = packed_window_labels(substrate_matrix.windows, read_labels(substrate_matrix.labels_file(prefix)))
+    transcript_ids = np.empty(len(windows_df), dtype=np.int64)
+    for transcript, (_, _, start, end) in enumerate(substrate_matrix.entries):
+        transcript_ids[start:end] = transcript
+    windows_df['transcript'] = transcript_ids
+    density_df = batch_density(windows_df)
+
+    output_paths = {}
+    for transcript, (refseq_id, enst_id, _, _) in enumerate(substrate_matrix.entries):
+        density_file = os.path.join(substrate_matrix.db_dir, 'prediction_targets', refseq_id, enst_id, f"{prefix}density.csv")
+        if not os.path.isfile(density_file):
+            output_paths[transcript] = density_file
+    try:
+        write_density_files(density_df, output_paths)
+    except Exception as e:
+        print(f"Error writing densities of {prefix}: {e}")
+
+def has_prediction(target_dir, prefix):
+    """Return True if the transcript has <prefix>eval_res.csv or its packed <prefix>labels.npy."""
+    from window_store import LABELS_SUFFIX
+
+    return (os.path.isfile(os.path.join(target_dir, f"{prefix}eval_res.csv"))
+            or os.path.isfile(os.path.join(target_dir, f"{prefix}{LABELS_SUFFIX}")))
+
+def calculate_densities(target_dirs, prefix):
+    """
+    Calculate <prefix>density.csv for every transcript that has <prefix>eval_res.csv but no density yet.
+
+    The windows of all transcripts are joined to their labels by row and aggregated with
+    one groupby (calc_eff_substrate_density.batch_density).
+
+    Args:
+        target_dirs (list): Transcript directories from find_target_dirs.
+        prefix (str): Output file prefix of the predictor.
+    """
+    import pandas as pd
+    from calc_eff_substrate_density import read_window_labels, packed_window_labels, batch_density, write_density_files
+    from window_store import WINDOWS_FILE, LABELS_SUFFIX, read_windows, read_labels
+
+    frames = []
+    output_paths = {}
+    for target_dir in target_dirs:
+        eval_res = os.path.join(target_dir, f"{prefix}eval_res.csv")
+        labels_file = os.path.join(target_dir, f"{prefix}{LABELS_SUFFIX}")
+        density_file = os.path.join(target_dir, f"{prefix}density.csv")
+        if os.path.isfile(density_file):
+            continue
+        try:
+            if os.path.isfile(eval_res):
+                windows_df = read_window_labels(eval_res, os.path.join(target_dir, 'table.csv'))
+            elif os.path.isfile(labels_file):
+                # Transcripts packed by protectio.py pack
+                windows_df = packed_window_labels(read_windows(os.path.join(target_dir, WINDOWS_FILE)), read_labels(labels_file))
+            else:
+                continue
+            if len(windows_df) == 0:
+                raise ValueError("No substrate window to calculate the density from.")
+        except Exception as e:
+            print(f"Error calculating density for {eval_res}: {e}")
+            continue
+        frames.append(windows_df.assign(transcript=len(output_paths)))
+        output_paths[len(output_paths)] = density_file
+
+    if frames:
+        write_density_files(batch_density(pd.concat(frames, ignore_index=True)), output_paths)
+
+def motif_db(db_dir, motifs, offset=None, files_per_chunk=None, matrix=False):
+    """
+    Evaluate every transcript in a PROTECTiO database with several IUPAC motifs in one pass.
+
+    Each motif writes pred_motif_<motif>_eval_res.csv and pred_motif_<motif>_density.csv,
+    the same files as pred_motif_acw.py / pred_motif_wcw.py for ACW / WCW. Transcripts
+    that already have the eval_res file of a motif keep it.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        motifs (list): IUPAC motifs (e.g. ACW, WCW, TCN).
+        offset (int): 0-based start of the motifs in the windows (default: 19).
+        files_per_chunk (int): Target files loaded into one window matrix.
+        matrix (bool): Read the windows from the substrate matrix built by protectio.py matrix.
+    """
+    from pred_motif import predict_motif_files, predict_motif_matrix, motif_label, DEFAULT_OFFSET, DEFAULT_FILES_PER_CHUNK
+
+    if offset is None:
+        offset = DEFAULT_OFFSET
+    prefixes = {motif: f"{motif_label(motif, offset)}_" for motif in motifs}
+
+    from db_manifest import record_predictor
+    for motif, prefix in prefixes.items():
+        record_predictor(db_dir, prefix, {'command': 'motif', 'motif': motif, 'offset': offset})
+
+    if matrix:
+        from window_store import SubstrateMatrix
+
+        substrate_matrix = SubstrateMatrix(db_dir)
+        labels_files = {motif: substrate_matrix.labels_file(prefix) for motif, prefix in prefixes.items()}
+        labels_files = {motif: labels_file for motif, labels_file in labels_files.items() if not os.path.isfile(labels_file)}
+        if labels_files:
+            print(f"Matching {', '.join(labels_files)} in {len(substrate_matrix)} windows...")
+            predict_motif_matrix(substrate_matrix, labels_files, offset)
+        for prefix in prefixes.values():
+            calculate_matrix_densities(substrate_matrix, prefix)
+        return
+
+    target_dirs = find_target_dirs(db_dir)
+    print(f"Found {len(target_dirs)} target directories.")
+
+    # Collect the transcripts that still need a prediction for at least one motif
+    jobs = []
+    for target_dir in target_dirs:
+        target_file = os.path.join(target_dir, 'target.csv')
+        eval_res_files = {}
+        for motif, prefix in prefixes.items():
+            if not has_prediction(target_dir, prefix):
+                eval_res_files[motif] = os.path.join(target_dir, f"{prefix}eval_res.csv")
+        if not eval_res_files:
+            continue
+        if os.path.isfile(target_file) and os.path.getsize(target_file) > 0:
+            jobs.append((target_file, eval_res_files))
+        else:
+            print(f"The file {target_file} is empty. Skipping processing.")
+
+    if jobs:
+        print(f"Matching {', '.join(motifs)} in {len(jobs)} target files...")
+        for target_file, eval_res, error in predict_motif_files(jobs, motifs, offset, files_per_chunk or DEFAULT_FILES_PER_CHUNK):
+            if error is not None:
+                print(f"Error evaluating {target_file}: {error}")
+
+    for prefix in prefixes.values():
+        calculate_densities(target_dirs, prefix)
+
+def read_id_pairs(id_json):
+    """
+    Read (original ID, Ensembl transcript ID) pairs from a TogoID conversion result.
+
+    Args:
+        id_json (str): JSON written by refseq2ensg.py or affy2ensg.py.
+
+    Returns:
+        list: (original ID, Ensembl transcript ID) tuples.
+    """
+    with open(id_json, 'r') as f:
+        responses = json.load(f)
+    return [(result[0], result[1]) for response in responses for result in response['results']]
+
+def extract_db(db_dir, id_json, batch_size=100, local_genome=None):
+    """
+    Write CBE substrate sequences of every transcript into <db_dir>/prediction_targets.
+
+    Transcripts are fetched from the Ensembl REST API in batches: one POST lookup/id per
+    batch gives their CDS, and POST sequence/region (50 regions per request) gives their
+    padded exons, so the request count scales with batches instead of exons. Transcripts
+    that already have a non-empty target.csv are skipped, so an interrupted build can be
+    resumed.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        id_json (str): TogoID conversion result (refseq_enst.json or affyprobe_enst.json).
+        batch_size (int): Transcripts per batch.
+        local_genome (LocalGenome): Read the CDS and sequences from a local GTF and genome
+            FASTA instead of the REST API.
+    """
+    from extract_codon_sequence_with_exons import extract_transcripts_batch, extract_transcripts_local
+    from rest_client import RestClientError
+
+    id_pairs = read_id_pairs(id_json)
+    print(f"Found {len(id_pairs)} ID pairs.")
+
+    jobs = []
+    for original_id, transcript_id in id_pairs:
+        output_dir = os.path.join(db_dir, 'prediction_targets', original_id, transcript_id)
+        target_file = os.path.join(output_dir, 'target.csv')
+        if os.path.isfile(target_file) and os.path.getsize(target_file) > 0:
+            print(f"Target file {target_file} already exists. Skipping.")
+            continue
+        jobs.append((transcript_id, output_dir))
+
+    for start in range(0, len(jobs), batch_size):
+        batch = jobs[start:start + batch_size]
+        print(f"{start + len(batch)}/{len(jobs)} Extracting substrate sequences of {len(batch)} transcripts...")
+        try:
+            if local_genome is not None:
+                extract_transcripts_local(batch, local_genome)
+            else:
+                extract_transcripts_batch(batch)
+        except RestClientError as e:
+            # The transcripts of this batch keep no target.csv and are retried on the next run
+            print(f"Error: {e}")
+
+def scan_db(db_dir, id_json, fasta_file, processes=None):
+    """
+    Write CBE substrate sequences of every transcript from one CDS FASTA file.
+
+    Instead of one extraction per transcript, the whole FASTA (e.g. Ensembl
+    Homo_sapiens.GRCh38.cds.all.fa) is translated and scanned in a process pool and
+    target.csv / table.csv are written in the same layout as protectio.py extract.
+    Windows are cut from the spliced CDS (scan_transcriptome.cds_substrates).
+    Transcripts that already have a non-empty target.csv are skipped.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        id_json (str): TogoID conversion result (refseq_enst.json or affyprobe_enst.json).
+        fasta_file (str): CDS FASTA whose record IDs are Ensembl transcript IDs.
+        processes (int): Worker processes (default: number of CPUs).
+    """
+    from scan_transcriptome import scan_transcriptome, write_substrate_files
+
+    output_dirs = {}
+    for original_id, transcript_id in dict.fromkeys(read_id_pairs(id_json)):
+        output_dir = os.path.join(db_dir, 'prediction_targets', original_id, transcript_id)
+        target_file = os.path.join(output_dir, 'target.csv')
+        if os.path.isfile(target_file) and os.path.getsize(target_file) > 0:
+            continue
+        output_dirs.setdefault(transcript_id.split('.')[0], []).append(output_dir)
+    print(f"Scanning {fasta_file} for {len(output_dirs)} transcripts...")
+
+    transcript_num = 0
+    window_num = 0
+    for transcript_id, target_text, table_text, record_window_num in scan_transcriptome(fasta_file, set(output_dirs), processes):
+        # A transcript listed twice in the FASTA keeps its first record
+        for output_dir in output_dirs.pop(transcript_id, []):
+            write_substrate_files(output_dir, target_text, table_text)
+            transcript_num += 1
+            window_num += record_window_num
+    print(f"{window_num} substrate windows of {transcript_num} transcripts written.")
+    if output_dirs:
+        print(f"{len(output_dirs)} transcripts are not in {fasta_file}: {', '.join(sorted(output_dirs)[:10])}{' ...' if len(output_dirs) > 10 else ''}")
+
+def rebuild_db(db_dir, id_json, refex_file=None, gtf=None, genome=None, release=None, batch_size=100, adopt=False):
+    """
+    Bring an existing database up to date with new Ensembl and RefEx releases.
+
+    <db_dir>/manifest.sqlite records, per transcript, the Ensembl release, a checksum of
+    its CDS and SHA-256 hashes of its files. A transcript is extracted again (and all its
+    predictions dropped) only if its CDS checksum changed or its extraction files differ
+    from the recorded hashes; a modified or missing prediction file only drops that
+    predictor's files. Transcripts no longer listed in id_json are removed. Every
+    predictor run recorded by protectio.py predict / motif is then run again, which only
+    evaluates the transcripts without predictions, and the ESD store and substrate matrix
+    are refreshed if they exist.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        id_json (str): TogoID conversion result of the new RefEx release.
+        refex_file (str): Filtered RefEx table, to report the tissues whose transcripts changed.
+        gtf (str): Local Ensembl GTF file (use with genome instead of the REST API).
+        genome (str): Local genome FASTA (use with gtf).
+        release (str): Ensembl release label (default: from the GTF name or the REST API).
+        batch_size (int): Transcripts per extraction batch.
+        adopt (bool): Record transcripts missing from the manifest as they are instead of
+            extracting them again (for databases built before the manifest existed).
+    """
+    import shutil
+    from db_manifest import (open_manifest, fetch_release, fetch_cds_checksums, stale_outputs, hash_outputs,
+                             remove_prediction_files, recorded_predictors, read_refex_rows, changed_tissues)
+
+    local_genome = None
+    if gtf is not None:
+        from local_genome import LocalGenome
+        local_genome = LocalGenome(gtf, genome)
+    if release is None:
+        release = fetch_release(gtf)
+
+    id_pairs = list(dict.fromkeys(read_id_pairs(id_json)))
+    transcript_ids = list(dict.fromkeys(transcript_id for _, transcript_id in id_pairs))
+    print(f"Checking {len(id_pairs)} ID pairs against Ensembl release {release}...")
+    checksums = fetch_cds_checksums(transcript_ids, local_genome)
+
+    connection = open_manifest(db_dir)
+    recorded = {(refseq_id, enst_id): cds_checksum for refseq_id, enst_id, cds_checksum
+                in connection.execute("SELECT refseq_id, enst_id, cds_checksum FROM transcripts")}
+    recorded_hashes = {}
+    for refseq_id, enst_id, file_name, sha256 in connection.execute("SELECT refseq_id, enst_id, file_name, sha256 FROM outputs"):
+        recorded_hashes.setdefault((refseq_id, enst_id), {})[file_name] = sha256
+
+    # Remove transcripts that are no longer listed
+    listed = set(id_pairs)
+    removed = []
+    existing_dirs = find_target_dirs(db_dir) if os.path.isdir(os.path.join(db_dir, 'prediction_targets')) else []
+    for target_dir in existing_dirs:
+        refseq_dir, enst_id = os.path.split(target_dir)
+        key = (os.path.basename(refseq_dir), enst_id)
+        if key not in listed:
+            shutil.rmtree(target_dir)
+            if not os.listdir(refseq_dir):
+                os.rmdir(refseq_dir)
+            removed.append(key)
+
+    # Drop the files whose inputs changed
+    reextracted = []
+    stale_prediction_num = 0
+    for key in id_pairs:
+        target_dir = os.path.join(db_dir, 'prediction_targets', *key)
+        target_file = os.path.join(target_dir, 'target.csv')
+        if key not in recorded:
+            if adopt and os.path.isfile(target_file) and os.path.getsize(target_file) > 0:
+                continue
+            changed = True
+        else:
+            extraction_changed, stale_prefixes = stale_outputs(target_dir, recorded_hashes.get(key, {}))
+            changed = extraction_changed or recorded[key] != checksums.get(key[1])
+        if changed:
+            if os.path.isdir(target_dir):
+                shutil.rmtree(target_dir)
+            reextracted.append(key)
+            continue
+        for prefix in stale_prefixes:
+            remove_prediction_files(target_dir, prefix)
+            stale_prediction_num += 1
+    print(f"{len(removed)} transcripts removed, {len(reextracted)} to extract again, {stale_prediction_num} stale predictions.")
+
+    extract_db(db_dir, id_json, batch_size, local_genome)
+
+    # The substrate matrix follows the transcripts; build_matrix drops its predictions as well
+    from window_store import MATRIX_FILE
+    if os.path.isfile(os.path.join(db_dir, MATRIX_FILE)) and (removed or reextracted):
+        build_matrix(db_dir)
+
+    for prefix, command in recorded_predictors(connection).items():
+        print(f"Updating predictions of {prefix or '(default)'}...")
+        if command['command'] == 'motif':
+            motif_db(db_dir, [command['motif']], command['offset'])
+        else:
+            predict_db(db_dir, command['predictor'], command['label'], command['model_dir'],
+                       command['batch_size'], command['num_threads'], command['cache_path'], backend=command.get('backend', 'fp32'),
+                       workers=command.get('workers'), shard_size=command.get('shard_size'))
+
+    store_path = os.path.join(db_dir, 'esd_store.sqlite')
+    if os.path.isfile(store_path):
+        from esd_store import remove_transcripts
+        remove_transcripts(store_path, removed + reextracted)
+        consolidate(db_dir, store_path)
+
+    if refex_file is not None:
+        tissues, refex_rows = read_refex_rows(refex_file)
+        old_refex_rows = dict(connection.execute("SELECT refseq_id, tissue_values FROM refex"))
+        if old_refex_rows:
+            tissue_changes = changed_tissues(old_refex_rows, refex_rows, tissues)
+            print(f"Tissues to aggregate again: {', '.join(tissue_changes) if tissue_changes else 'none'}")
+        connection.execute("DELETE FROM refex")
+        connection.executemany("INSERT INTO refex VALUES (?, ?)", refex_rows.items())
+
+    # Record the state of every listed transcript
+    connection.executemany("DELETE FROM transcripts WHERE refseq_id = ? AND enst_id = ?", removed)
+    connection.executemany("DELETE FROM outputs WHERE refseq_id = ? AND enst_id = ?", removed + reextracted)
+    for key in id_pairs:
+        target_dir = os.path.join(db_dir, 'prediction_targets', *key)
+        connection.execute("INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?)", key + (release, checksums.get(key[1])))
+        connection.execute("DELETE FROM outputs WHERE refseq_id = ? AND enst_id = ?", key)
+        if os.path.isdir(target_dir):
+            connection.executemany("INSERT INTO outputs VALUES (?, ?, ?, ?)",
+                                   [key + item for item in hash_outputs(target_dir).items()])
+    connection.execute("INSERT OR REPLACE INTO metadata VALUES ('release', ?)", (release,))
+    connection.commit()
+    connection.close()
+    print(f"Manifest updated for Ensembl release {release}.")
+
+def consolidate(db_dir, store_path=None, include_windows=False):
+    """
+    Gather the ESD values of every predictor into one SQLite store.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        store_path (str): Store to write. Defaults to <db_dir>/esd_store.sqlite.
+        include_windows (bool): Also store every table.csv and eval_res.csv row.
+    """
+    from esd_store import consolidate_db, list_predictors
+
+    if store_path is None:
+        store_path = os.path.join(db_dir, 'esd_store.sqlite')
+    record_num = consolidate_db(db_dir, store_path, include_windows)
+    print(f"{record_num} density records saved to {store_path}")
+    for predictor, transcript_num in list_predictors(store_path):
+        print(f"  {predictor or '(default)'}: {transcript_num} transcripts")
+
+def build_matrix(db_dir):
+    """
+    Concatenate the windows of every transcript into <db_dir>/substrate_matrix.npy.
+
+    Predictions and tokens of the previous matrix (<prefix>matrix_labels.npy,
+    <prefix>matrix_scores.npy and matrix_tokens_*) are removed, so predict and motif
+    --matrix run again on the new rows.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+    """
+    from window_store import build_substrate_matrix, MATRIX_FILE, MATRIX_LABELS_SUFFIX, MATRIX_SCORES_SUFFIX, MATRIX_TOKENS_PREFIX
+
+    # Predictions and tokens of the previous matrix no longer line up with its rows
+    for file_name in os.listdir(db_dir):
+        if file_name.startswith(MATRIX_TOKENS_PREFIX) or file_name.endswith((MATRIX_LABELS_SUFFIX, MATRIX_SCORES_SUFFIX)):
+            os.remove(os.path.join(db_dir, file_name))
+    target_dirs = find_target_dirs(db_dir)
+    print(f"Found {len(target_dirs)} target directories.")
+    window_num = build_substrate_matrix(db_dir, target_dirs)
+    print(f"{window_num} windows saved to {os.path.join(db_dir, MATRIX_FILE)}")
+
+def tokenize_db(db_dir, model_dir, pool_size=None):
+    """
+    Tokenize the substrate matrix once for a DNABERT-2 tokenizer.
+
+    predict --matrix then reads the token IDs of every window from
+    <db_dir>/matrix_tokens_<tokenizer key>.npy, for every model sharing the tokenizer.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        model_dir (str): DNABERT-2 model directory whose tokenizer is used.
+        pool_size (int): Windows tokenized at a time.
+    """
+    from transformers import AutoTokenizer
+    from pred_rna_offtarget_batch import tokenize_matrix, tokenizer_key, DEFAULT_POOL_SIZE
+    from window_store import SubstrateMatrix
+
+    substrate_matrix = SubstrateMatrix(db_dir)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
+    for tokenized_num in tokenize_matrix(substrate_matrix, tokenizer, pool_size or DEFAULT_POOL_SIZE):
+        print(f"{tokenized_num}/{len(substrate_matrix)} windows tokenized")
+    print(f"Tokens saved to {substrate_matrix.tokens_files(tokenizer_key(tokenizer))[0]}")
+
+def pack(db_dir, remove_text=False):
+    """
+    Convert the windows and predictions of every transcript to the 2-bit packed format.
+
+    table.csv becomes windows.npy (10-byte packed window and its codon metadata) and every
+    <prefix>eval_res.csv becomes <prefix>labels.npy (one uint8 class ID per window).
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        remove_text (bool): Delete table.csv and the eval_res.csv files once packed.
+    """
+    from window_store import pack_transcript
+
+    target_dirs = find_target_dirs(db_dir)
+    print(f"Found {len(target_dirs)} target directories.")
+    packed_num = 0
+    for target_dir in target_dirs:
+        if not os.path.isfile(os.path.join(target_dir, 'target.csv')) or os.path.getsize(os.path.join(target_dir, 'target.csv')) == 0:
+            continue
+        try:
+            pack_transcript(target_dir, remove_text)
+            packed_num += 1
+        except Exception as e:
+            print(f"Error packing {target_dir}: {e}")
+    print(f"{packed_num} transcripts packed.")
+
+def export_model(model_dir, output_dir, int8=False, opset=None):
+    """
+    Export a DNABERT-2 model to an ONNX model directory for protectio.py predict --backend onnx.
+
+    Args:
+        model_dir (str): DNABERT-2 model directory, e.g. DNABERT-2-CBE_Suzuki_v1/.
+        output_dir (str): Directory to write.
+        int8 (bool): Quantise the ONNX weights to int8.
+        opset (int): ONNX opset version (default: 14).
+    """
+    from model_export import export_onnx, DEFAULT_OPSET
+
+    onnx_file = export_onnx(model_dir, output_dir, int8, opset or DEFAULT_OPSET)
+    print(f"{'int8' if int8 else 'fp32'} ONNX model saved to {onnx_file}")
+
+def parity(model_dir, references, backend='fp32', batch_size=None, num_threads=None):
+    """
+    Compare the labels of a model run with a backend to reference fp32 eval_res.csv files.
+
+    Args:
+        model_dir (str): DNABERT-2 model directory (an ONNX export for backend 'onnx').
+        references (list): eval_res.csv files, or directories containing one.
+        backend (str): Inference backend (fp32, int8 or onnx).
+        batch_size (int): Windows per forward pass.
+        num_threads (int): Intra-op CPU threads.
+
+    Returns:
+        float: Fraction of windows whose label matches the reference.
+    """
+    from pred_rna_offtarget_batch import load_model
+    from model_export import parity_check
+
+    eval_res_files = [os.path.join(reference, 'eval_res.csv') if os.path.isdir(reference) else reference for reference in references]
+    tokenizer, model, device = load_model(model_dir, num_threads, backend)
+    window_num = 0
+    identical_num = 0
+    total_seconds = 0.0
+    for eval_res_file, windows, identical, seconds in parity_check(eval_res_files, tokenizer, model, device, batch_size):
+        print(f"{eval_res_file}: {identical}/{windows} labels identical, {windows / seconds if seconds else 0:.1f} windows/s")
+        window_num += windows
+        identical_num += identical
+        total_seconds += seconds
+    agreement = identical_num / window_num if window_num else 1.0
+    print(f"{backend}: {identical_num}/{window_num} labels identical ({agreement:.4%}), "
+          f"{window_num / total_seconds if total_seconds else 0:.1f} windows/s")
+    return agreement
+
+def main():
+    from model_export import BACKENDS, DEFAULT_BACKEND
+
+    parser = argparse.ArgumentParser(description='PROTECTiO database tools.')
+    parser.add_argument('-v', '--version', action='version', version=f"%(prog)s version {__version__}")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    predict_parser = subparsers.add_parser('predict', help='Evaluate every transcript in a database with one predictor and calculate its ESD.')
+    predict_parser.add_argument('--db', required=True, help='PROTECTiO database directory (contains prediction_targets/)')
+    predict_parser.add_argument('--predictor', required=True, action='append', help='Predictor script, e.g. pred_motif_acw or pred_dnabert2_cbe_snv1.py (repeat to evaluate several predictors in one sweep)')
+    predict_parser.add_argument('--label', default=None, help='Output file prefix (default: predictor name; "" writes eval_res.csv/density.csv)')
+    predict_parser.add_argument('--model_dir', default=None, help="DNABERT-2 model directory overriding the predictor's MODEL_DIR")
+    predict_parser.add_argument('--batch_size', type=int, default=None, help='DNABERT-2 windows per forward pass (default: 128)')
+    predict_parser.add_argument('--threads', type=int, default=None, help="DNABERT-2 intra-op CPU threads (default: torch's choice)")
+    predict_parser.add_argument('--cache', default=None, help='SQLite prediction cache reused across transcripts and runs (DNABERT-2 only)')
+    predict_parser.add_argument('--matrix', action='store_true', help='Read the windows from the substrate matrix (protectio.py matrix) in one sequential pass')
+    predict_parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                                help='DNABERT-2 inference: fp32 (PyTorch, default), int8 (dynamically quantised, CPU) or onnx (ONNX Runtime on a --model_dir written by export)')
+    predict_parser.add_argument('--workers', type=int, default=None,
+                                help='Worker processes, each pinned to its own cores with --threads intra-op threads (default: one process)')
+    predict_parser.add_argument('--shard_size', type=int, default=None, help='Target directories per worker shard, the unit of resume with --workers (default: 200)')
+
+    motif_parser = subparsers.add_parser('motif', help='Evaluate every transcript in a database with several IUPAC motifs in one pass and calculate their ESD.')
+    motif_parser.add_argument('--db', required=True, help='PROTECTiO database directory (contains prediction_targets/)')
+    motif_parser.add_argument('--motif', required=True, action='append', help='IUPAC motif, e.g. ACW (repeat for several motifs)')
+    motif_parser.add_argument('--offset', type=int, default=None, help='0-based start of the motif in the 40-nt window (default: 19)')
+    motif_parser.add_argument('--files_per_chunk', type=int, default=None, help='Target files loaded into one window matrix (default: 2000)')
+    motif_parser.add_argument('--matrix', action='store_true', help='Read the windows from the substrate matrix (protectio.py matrix)')
+
+    matrix_parser = subparsers.add_parser('matrix', help='Concatenate the windows of every transcript into one memory-mapped substrate matrix.')
+    matrix_parser.add_argument('--db', required=True, help='PROTECTiO database directory (contains prediction_targets/)')
+
+    tokenize_parser = subparsers.add_parser('tokenize', help='Tokenize the substrate matrix once for a DNABERT-2 tokenizer, reused by predict --matrix.')
+    tokenize_parser.add_argument('--db', required=True, help='PROTECTiO database directory (contains substrate_matrix.npy)')
+    tokenize_parser.add_argument('--model_dir', required=True, help='DNABERT-2 model directory whose tokenizer is used')
+    tokenize_parser.add_argument('--pool_size', type=int, default=None, help='Windows tokenized at a time (default: 16384)')
+
+    rebuild_parser = subparsers.add_parser('rebuild', help='Update a database to new Ensembl/RefEx releases, redoing only the transcripts whose inputs changed.')
+    rebuild_parser.add_argument('--db', required=True, help='PROTECTiO database directory (contains prediction_targets/)')
+    rebuild_parser.add_argument('--ids', required=True, help='TogoID conversion result of the new RefEx release, e.g. refseq_enst.json')
+    rebuild_parser.add_argument('--refex', default=None, help='Filtered RefEx table, to report the tissues whose transcripts changed')
+    rebuild_parser.add_argument('--gtf', default=None, help='Local Ensembl GTF file (use with --genome instead of the REST API)')
+    rebuild_parser.add_argument('--genome', default=None, help='Local genome FASTA indexed with samtools faidx (use with --gtf)')
+    rebuild_parser.add_argument('--release', default=None, help='Ensembl release label (default: from the GTF name or the REST API)')
+    rebuild_parser.add_argument('--batch_size', type=int, default=100, help='Transcripts per extraction batch (default: 100)')
+    rebuild_parser.add_argument('--adopt', action='store_true', help='Record transcripts missing from the manifest as they are (databases built before the manifest existed)')
+
+    pack_parser = subparsers.add_parser('pack', help='Convert table.csv and eval_res.csv files to 2-bit packed windows.npy and labels.npy files.')
+    pack_parser.add_argument('--db', required=True, help='PROTECTiO database directory (contains prediction_targets/)')
+    pack_parser.add_argument('--remove_text', action='store_true', help='Delete table.csv and the eval_res.csv files once packed (target.csv is kept)')
+
+    extract_parser = subparsers.add_parser('extract', help='Write CBE substrate sequences of every transcript using batched Ensembl REST requests.')
+    extract_parser.add_argument('--db', required=True, help='PROTECTiO database directory (prediction_targets/ is created in it)')
+    extract_parser.add_argument('--ids', required=True, help='TogoID conversion result, e.g. refseq_enst.json')
+    extract_parser.add_argument('--batch_size', type=int, default=100, help='Transcripts per batch (default: 100)')
+    extract_parser.add_argument('--gtf', default=None, help='Local Ensembl GTF file (use with --genome instead of the REST API)')
+    extract_parser.add_argument('--genome', default=None, help='Local genome FASTA indexed with samtools faidx (use with --gtf)')
+
+    scan_parser = subparsers.add_parser('scan', help='Write CBE substrate sequences of every transcript from one CDS FASTA file in a process pool.')
+    scan_parser.add_argument('--db', required=True, help='PROTECTiO database directory (prediction_targets/ is created in it)')
+    scan_parser.add_argument('--ids', required=True, help='TogoID conversion result, e.g. refseq_enst.json')
+    scan_parser.add_argument('--fasta', required=True, help='CDS FASTA, e.g. Homo_sapiens.GRCh38.cds.all.fa')
+    scan_parser.add_argument('--processes', type=int, default=None, help='Worker processes (default: number of CPUs)')
+
+    consolidate_parser = subparsers.add_parser('consolidate', help='Gather every density.csv of a database into one SQLite ESD store.')
+    consolidate_parser.add_argument('--db', required=True, help='PROTECTiO database directory (contains prediction_targets/)')
+    consolidate_parser.add_argument('--store', default=None, help='Store to write (default: <db>/esd_store.sqlite)')
+    consolidate_parser.add_argument('--windows', action='store_true', help='Also store every table.csv and eval_res.csv row')
+
+    export_parser = subparsers.add_parser('export', help='Export a DNABERT-2 model to ONNX (optionally int8) for predict --backend onnx.')
+    export_parser.add_argument('--model_dir', required=True, help='DNABERT-2 model directory, e.g. DNABERT-2-CBE_Suzuki_v1/')
+    export_parser.add_argument('--output', required=True, help='Output model directory (model.onnx with the tokenizer and configuration)')
+    export_parser.add_argument('--int8', action='store_true', help='Quantise the ONNX weights to int8 with ONNX Runtime')
+    export_parser.add_argument('--opset', type=int, default=None, help='ONNX opset version (default: 14)')
+
+    parity_parser = subparsers.add_parser('parity', help='Compare the labels of a backend with reference fp32 eval_res.csv files.')
+    parity_parser.add_argument('--model_dir', required=True, help='DNABERT-2 model directory (the export directory for --backend onnx)')
+    parity_parser.add_argument('--reference', required=True, nargs='+', help='Reference eval_res.csv files or directories containing one, e.g. the *_snv1pred_* directories of benchmarking/A_validation_using_rAPOBEC1_test_dataset')
+    parity_parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help='Inference backend to check (default: fp32)')
+    parity_parser.add_argument('--batch_size', type=int, default=None, help='Windows per forward pass (default: 128)')
+    parity_parser.add_argument('--threads', type=int, default=None, help="Intra-op CPU threads (default: torch's choice)")
+    parity_parser.add_argument('--min_agreement', type=float, default=None, help='Exit with status 1 if fewer labels than this fraction are identical, e.g. 0.99')
+
+    args = parser.parse_args()
+
+    if args.command == 'consolidate':
+        consolidate(args.db, args.store, args.windows)
+    elif args.command == 'motif':
+        motif_db(args.db, args.motif, args.offset, args.files_per_chunk, args.matrix)
+    elif args.command == 'matrix':
+        build_matrix(args.db)
+    elif args.command == 'tokenize':
+        tokenize_db(args.db, args.model_dir, args.pool_size)
+    elif args.command == 'rebuild':
+        if (args.gtf is None) != (args.genome is None):
+            parser.error("--gtf and --genome must be given together")
+        rebuild_db(args.db, args.ids, args.refex, args.gtf, args.genome, args.release, args.batch_size, args.adopt)
+    elif args.command == 'pack':
+        pack(args.db, args.remove_text)
+    elif args.command == 'extract':
+        if (args.gtf is None) != (args.genome is None):
+            parser.error("--gtf and --genome must be given together")
+        local_genome = None
+        if args.gtf is not None:
+            from local_genome import LocalGenome
+            local_genome = LocalGenome(args.gtf, args.genome)
+        extract_db(args.db, args.ids, args.batch_size, local_genome)
+    elif args.command == 'scan':
+        scan_db(args.db, args.ids, args.fasta, args.processes)
+    elif args.command == 'export':
+        export_model(args.model_dir, args.output, args.int8, args.opset)
+    elif args.command == 'parity':
+        agreement = parity(args.model_dir, args.reference, args.backend, args.batch_size, args.threads)
+        if args.min_agreement is not None and agreement < args.min_agreement:
+            print(f"Error: Label agreement is below {args.min_agreement}.")
+            sys.exit(1)
+    elif args.command == 'predict':
+        if args.backend == 'onnx' and args.model_dir is None:
+            parser.error("--backend onnx needs --model_dir with a model written by protectio.py export")
+        if args.workers is not None and args.matrix:
+            parser.error("--workers evaluates target files and cannot be combined with --matrix")
+        if len(args.predictor) == 1:
+            predict_db(args.db, args.predictor[0], args.label, args.model_dir, args.batch_size, args.threads, args.cache, args.matrix, args.backend,
+                       args.workers, args.shard_size)
+        elif args.label is not None or args.model_dir is not None or args.matrix or args.workers is not None:
+            parser.error("--label, --model_dir, --matrix and --workers take a single --predictor")
+        else:
+            predict_many_db(args.db, args.predictor, args.batch_size, args.threads, args.cache, backend=args.backend)
+
+if __name__ == "__main__":
+    main()
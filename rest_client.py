@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import asyncio
+import random
+import time
+
+import aiohttp
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+ENSEMBL_REST_SERVER = "https://rest.ensembl.org"
+TOGOID_API_SERVER = "https://api.togoid.dbcls.jp"
+
+# Responses worth retrying: rate limiting and temporary server-side failures
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class RestClientError(Exception):
+    """Raised when a request fails permanently or runs out of retries."""
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate follows the server instead of a hard-coded sleep.
+
+    The rate drops by half on every 429 and creeps back towards max_rate on success
+    (additive increase, multiplicative decrease). Retry-After pauses all requests, and
+    the X-RateLimit-Remaining/X-RateLimit-Reset headers sent by Ensembl cap the rate
+    so that the hourly quota lasts until it is reset.
+    """
+
+    def __init__(self, max_rate, min_rate=0.1):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until the next request may be sent."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Hold back every request for the given number of seconds."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update(self, status, headers):
+        """Adjust the rate after a response."""
+        if status == 429:
+            self.rate = max(self.min_rate, self.rate / 2)
+        else:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            try:
+                remaining, reset = int(remaining), max(1.0, float(reset))
+            except ValueError:
+                return
+            if remaining <= 0:
+                self.pause(reset)
+            else:
+                self.rate = max(self.min_rate, min(self.rate, remaining / reset))
+
+class AsyncRestClient:
+    """
+    JSON REST client sharing one pool of keep-alive connections across requests.
+
+    Use it as an async context manager:
+
+        async with AsyncRestClient() as client:
+            status, data = await client.get_json(url)
+
+    Transient failures (429, 5xx, dropped connections, timeouts) are retried with
+    exponential backoff, honouring Retry-After. Other responses are returned to the
+    caller together with their status code.
+    """
+
+    def __init__(self, requests_per_second=15, max_connections=8, max_retries=6, backoff=1.0, timeout=60):
+        self.requests_per_second = requests_per_second
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = None
+        self.limiter = None
+
+    async def __aenter__(self):
+        # The limiter's lock must be created inside the running event loop
+        self.limiter = AdaptiveRateLimiter(self.requests_per_second)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={'Accept': 'application/json'},
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    async def request(self, method, url, params=None, payload=None):
+        """
+        Send a request and decode its JSON body.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Request URL.
+            params (dict): Query parameters.
+            payload (object): JSON request body.
+
+        Returns:
+            tuple: (status code, decoded JSON or None).
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            delay = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+            try:
+                async with self.session.request(method, url, params=params, json=payload) as response:
+                    self.limiter.update(response.status, response.headers)
+                    if response.status not in RETRY_STATUSES:
+                        try:
+                            data = await response.json(content_type=None)
+                        except ValueError:
+                            data = None
+                        return response.status, data
+                    error = f"HTTP {response.status}"
+                    retry_after = response.headers.get('Retry-After')
+                    if retry_after is not None:
+                        try:
+                            delay = float(retry_after)
+                        except ValueError:
+                            pass
+                        self.limiter.pause(delay)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+            if attempt < self.max_retries:
+                await asyncio.sleep(delay)
+        raise RestClientError(f"{method} {url} failed after {self.max_retries + 1} attempts ({error})")
+
+    async def get_json(self, url, params=None):
+        """GET a JSON resource. Returns (status code, decoded JSON or None)."""
+        return await self.request('GET', url, params=params)
+
+    async def post_json(self, url, payload, params=None):
+        """POST a JSON body. Returns (status code, decoded JSON or None)."""
+        return await self.request('POST', url, params=params, payload=payload)
+
+async def convert_togoid_ids(id_chunks, route, requests_per_second=2):
+    """
+    Convert chunks of IDs with the TogoID API concurrently.
+
+    Args:
+        id_chunks (list): Lists of IDs, up to 500 per chunk (one request each).
+        route (str): TogoID conversion route (e.g. refseq_rna,ensembl_transcript).
+        requests_per_second (float): Maximum request rate.
+
+    Returns:
+        list: Decoded JSON response of each chunk, in input order.
+    """
+    async def convert(client, ids):
+        params = {'ids': ','.join(ids), 'route': route, 'report': 'all', 'format': 'json'}
+        status, data = await client.get_json(f"{TOGOID_API_SERVER}/convert", params=params)
+        if status != 200 or data is None:
+            raise RestClientError(f"TogoID returned HTTP {status} for {ids[0]}..{ids[-1]}")
+        return data
+
+    async with AsyncRestClient(requests_per_second=requests_per_second, max_connections=4) as client:
+        return await asyncio.gather(*(convert(client, ids) for ids in id_chunks))
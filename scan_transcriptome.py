@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import os
+from multiprocessing import Pool
+
+from Bio.Seq import Seq
+
+from extract_codon_sequence_with_exons import codon_changes_amino_acid
+from get_cbe_substrate_20nt import read_fasta
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# The target C sits at index 20 of a 40-nt window, as in extract_codon_sequence_with_exons.py
+UPSTREAM_LENGTH = 20
+DOWNSTREAM_LENGTH = 19
+
+# Records sent to a worker process at a time
+RECORDS_PER_TASK = 64
+
+TABLE_HEADER = "flanking_sequence,amino_acid,codon,pos,amino_acid_len,rel_amino_acid_pos\n"
+
+def read_records(fasta_file):
+    """
+    Read the records of a (CDS) FASTA file one by one.
+
+    Yields:
+        tuple: (record ID without version, sequence)
+    """
+    with open(fasta_file, 'rb') as handle:
+        record_id = None
+        chunks = []
+        for current_id, chunk in read_fasta(handle):
+            if chunk is not None:
+                chunks.append(chunk)
+                continue
+            if record_id is not None:
+                yield record_id, b"".join(chunks).decode()
+            record_id = current_id.split('.')[0]
+            chunks = []
+        if record_id is not None:
+            yield record_id, b"".join(chunks).decode()
+
+def cds_substrates(cds_sequence):
+    """
+    Find the codons of a CDS that C->T editing turns into a stop codon and their 40-nt windows.
+
+    The codons are those of extract_codon_sequence_with_exons.write_substrates, but the
+    windows are cut from the spliced CDS instead of the genome, so a codon near an exon
+    junction gets the neighbouring exon as context instead of the intron. Codons closer
+    to the CDS ends than the window flanks are skipped.
+
+    Args:
+        cds_sequence (str): CDS from the start codon.
+
+    Returns:
+        tuple: (target.csv text, table.csv rows text, number of windows)
+    """
+    cds_sequence = cds_sequence.upper()
+    amino_acid_sequence = str(Seq(cds_sequence[:len(cds_sequence) // 3 * 3]).translate(to_stop=True))
+    amino_acid_len = len(amino_acid_sequence)
+
+    target_lines = []
+    table_lines = []
+    for pos in range(amino_acid_len):
+        codon = cds_sequence[pos * 3:pos * 3 + 3]
+        if 'C' not in codon or not codon_changes_amino_acid(codon, onlystop=True):
+            continue
+        c_position = pos * 3 + codon.find('C')
+        if c_position < UPSTREAM_LENGTH or c_position + DOWNSTREAM_LENGTH >= len(cds_sequence):
+            continue
+        flanking_sequence = cds_sequence[c_position - UPSTREAM_LENGTH:c_position + DOWNSTREAM_LENGTH + 1]
+        rel_amino_acid_pos = round(float(pos / amino_acid_len), 5)
+        target_lines.append(f"{flanking_sequence}\n")
+        table_lines.append(f"{flanking_sequence},{amino_acid_sequence[pos]},{codon},{pos},{amino_acid_len},{rel_amino_acid_pos}\n")
+    return "".join(target_lines), "".join(table_lines), len(target_lines)
+
+def _scan_record(record):
+    record_id, cds_sequence = record
+    return (record_id,) + cds_substrates(cds_sequence)
+
+def scan_transcriptome(fasta_file, transcript_ids=None, processes=None):
+    """
+    Find the substrates of every record of a CDS FASTA file in a process pool.
+
+    Args:
+        fasta_file (str): CDS FASTA, e.g. Ensembl Homo_sapiens.GRCh38.cds.all.fa.
+        transcript_ids (set): Only scan these transcript IDs (all records if None).
+        processes (int): Worker processes (default: number of CPUs; 1 scans in-process).
+
+    Yields:
+        tuple: (transcript ID, target.csv text, table.csv rows text, number of windows)
+            in the order of the FASTA file.
+    """
+    records = (record for record in read_records(fasta_file) if transcript_ids is None or record[0] in transcript_ids)
+    if processes == 1:
+        yield from map(_scan_record, records)
+        return
+    with Pool(processes or os.cpu_count()) as pool:
+        yield from pool.imap(_scan_record, records, chunksize=RECORDS_PER_TASK)
+
+def write_substrate_files(output_dir, target_text, table_text):
+    """Write target.csv and table.csv of one transcript like extract_codon_sequence_with_exons.py."""
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'table.csv'), 'w') as table_file:
+        table_file.write(TABLE_HEADER + table_text)
+    # target.csv last: a non-empty target.csv marks the transcript as extracted
+    with open(os.path.join(output_dir, 'target.csv'), 'w') as flanking_file:
+        flanking_file.write(target_text)
@@ -1,12 +1,15 @@
 import os
 import pandas as pd
 import seaborn as sns
-import matplotlib.pyplot as plt
+from matplotlib import cm
 from scipy import stats
 import numpy as np
 from statsmodels.stats.power import TTestIndPower
+from statsmodels.stats.multitest import multipletests
 import argparse
 
+from plot_rendering import PLOT_MODES, new_figure, render_plots
+
 # Function to read and combine CSV files from a directory
 def load_and_combine_data(files):
     data_frames = []
@@ -19,27 +22,55 @@ def load_and_combine_data(files):
     combined_df = pd.concat(data_frames, ignore_index=True)
     return combined_df
 
+# Function to ensure "All" is the first tissue category
+def order_tissues(df):
+    df['Tissue'] = pd.Categorical(df['Tissue'], categories=['All'] + sorted([t for t in df['Tissue'].unique() if t != 'All']))
+
+def draw_violinplot(df, column):
+    fig, ax = new_figure((8, 12))  # Vertical violin plot with tall figure size
+
+    # Create a violin plot
+    sns.violinplot(x='Tissue', y=column, data=df, ax=ax)
+    ax.set_title(f'Violin plot of {column} across tissues')
+    ax.tick_params(axis='x', labelrotation=90)
+    fig.tight_layout()
+    return fig
+
 # Function to generate vertical violin plots for each column and ensure "All" is the first category
-def generate_violinplots(df, output_dir):
+def generate_violinplots(df, output_dir, plot_jobs):
     value_columns = df.columns[(df.columns != 'ENST_ID') & (df.columns != 'Tissue')]  # All columns except 'Tissue'
+    order_tissues(df)
     for column in value_columns:
-        plt.figure(figsize=(8, 12))  # Vertical violin plot with tall figure size
-        
-        # Ensure "All" is the leftmost category
-        df['Tissue'] = pd.Categorical(df['Tissue'], categories=['All'] + sorted([t for t in df['Tissue'].unique() if t != 'All']))
-
-        # Create a violin plot
-        sns.violinplot(x='Tissue', y=column, data=df)
-        plt.title(f'Violin plot of {column} across tissues')
-        plt.xticks(rotation=90)
-        plt.tight_layout()
-        
-        # Save the plot as a 350dpi PNG
-        plt.savefig(os.path.join(output_dir, f'{column}_violinplot.png'), dpi=350)
-        plt.close()
+        # Queue the plot (saved as a PNG by render_plots)
+        plot_jobs.append((draw_violinplot, (df[['Tissue', column]], column), os.path.join(output_dir, f'{column}_violinplot.png')))
+
+def draw_circular_barplot(labels, values, sem_values, column):
+    angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False).tolist()  # Create angles for each tissue
+
+    fig, ax = new_figure((16, 8), polar=True)
+
+    # Use a colormap for different tissue colors
+    colors = cm.viridis(np.linspace(0, 1, len(labels)))
+
+    # Plot the bars for each tissue
+    bars = ax.bar(angles, values, yerr=sem_values, width=0.3, color=colors, alpha=0.7, edgecolor='black', capsize=5)
+
+    # Add labels for each tissue, leaving space for "All"
+    ax.set_xticks(angles)
+    ax.set_xticklabels([])
+    ax.tick_params(axis='x', which='both', length=0)  # Set tick length to 0 to hide the tick marks
+
+    # Add a legend on the right side
+    ax.legend(bars, labels, bbox_to_anchor=(1.05, 1), loc='upper left', title="Tissues")
+
+    # Remove the "All" position and place axis labels there
+    ax.text(0, 0, "Tissues", va='center', ha='center', fontsize=14, weight='bold')
+
+    ax.set_title(f'Circular Barplot of {column} with SEM')
+    return fig
 
 # Function to calculate statistics and generate circular bar plots with SEM
-def generate_circular_barplot(df, output_dir):
+def generate_circular_barplot(df, output_dir, plot_jobs):
     value_columns = df.columns[(df.columns != 'ENST_ID') & (df.columns != 'Tissue')]
     for column in value_columns:
         # Calculate mean, SEM, and sample size for each tissue, excluding "All"
@@ -61,41 +92,42 @@ def generate_circular_barplot(df, output_dir):
         if labels.empty:
             print(f"Skipping {column} circular plot due to lack of labels.")
             continue
-        
-        angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False).tolist()  # Create angles for each tissue
+
         values = stats_data['Mean'].fillna(0)
         sem_values = stats_data['SEM'].fillna(0)
 
-        if len(values) == 0 or len(angles) == 0:
+        if len(values) == 0:
             print(f"Skipping {column} circular plot due to missing values.")
             continue
 
-        fig, ax = plt.subplots(figsize=(16, 8), subplot_kw=dict(polar=True))
-
-        # Use a colormap for different tissue colors
-        colors = plt.cm.viridis(np.linspace(0, 1, len(labels)))
+        # Queue the circular barplot
+        plot_jobs.append((draw_circular_barplot, (labels.to_list(), values.to_list(), sem_values.to_list(), column), os.path.join(output_dir, f'{column}_circular_barplot.png')))
 
-        # Plot the bars for each tissue
-        bars = ax.bar(angles, values, yerr=sem_values, width=0.3, color=colors, alpha=0.7, edgecolor='black', capsize=5)
+def draw_barplot(labels, values, sem_values, column):
+    # viridis カラーマップを使って色を生成
+    colors = cm.viridis(np.linspace(0, 1, len(labels)))
 
-        # Add labels for each tissue, leaving space for "All"
-        ax.set_xticks(angles)
-        ax.set_xticklabels([])
-        ax.tick_params(axis='x', which='both', length=0)  # Set tick length to 0 to hide the tick marks
+    # バープロットの描画
+    fig, ax = new_figure((12, 6))
 
-        # Add a legend on the right side
-        ax.legend(bars, labels, bbox_to_anchor=(1.05, 1), loc='upper left', title="Tissues")
+    # バーの描画
+    ax.bar(labels, values, yerr=sem_values, capsize=5, color=colors, edgecolor='black')
 
-        # Remove the "All" position and place axis labels there
-        ax.text(0, 0, "Tissues", va='center', ha='center', fontsize=14, weight='bold')
+    # グラフの装飾
+    ax.set_title(f'Barplot of {column} with SEM', fontsize=16)
+    ax.set_xlabel('Tissue', fontsize=14)
+    ax.set_ylabel(f'{column} (Mean ± SEM)', fontsize=14)
 
-        plt.title(f'Circular Barplot of {column} with SEM')
+    # バーラベルを自動調整
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
 
-        # Save the circular barplot
-        plt.savefig(os.path.join(output_dir, f'{column}_circular_barplot.png'), dpi=350)
-        plt.close()
+    # レイアウトを調整してラベルが切れないようにする
+    fig.tight_layout()
+    return fig
 
-def generate_barplot(df, output_dir):
+def generate_barplot(df, output_dir, plot_jobs):
     value_columns = df.columns[(df.columns != 'ENST_ID') & (df.columns != 'Tissue')]
     for column in value_columns:
         # 各ティッシュに対して平均、SEM、およびサンプルサイズを計算（"All" を除く）
@@ -132,39 +164,20 @@ def generate_barplot(df, output_dir):
             print(f"Skipping {column} bar plot due to missing values.")
             continue
 
-        # viridis カラーマップを使って色を生成
-        colors = plt.cm.viridis(np.linspace(0, 1, len(labels)))
+        # バーグラフを描画キューに追加
+        plot_jobs.append((draw_barplot, ([str(label) for label in labels], values.to_list(), sem_values.to_list(), column), os.path.join(output_dir, f'{column}_barplot.png')))
 
-        # バープロットの描画
-        fig, ax = plt.subplots(figsize=(12, 6))
+# Multiple-testing corrections applied to the tissue comparisons of each column (statsmodels multipletests)
+CORRECTION_METHODS = ('none', 'bonferroni', 'holm', 'fdr_bh')
 
-        # バーの描画
-        bars = ax.bar(labels, values, yerr=sem_values, capsize=5, color=colors, edgecolor='black')
-
-        # グラフの装飾
-        ax.set_title(f'Barplot of {column} with SEM', fontsize=16)
-        ax.set_xlabel('Tissue', fontsize=14)
-        ax.set_ylabel(f'{column} (Mean ± SEM)', fontsize=14)
-
-        # バーラベルを自動調整
-        plt.xticks(rotation=45, ha='right')
-
-        # ファイルに保存
-        plt.tight_layout()  # レイアウトを調整してラベルが切れないようにする
-        plt.savefig(os.path.join(output_dir, f'{column}_barplot.png'), dpi=350)
-        plt.close()
-
-# Function to calculate confidence intervals and extract significant rows
-def extract_significant_rows(df, tissue, column, output_dir, alpha):
-    # Filter "All" tissue data
-    tissue_df = df[df['Tissue'] == tissue]
-    all_values = df[df['Tissue'] == 'All'][column].dropna()
-    
-    # Calculate confidence interval for "All" based on adjusted alpha
+# Function to calculate the confidence interval of "All"
+def calculate_all_confidence_interval(all_values, alpha):
     mean_all = np.mean(all_values)
     sem_all = stats.sem(all_values)
-    ci = stats.t.interval(1 - alpha, len(all_values) - 1, loc=mean_all, scale=sem_all)
+    return stats.t.interval(1 - alpha, len(all_values) - 1, loc=mean_all, scale=sem_all)
 
+# Function to extract rows outside the confidence interval of "All"
+def extract_significant_rows(tissue_df, tissue, column, output_dir, ci):
     # Filter data for rows above the upper bound
     upper_df = tissue_df[(tissue_df[column] > ci[1])]
     if not upper_df.empty:
@@ -185,68 +198,104 @@ def extract_significant_rows(df, tissue, column, output_dir, alpha):
         })
         lower_metascape_df.to_csv(os.path.join(output_dir, f'{tissue}_{column}_lower_outliers_for_metascape.csv'), index=False)
 
+# Function to run Welch's t-tests of every tissue against "All" at once
+def welchs_ttest_against_all(tissue_samples, all_data):
+    # Tissues with at least two values are tested; the others are reported as lacking data
+    tested = [tissue for tissue, data in tissue_samples.items() if len(data) > 1]
+    if not tested:
+        return {}
+
+    # One row per tissue, padded with NaN to the largest tissue
+    matrix = np.full((len(tested), max(len(tissue_samples[tissue]) for tissue in tested)), np.nan)
+    for row, tissue in enumerate(tested):
+        matrix[row, :len(tissue_samples[tissue])] = tissue_samples[tissue]
+    ttest_result = stats.ttest_ind(matrix, all_data[np.newaxis, :], axis=1, equal_var=False, nan_policy='omit')
+    return {tissue: (ttest_result.statistic[row], ttest_result.pvalue[row]) for row, tissue in enumerate(tested)}
 
 # Function to perform Welch's t-test with power-adjusted alpha
-def perform_welchs_ttest_with_power_adjusted_alpha(df, output_dir, desired_power=0.8):
+def perform_welchs_ttest_with_power_adjusted_alpha(df, output_dir, desired_power=0.8, correction='none'):
     value_columns = df.columns[(df.columns != 'ENST_ID') & (df.columns != 'Tissue')]
     power_analysis = TTestIndPower()
-    
+
+    # Row positions of each tissue, in the order of the groupby
+    tissue_indices = df.groupby('Tissue').indices
+
     for column in value_columns:
         df[column] = pd.to_numeric(df[column], errors='coerce')
-        grouped_data = df.groupby('Tissue')[column].apply(list).to_dict()
+        values = df[column].to_numpy(dtype=float)
+        tissues = df.groupby('Tissue')[column].count().index
+        samples = {}
+        for tissue in tissues:
+            tissue_values = values[tissue_indices.get(tissue, [])]
+            samples[tissue] = tissue_values[~np.isnan(tissue_values)]
+
+        if 'All' in samples:
+            all_data = samples['All']
 
-        if 'All' in grouped_data:
-            all_data = [val for val in grouped_data['All'] if pd.notna(val)]
-            
             if len(all_data) > 1:
+                tissue_samples = {tissue: data for tissue, data in samples.items() if tissue != 'All'}
+                ttest_results = welchs_ttest_against_all(tissue_samples, all_data)
+
+                # Adjust the p-values of all tissue comparisons of this column together
+                adjusted_pvalues = {}
+                if correction != 'none' and ttest_results:
+                    adjusted = multipletests([pvalue for _, pvalue in ttest_results.values()], method=correction)[1]
+                    adjusted_pvalues = dict(zip(ttest_results, adjusted))
+
+                # The confidence interval of "All" is computed once per alpha
+                all_values = df.iloc[tissue_indices['All']][column].dropna()
+                ci_cache = {}
+
                 column_log_file = os.path.join(output_dir, f'{column}_welch_ttest_results.log')
                 with open(column_log_file, 'w') as log:
                     log.write(f"Welch's t-test results for {column}, comparing All vs other tissues:\n")
 
-                    for tissue, data in grouped_data.items():
-                        if tissue != 'All':
-                            other_tissue_data = [val for val in data if pd.notna(val)]
-                            
-                            if len(other_tissue_data) > 1:
-                                # Perform Welch's t-test
-                                ttest_result = stats.ttest_ind(other_tissue_data, all_data, equal_var=False)
-                                
-                                # Determine adjusted alpha based on desired power
-                                alpha = 0.05  # Default
-                                enable_power_adjustment = False# May be too strict
-                                if enable_power_adjustment:
-                                    # Calculate effect size
-                                    pooled_std = np.sqrt(np.var(all_data) / len(all_data) + np.var(other_tissue_data) / len(other_tissue_data))
-                                    effect_size = abs(np.mean(all_data) - np.mean(other_tissue_data)) / pooled_std
-                                    if effect_size > 0:
-                                        try:
-                                            alpha = 1.0 - power_analysis.solve_power(effect_size=effect_size, power=desired_power, nobs1=len(all_data), ratio=len(other_tissue_data) / len(all_data), alternative='two-sided')
-                                            log.write(f"Set alpha level with power={desired_power:.10f}.\n")
-                                        except:
-                                            log.write(f"Unable to calculate adjusted alpha for {tissue} vs All due to insufficient effect size or sample size.\n")
-                                            pass  # Use default alpha if power calculation fails
-
-                                log.write(f'Comparing {tissue} vs All with alpha={alpha:.10f}:\n')
-                                log.write(f'  t-statistic: {ttest_result.statistic}, p-value: {ttest_result.pvalue}\n')
-
-                                # Check for statistical significance
-                                if ttest_result.pvalue < alpha:
-                                    log.write(f'  Statistically significant difference (p-value < {alpha:.10f})\n')
-                                    # Extract and save rows outside confidence interval with adjusted alpha
-                                    extract_significant_rows(df, tissue, column, output_dir, alpha)
-                                else:
-                                    log.write(f'  No statistically significant difference (p-value >= {alpha:.10f})\n')
-                                log.write('-' * 50 + '\n')
+                    for tissue, other_tissue_data in tissue_samples.items():
+                        if tissue in ttest_results:
+                            statistic, pvalue = ttest_results[tissue]
+
+                            # Determine adjusted alpha based on desired power
+                            alpha = 0.05  # Default
+                            enable_power_adjustment = False# May be too strict
+                            if enable_power_adjustment:
+                                # Calculate effect size
+                                pooled_std = np.sqrt(np.var(all_data) / len(all_data) + np.var(other_tissue_data) / len(other_tissue_data))
+                                effect_size = abs(np.mean(all_data) - np.mean(other_tissue_data)) / pooled_std
+                                if effect_size > 0:
+                                    try:
+                                        alpha = 1.0 - power_analysis.solve_power(effect_size=effect_size, power=desired_power, nobs1=len(all_data), ratio=len(other_tissue_data) / len(all_data), alternative='two-sided')
+                                        log.write(f"Set alpha level with power={desired_power:.10f}.\n")
+                                    except:
+                                        log.write(f"Unable to calculate adjusted alpha for {tissue} vs All due to insufficient effect size or sample size.\n")
+                                        pass  # Use default alpha if power calculation fails
+
+                            log.write(f'Comparing {tissue} vs All with alpha={alpha:.10f}:\n')
+                            log.write(f'  t-statistic: {statistic}, p-value: {pvalue}\n')
+                            if tissue in adjusted_pvalues:
+                                pvalue = adjusted_pvalues[tissue]
+                                log.write(f'  adjusted p-value ({correction}): {pvalue}\n')
+
+                            # Check for statistical significance
+                            if pvalue < alpha:
+                                log.write(f'  Statistically significant difference (p-value < {alpha:.10f})\n')
+                                # Extract and save rows outside confidence interval with adjusted alpha
+                                if alpha not in ci_cache:
+                                    ci_cache[alpha] = calculate_all_confidence_interval(all_values, alpha)
+                                tissue_df = df.iloc[tissue_indices[tissue]]
+                                extract_significant_rows(tissue_df, tissue, column, output_dir, ci_cache[alpha])
                             else:
-                                log.write(f"Not enough data to compare All vs {tissue}.\n")
-                                log.write('-' * 50 + '\n')
+                                log.write(f'  No statistically significant difference (p-value >= {alpha:.10f})\n')
+                            log.write('-' * 50 + '\n')
+                        else:
+                            log.write(f"Not enough data to compare All vs {tissue}.\n")
+                            log.write('-' * 50 + '\n')
             else:
                 print(f"Skipping {column} due to insufficient data for All.")
         else:
             print(f"Skipping {column} because All data is not available.")
 
 # Updated process_and_analyze_data function
-def process_and_analyze_data(input_dir, output_dir):
+def process_and_analyze_data(input_dir, output_dir, plots='publication', processes=None, correction='none'):
     # Find all CSV files in the input directory that start with 'rawdata_'
     files = [os.path.join(input_dir, file) for file in os.listdir(input_dir) if file.startswith('rawdata_')]
     
@@ -257,14 +306,18 @@ def process_and_analyze_data(input_dir, output_dir):
     os.makedirs(output_dir, exist_ok=True)
 
     # Generate violin plots for each column
-    generate_violinplots(combined_df, output_dir)
+    plot_jobs = []
+    generate_violinplots(combined_df, output_dir, plot_jobs)
 
     # Generate circular bar plots with SEM and save stats
-    generate_circular_barplot(combined_df, output_dir)
-    generate_barplot(combined_df, output_dir)
+    generate_circular_barplot(combined_df, output_dir, plot_jobs)
+    generate_barplot(combined_df, output_dir, plot_jobs)
+
+    # Draw the queued plots in parallel
+    render_plots(plot_jobs, plots, processes)
 
     # Perform Welch's t-test and log results
-    perform_welchs_ttest_with_power_adjusted_alpha(combined_df, output_dir)
+    perform_welchs_ttest_with_power_adjusted_alpha(combined_df, output_dir, correction=correction)
 
     print(f"Processing complete. Violin plots, circular barplots, statistics, and Welch's t-test results are saved in: {output_dir}")
 
@@ -273,8 +326,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Aggregate CSV files, generate violin plots, circular barplots, and perform Welch's t-test.")
     parser.add_argument('--input_dir', required=True, help="Directory containing the CSV files.")
     parser.add_argument('--output_dir', required=True, help="Directory to save plots, statistics, and t-test results.")
+    parser.add_argument('--plots', required=False, default='publication', choices=PLOT_MODES, help="Plot output: none (statistics only), fast (72-dpi previews) or publication (350-dpi PNG, default).")
+    parser.add_argument('--processes', required=False, type=int, default=None, help="Worker processes for plotting (default: number of CPUs).")
+    parser.add_argument('--correction', required=False, default='none', choices=CORRECTION_METHODS, help="Multiple-testing correction of the tissue comparisons of each column (default: none).")
     
     args = parser.parse_args()
     
     # Call the main function
-    process_and_analyze_data(args.input_dir, args.output_dir)
+    process_and_analyze_data(args.input_dir, args.output_dir, args.plots, args.processes, args.correction)
@@ -0,0 +1,122 @@
+import os
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from calc_eff_substrate_density import batch_calculate_density, batch_density, read_transcript_scores, read_window_labels
+from window_store import SubstrateMatrix, build_substrate_matrix, write_scores
+
+# rel_amino_acid_pos of a transcript whose mean the groupby mean rounds to 0.5387, not 0.53869
+ROUNDING_POSITIONS = [0.05128, 0.38695, 0.39627, 0.44755, 0.45455, 0.65501, 0.65734, 0.67366, 0.81352, 0.85082]
+
+def write_transcript(target_dir, positions, labels, amino_acid_len, seed=0):
+    # table.csv and eval_res.csv of one transcript with distinct windows
+    rng = random.Random(seed)
+    windows = set()
+    while len(windows) < len(positions):
+        windows.add(''.join(rng.choice('ACGT') for _ in range(40)))
+    windows = sorted(windows)
+    os.makedirs(target_dir)
+    table_path = os.path.join(target_dir, 'table.csv')
+    eval_res_path = os.path.join(target_dir, 'eval_res.csv')
+    pd.DataFrame({
+        'flanking_sequence': windows,
+        'amino_acid': 'Q',
+        'codon': 'CAG',
+        'pos': range(1, len(windows) + 1),
+        'amino_acid_len': amino_acid_len,
+        'rel_amino_acid_pos': positions,
+    }).to_csv(table_path, index=False)
+    pd.DataFrame({'flanking_sequence': windows, 'pred': labels}).to_csv(eval_res_path, index=False)
+    return eval_res_path, table_path
+
+def per_transcript_density(eval_res_path, table_path):
+    # The per-transcript computation that calc_eff_substrate_density.py replaced
+    eval_res_df = pd.read_csv(eval_res_path)
+    table_df = pd.read_csv(table_path)
+    merged_df = pd.merge(eval_res_df, table_df, on='flanking_sequence', how='inner')
+    total_label_1_count = merged_df[merged_df['pred'] == 'LABEL_1'].shape[0]
+    total_flanking_sequence_count = merged_df.shape[0]
+    amino_acid_len = merged_df['amino_acid_len'].iloc[0]
+    return pd.DataFrame({
+        'Total substrate': [total_flanking_sequence_count],
+        'Effective substrate': [total_label_1_count],
+        'Peptide length': [amino_acid_len],
+        'Effective substrate density': [round(total_label_1_count / total_flanking_sequence_count / amino_acid_len, 5)],
+        'Mean position of Substrate': [round(merged_df['rel_amino_acid_pos'].mean(), 5)],
+        'Mean position of Effective substrate': [round(merged_df[merged_df['pred'] == 'LABEL_1']['rel_amino_acid_pos'].mean(), 5)],
+    })
+
+def test_batch_density_matches_per_transcript_computation(tmp_path):
+    rng = np.random.default_rng(0)
+    jobs = []
+    for transcript in range(200):
+        amino_acid_len = int(rng.integers(80, 800))
+        count = int(rng.integers(1, 40))
+        positions = np.round(np.sort(rng.choice(np.arange(1, amino_acid_len + 1), count, replace=False)) / amino_acid_len, 5)
+        labels = rng.choice(['LABEL_0', 'LABEL_1'], count, p=[0.6, 0.4])
+        target_dir = str(tmp_path / f'NM_{transcript}' / 'ENST')
+        jobs.append(write_transcript(target_dir, positions, labels, amino_acid_len, seed=transcript) + (os.path.join(target_dir, 'density.csv'),))
+    # Transcripts with every window effective, none effective, and the rounding case
+    for name, positions, labels in [
+        ('all', [0.1, 0.2, 0.3], ['LABEL_1'] * 3),
+        ('none', [0.1, 0.2, 0.3], ['LABEL_0'] * 3),
+        ('rounding', ROUNDING_POSITIONS, ['LABEL_1'] * len(ROUNDING_POSITIONS)),
+    ]:
+        target_dir = str(tmp_path / name / 'ENST')
+        jobs.append(write_transcript(target_dir, positions, labels, 429) + (os.path.join(target_dir, 'density.csv'),))
+
+    density_df, errors = batch_calculate_density(jobs)
+    assert errors == {}
+    assert len(density_df) == len(jobs)
+    for eval_res_path, table_path, density_path in jobs:
+        # Byte-identical density.csv files
+        with open(density_path) as density_file:
+            assert density_file.read() == per_transcript_density(eval_res_path, table_path).to_csv(index=False)
+
+def forward_labels_scores(logit_differences):
+    # Class IDs and stored LABEL_1 probabilities of a two-class model with the given logit(LABEL_1) - logit(LABEL_0)
+    torch = pytest.importorskip('torch')
+    pytest.importorskip('transformers')
+    from types import SimpleNamespace
+    from pred_rna_offtarget_batch import _forward
+
+    logits = torch.tensor(np.stack([np.zeros(len(logit_differences)), logit_differences], axis=1), dtype=torch.float32)
+    model = lambda **inputs: SimpleNamespace(logits=logits)
+    dummy = np.zeros((len(logit_differences), 1), dtype=np.int64)
+    return _forward(model, 'cpu', dummy, dummy)
+
+def test_threshold_on_stored_scores_reproduces_labels(tmp_path):
+    # Logit differences around 0 fall in the probabilities float16 rounds to 0.5
+    rng = np.random.default_rng(0)
+    logit_differences = np.concatenate([rng.normal(0, 3, 2000), rng.uniform(-1e-3, 1e-3, 2000)])
+    y_preds, y_scores = forward_labels_scores(logit_differences)
+    assert y_scores.dtype == np.float16
+    np.testing.assert_array_equal(y_scores >= 0.5, y_preds == 1)
+
+    # Per-transcript scores.npy and the matrix-wide matrix_scores.npy give the densities of the labels
+    target_dirs = []
+    start = 0
+    for transcript, count in enumerate(rng.integers(1, 300, 20)):
+        target_dir = str(tmp_path / f'NM_{transcript}' / 'ENST')
+        labels = [f'LABEL_{label}' for label in y_preds[start:start + count]]
+        positions = np.round(np.arange(1, count + 1) / 300, 5)
+        eval_res_path, table_path = write_transcript(target_dir, positions, labels, 300, seed=transcript)
+        os.replace(eval_res_path, os.path.join(target_dir, 's_eval_res.csv'))
+        write_scores(os.path.join(target_dir, 's_scores.npy'), y_scores[start:start + count])
+        target_dirs.append(target_dir)
+        start += count
+    build_substrate_matrix(str(tmp_path), target_dirs)
+    matrix = SubstrateMatrix(str(tmp_path))
+    write_scores(matrix.scores_file('m_'), y_scores[:start])
+
+    frames = {'labels': [], 'scores': [], 'matrix': []}
+    for transcript, target_dir in enumerate(target_dirs):
+        frames['labels'].append(read_window_labels(os.path.join(target_dir, 's_eval_res.csv'), os.path.join(target_dir, 'table.csv')).assign(transcript=transcript))
+        frames['scores'].append(read_transcript_scores(target_dir, 's_', threshold=0.5).assign(transcript=transcript))
+        frames['matrix'].append(read_transcript_scores(target_dir, 'm_', threshold=0.5, matrix=matrix).assign(transcript=transcript))
+    densities = {source: batch_density(pd.concat(source_frames, ignore_index=True)) for source, source_frames in frames.items()}
+    pd.testing.assert_frame_equal(densities['scores'], densities['labels'])
+    pd.testing.assert_frame_equal(densities['matrix'], densities['labels'])
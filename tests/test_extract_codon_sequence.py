@@ -0,0 +1,172 @@
+import io
+import random
+
+import pytest
+from Bio.Seq import Seq
+
+from extract_codon_sequence_with_exons import PaddedExonSequences, map_residue_to_genomic_position, write_substrates
+
+# Codons without stops; CAA, CAG and CGA are the substrates written to table.csv
+CODONS = ['CAG', 'CAA', 'CGA', 'GCT', 'ACC', 'TTC', 'GGA', 'AAG', 'CTG', 'TCC']
+
+class FakeGenome:
+    """Forward-strand chromosomes answering region requests like the Ensembl REST API."""
+
+    def __init__(self, chromosomes):
+        self.chromosomes = chromosomes
+        self.requests = []
+
+    def fetch(self, region):
+        self.requests.append(region)
+        chrom, coordinates, strand = region.rsplit(':', 2)
+        start, end = (int(x) for x in coordinates.split('..'))
+        # Regions running past the chromosome end are truncated, as Ensembl does
+        sequence = self.chromosomes[chrom][start - 1:end]
+        return str(Seq(sequence).reverse_complement()) if int(strand) == -1 else sequence
+
+def random_bases(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+def make_transcript(rng, codons, exon_ends, strand, intron=30, tail=30):
+    """
+    Lay out a CDS on a chromosome.
+
+    Args:
+        codons (list): CDS codons after ATG; a stop codon is appended.
+        exon_ends (list): CDS positions at which an exon ends (the last one is the CDS end).
+        strand (int): 1 or -1.
+        tail (int): Bases after the last exon on the chromosome.
+
+    Returns:
+        tuple: (chromosome sequence, map/cds mappings)
+    """
+    cds = 'ATG' + ''.join(codons) + 'TAA'
+    exon_ends = [end for end in exon_ends if end < len(cds)] + [len(cds)]
+    pieces = [cds[start:end] for start, end in zip([0] + exon_ends[:-1], exon_ends)]
+    if strand == -1:
+        pieces = [str(Seq(piece).reverse_complement()) for piece in reversed(pieces)]
+
+    chromosome = ''
+    mappings = []
+    for piece in pieces:
+        chromosome += random_bases(rng, intron)
+        mappings.append({'seq_region_name': '1', 'start': len(chromosome) + 1, 'end': len(chromosome) + len(piece), 'strand': strand})
+        chromosome += piece
+    chromosome += random_bases(rng, tail)
+    rng.shuffle(mappings)
+    return chromosome, mappings
+
+def baseline_map_residue_to_genomic_position(residue_position, exon_regions):
+    # Linear scan over the exons, as before build_cds_offsets
+    codon_start_in_cds = residue_position * 3
+    current_cds_position = 0
+    for chrom, start, end, strand in exon_regions:
+        exon_length = end - start + 1
+        if current_cds_position + exon_length >= codon_start_in_cds + 3:
+            codon_start_in_exon = codon_start_in_cds - current_cds_position
+            genomic_start = start + codon_start_in_exon
+            genomic_end = genomic_start + 2
+            if strand == -1:
+                genomic_start, genomic_end = end - codon_start_in_exon - 2, end - codon_start_in_exon
+            return chrom, genomic_start, genomic_end, strand
+        current_cds_position += exon_length
+    raise ValueError("Residue position out of range for the provided exon regions")
+
+def baseline_substrates(exon_data, fetch):
+    # target.csv and table.csv rows of the per-codon script: one request per exon and per window
+    strand = exon_data[0]['strand']
+    exon_regions = []
+    cds_sequence = ''
+    for exon in sorted(exon_data, key=lambda x: x['start'], reverse=(strand == -1)):
+        cds_sequence += fetch(f"{exon['seq_region_name']}:{exon['start']}..{exon['end']}:{strand}")
+        exon_regions.append((exon['seq_region_name'], exon['start'], exon['end'], strand))
+    amino_acid_sequence = Seq(cds_sequence).translate(to_stop=True)
+
+    target_rows = []
+    table_rows = []
+    amino_acid_len = len(amino_acid_sequence)
+    for pos in range(amino_acid_len):
+        codon = cds_sequence[pos * 3:pos * 3 + 3]
+        if codon not in ('CAA', 'CAG', 'CGA'):
+            continue
+        chrom, codon_start, _, strand = baseline_map_residue_to_genomic_position(pos, exon_regions)
+        c_position_in_codon = codon.find('C')
+        if strand == 1:
+            c_position_in_genome = codon_start + c_position_in_codon
+            flanking_start, flanking_end = max(1, c_position_in_genome - 20), c_position_in_genome + 19
+        else:
+            c_position_in_genome = codon_start + c_position_in_codon + 2
+            flanking_start, flanking_end = max(1, c_position_in_genome - 19), c_position_in_genome + 20
+        flanking_sequence = fetch(f"{chrom}:{flanking_start}..{flanking_end}:{strand}")
+        target_rows.append(f"{flanking_sequence}\n")
+        table_rows.append(f"{flanking_sequence},{amino_acid_sequence[pos]},{codon},{pos},{amino_acid_len},{round(float(pos / amino_acid_len), 5)}\n")
+    return ''.join(target_rows), ''.join(table_rows)
+
+def new_substrates(exon_data, fetch, prefetch):
+    padded_sequences = PaddedExonSequences(fetch)
+    if prefetch:
+        # As extract_transcripts_batch: padded exons fetched up front, the rest cut from memory
+        for exon in exon_data:
+            region = padded_sequences.padded_region(exon['seq_region_name'], exon['start'], exon['end'])
+            padded_sequences.add(region, fetch(region))
+    flanking_file, table_file = io.StringIO(), io.StringIO()
+    write_substrates(exon_data, padded_sequences.get, io.StringIO(), flanking_file, table_file)
+    return flanking_file.getvalue(), table_file.getvalue()
+
+def transcript_cases():
+    rng = random.Random(0)
+    codons = [rng.choice(CODONS) for _ in range(60)]
+    # CAG split C|AG over the junction after CDS position 31, and CA|G after position 62
+    codons[9] = codons[19] = 'CAG'
+    exon_ends = [31, 62, 100, 148]
+    cases = {}
+    for strand in (1, -1):
+        cases[f'strand {strand}'] = make_transcript(rng, codons, exon_ends, strand)
+        # The last exon ends 5 nt before the chromosome end, so its windows run past the fetched exon +20 nt
+        edge_codons = codons[:-3] + ['CAG', 'CGA', 'CAA']
+        cases[f'strand {strand} at chromosome end'] = make_transcript(rng, edge_codons, exon_ends, strand, tail=5 if strand == 1 else 30)
+    # Minus-strand chromosome start: the window start is clamped to 1
+    cases['strand -1 at chromosome start'] = make_transcript(rng, codons[:-3] + ['CAG', 'CGA', 'CAA'], exon_ends, -1, intron=4)
+    return cases
+
+@pytest.mark.parametrize('name', list(transcript_cases()))
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_substrates_match_the_per_codon_fetch(name, prefetch):
+    chromosome, exon_data = transcript_cases()[name]
+    baseline = baseline_substrates(exon_data, FakeGenome({'1': chromosome}).fetch)
+    genome = FakeGenome({'1': chromosome})
+    assert new_substrates(exon_data, genome.fetch, prefetch) == baseline
+    assert baseline[1].count('\n') >= 5
+    # Windows are cut from the padded exons instead of one request each
+    assert len(genome.requests) < len(exon_data) + baseline[1].count('\n')
+
+def test_split_codons_and_fallback_fetches_are_exercised():
+    chromosome, exon_data = transcript_cases()['strand 1 at chromosome end']
+    baseline_genome = FakeGenome({'1': chromosome})
+    _, table = baseline_substrates(exon_data, baseline_genome.fetch)
+    window_regions = set(baseline_genome.requests[len(exon_data):])
+    positions = [int(row.split(',')[3]) for row in table.splitlines()]
+    # The CAG codons split over the first two junctions
+    assert 10 in positions and 20 in positions
+
+    genome = FakeGenome({'1': chromosome})
+    padded_sequences = PaddedExonSequences(genome.fetch)
+    exon_padded_regions = [padded_sequences.padded_region(exon['seq_region_name'], exon['start'], exon['end']) for exon in exon_data]
+    new_substrates(exon_data, genome.fetch, prefetch=True)
+    later_requests = genome.requests[len(exon_data):]
+    # The window of a split codon starts 21 nt before its exon and is fetched with its own padding
+    assert any(region.endswith(':1') and region not in exon_padded_regions and region not in window_regions for region in later_requests)
+    # The window truncated at the chromosome end is fetched directly
+    assert len(table.splitlines()[-1].split(',')[0]) < 40
+    assert any(region in window_regions for region in later_requests)
+
+def test_bisect_mapping_matches_the_linear_scan():
+    for chromosome, exon_data in transcript_cases().values():
+        strand = exon_data[0]['strand']
+        exon_regions = [(exon['seq_region_name'], exon['start'], exon['end'], strand)
+                        for exon in sorted(exon_data, key=lambda x: x['start'], reverse=(strand == -1))]
+        cds_len = sum(end - start + 1 for _, start, end, _ in exon_regions)
+        for pos in range(cds_len // 3):
+            assert map_residue_to_genomic_position(pos, exon_regions) == baseline_map_residue_to_genomic_position(pos, exon_regions)
+        with pytest.raises(ValueError):
+            map_residue_to_genomic_position(cds_len // 3, exon_regions)
@@ -0,0 +1,42 @@
+import inference_workers
+from inference_workers import shard_target_dirs, worker_cpu_sets
+
+def test_shards_are_fixed_slices_of_the_target_dirs():
+    target_dirs = [f'NM_{i}/ENST{i}' for i in range(7)]
+    shards = shard_target_dirs(target_dirs, 3)
+    assert shards == [target_dirs[0:3], target_dirs[3:6], target_dirs[6:7]]
+    assert shard_target_dirs(target_dirs, 3) == shards
+    assert shard_target_dirs([], 3) == []
+
+def test_worker_cpu_sets_are_disjoint(monkeypatch):
+    monkeypatch.setattr(inference_workers, 'available_cpus', lambda: [0, 1, 2, 3, 4, 5, 6, 7])
+    assert worker_cpu_sets(4) == [[0, 1], [2, 3], [4, 5], [6, 7]]
+    assert worker_cpu_sets(3) == [[0, 1], [2, 3], [4, 5]]
+    assert worker_cpu_sets(2, threads=1) == [[0], [1]]
+
+def test_worker_cpu_sets_wrap_around_when_oversubscribed(monkeypatch, capsys):
+    monkeypatch.setattr(inference_workers, 'available_cpus', lambda: [0, 1])
+    assert worker_cpu_sets(3) == [[0], [1], [0]]
+    assert 'Warning' in capsys.readouterr().out
+
+def test_predict_shard_reports_errors_per_target_file(monkeypatch):
+    def predict_files(jobs):
+        for target_file, _ in jobs:
+            yield target_file, target_file.replace('target.csv', 'eval_res.csv'), ValueError('bad') if 'bad' in target_file else None
+
+    monkeypatch.setattr(inference_workers, '_predict_files', predict_files)
+    monkeypatch.setattr(inference_workers, '_init_error', None)
+    jobs = [('ok/target.csv', 'ok/eval_res.csv'), ('bad/target.csv', 'bad/eval_res.csv')]
+    assert inference_workers._predict_shard((5, jobs)) == (5, [
+        ('ok/target.csv', 'ok/eval_res.csv', None),
+        ('bad/target.csv', 'bad/eval_res.csv', 'ValueError: bad'),
+    ])
+
+def test_predict_shard_reports_a_failed_worker_load_for_every_target_file(monkeypatch):
+    monkeypatch.setattr(inference_workers, '_predict_files', None)
+    monkeypatch.setattr(inference_workers, '_init_error', 'Worker could not load pred_x: SystemExit: 1')
+    jobs = [('a/target.csv', 'a/eval_res.csv'), ('b/target.csv', 'b/eval_res.csv')]
+    assert inference_workers._predict_shard((2, jobs)) == (2, [
+        ('a/target.csv', None, 'Worker could not load pred_x: SystemExit: 1'),
+        ('b/target.csv', None, 'Worker could not load pred_x: SystemExit: 1'),
+    ])
@@ -0,0 +1,77 @@
+from prediction_cache import PredictionCache, pack_sequence, unpack_sequence
+
+WINDOW_A = "ACGT" * 10
+WINDOW_B = "TTGCA" * 8
+WINDOW_N = "ACGTN" * 8
+
+class CountingPredictor:
+    """predict_fn that records the sequences it was asked for."""
+
+    def __init__(self, with_scores=False):
+        self.calls = []
+        self.with_scores = with_scores
+
+    def __call__(self, sequences):
+        self.calls.append(list(sequences))
+        labels = ['LABEL_1' if sequence.startswith('A') else 'LABEL_0' for sequence in sequences]
+        if self.with_scores:
+            return [(label, 0.75 if label == 'LABEL_1' else 0.25) for label in labels]
+        return labels
+
+def test_pack_sequence_round_trip():
+    for sequence in (WINDOW_A, WINDOW_B, "C", "GATTACA"):
+        assert unpack_sequence(pack_sequence(sequence)) == sequence
+    assert pack_sequence(WINDOW_N) is None
+    assert pack_sequence(WINDOW_A.lower()) is None
+
+def test_predict_runs_unique_missing_sequences_only(tmp_path):
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"), "model", "v1")
+    predictor = CountingPredictor()
+
+    assert cache.predict([WINDOW_A, WINDOW_B, WINDOW_A], predictor) == ['LABEL_1', 'LABEL_0', 'LABEL_1']
+    assert predictor.calls == [[WINDOW_A, WINDOW_B]]
+    assert cache.count() == 2
+
+    # Every window is a hit now
+    assert cache.predict([WINDOW_B, WINDOW_A], predictor) == ['LABEL_0', 'LABEL_1']
+    assert len(predictor.calls) == 1
+
+    # Windows that cannot be packed are never cached
+    assert cache.predict([WINDOW_A, WINDOW_N], predictor) == ['LABEL_1', 'LABEL_1']
+    assert predictor.calls[1:] == [[WINDOW_N]]
+    assert cache.count() == 2
+    cache.close()
+
+def test_predict_keeps_versions_apart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    PredictionCache(path, "model", "v1").predict([WINDOW_A], CountingPredictor())
+
+    predictor = CountingPredictor()
+    cache = PredictionCache(path, "model", "v2")
+    cache.predict([WINDOW_A], predictor)
+    assert predictor.calls == [[WINDOW_A]]
+
+def test_predict_with_scores_repredicts_windows_cached_without_score(tmp_path):
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"), "model", "v1")
+    cache.predict([WINDOW_A], CountingPredictor())
+
+    predictor = CountingPredictor(with_scores=True)
+    assert cache.predict([WINDOW_A, WINDOW_B], predictor, with_scores=True) == [('LABEL_1', 0.75), ('LABEL_0', 0.25)]
+    assert predictor.calls == [[WINDOW_A, WINDOW_B]]
+
+    # Scored windows are hits, with and without scores
+    assert cache.predict([WINDOW_A, WINDOW_B], predictor, with_scores=True) == [('LABEL_1', 0.75), ('LABEL_0', 0.25)]
+    assert cache.predict([WINDOW_B], predictor) == ['LABEL_0']
+    assert len(predictor.calls) == 1
+
+def test_predict_does_not_share_labels_across_case(tmp_path):
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"), "model", "v1")
+    cache.predict([WINDOW_A], CountingPredictor())
+
+    # The tokenizer is case-sensitive: a lowercase window is sent to the model, every time
+    predictor = CountingPredictor()
+    lowercase = WINDOW_A.lower()
+    assert cache.predict([lowercase, WINDOW_A], predictor) == ['LABEL_0', 'LABEL_1']
+    assert cache.predict([lowercase], predictor) == ['LABEL_0']
+    assert predictor.calls == [[lowercase], [lowercase]]
+    assert cache.count() == 1
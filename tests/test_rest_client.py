@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import test_utils, web
+
+from rest_client import AdaptiveRateLimiter, AsyncRestClient, RestClientError
+
+def run_against_stub(responses, max_retries=3):
+    """
+    GET a local stub server that answers with the given (status, headers) in turn.
+
+    Returns:
+        tuple: (result of the request or the RestClientError raised, monotonic time of each request, client)
+    """
+    async def run():
+        request_times = []
+
+        async def handler(request):
+            request_times.append(time.monotonic())
+            status, headers = responses[min(len(request_times), len(responses)) - 1]
+            return web.json_response({'attempt': len(request_times)}, status=status, headers=headers)
+
+        app = web.Application()
+        app.router.add_get('/lookup', handler)
+        async with test_utils.TestServer(app) as server:
+            async with AsyncRestClient(requests_per_second=1000, max_retries=max_retries, backoff=0.01) as client:
+                try:
+                    result = await client.get_json(str(server.make_url('/lookup')))
+                except RestClientError as e:
+                    result = e
+        return result, request_times, client
+
+    return asyncio.run(run())
+
+def test_rate_limited_request_is_retried():
+    result, request_times, client = run_against_stub([(429, {}), (200, {})])
+    assert result == (200, {'attempt': 2})
+    assert len(request_times) == 2
+    # Halved on the 429, then one additive step back
+    assert client.limiter.rate == pytest.approx(1000 / 2 + 0.1)
+
+def test_retry_after_pauses_the_limiter():
+    result, request_times, client = run_against_stub([(503, {'Retry-After': '0.3'}), (200, {})])
+    assert result == (200, {'attempt': 2})
+    assert request_times[1] - request_times[0] >= 0.3
+    assert client.limiter.paused_until >= request_times[0] + 0.3
+
+def test_server_errors_raise_after_the_last_retry():
+    result, request_times, _ = run_against_stub([(500, {})], max_retries=2)
+    assert isinstance(result, RestClientError)
+    assert 'failed after 3 attempts (HTTP 500)' in str(result)
+    assert len(request_times) == 3
+
+def test_other_errors_are_returned_without_retry():
+    result, request_times, _ = run_against_stub([(400, {}), (200, {})])
+    assert result == (400, {'attempt': 1})
+    assert len(request_times) == 1
+
+def test_rate_follows_aimd_and_rate_limit_headers():
+    limiter = AdaptiveRateLimiter(max_rate=10, min_rate=1)
+    limiter.update(429, {})
+    limiter.update(429, {})
+    assert limiter.rate == 2.5
+    limiter.update(200, {})
+    assert limiter.rate == pytest.approx(2.6)
+    for _ in range(10):
+        limiter.update(429, {})
+    assert limiter.rate == 1
+
+    limiter = AdaptiveRateLimiter(max_rate=10)
+    # 300 requests left for 100 s caps the rate at 3 per second
+    limiter.update(200, {'X-RateLimit-Remaining': '300', 'X-RateLimit-Reset': '100'})
+    assert limiter.rate == 3
+    # An exhausted quota pauses until it is reset
+    before = time.monotonic()
+    limiter.update(200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '5'})
+    assert limiter.paused_until >= before + 5
@@ -0,0 +1,71 @@
+import os
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from window_store import (
+    WINDOW_LENGTH, MATRIX_FILE, SubstrateMatrix, build_substrate_matrix, pack_windows, table_to_windows, unpack_windows,
+)
+
+def random_windows(count, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice('ACGT') for _ in range(WINDOW_LENGTH)) for _ in range(count)]
+
+def write_table(target_dir, windows):
+    os.makedirs(target_dir)
+    pd.DataFrame({
+        'flanking_sequence': windows,
+        'amino_acid': 'Q',
+        'codon': 'CAG',
+        'pos': range(1, len(windows) + 1),
+        'amino_acid_len': 100,
+        'rel_amino_acid_pos': [round(i / 100, 5) for i in range(1, len(windows) + 1)],
+    }).to_csv(os.path.join(target_dir, 'table.csv'), index=False)
+    return target_dir
+
+def test_pack_unpack_round_trip():
+    windows = random_windows(257) + ['A' * WINDOW_LENGTH, 'T' * WINDOW_LENGTH]
+    packed = pack_windows(windows)
+    assert packed.shape == (len(windows), WINDOW_LENGTH // 4)
+    assert packed.dtype == np.uint8
+    assert unpack_windows(packed) == windows
+
+@pytest.mark.parametrize('window', ['ACGT' * 9, 'ACGT' * 11, 'ACGN' * 10, 'acgt' * 10])
+def test_pack_rejects_windows_that_cannot_be_packed(window):
+    with pytest.raises(ValueError):
+        pack_windows(random_windows(3) + [window])
+
+def test_build_substrate_matrix_skips_unpackable_transcripts(tmp_path, capsys):
+    target_dirs = [
+        write_table(str(tmp_path / 'NM_1' / 'ENST1'), random_windows(5, seed=1)),
+        write_table(str(tmp_path / 'NM_2' / 'ENST2'), random_windows(3, seed=2)[:2] + ['N' * WINDOW_LENGTH]),
+        write_table(str(tmp_path / 'NM_3' / 'ENST3'), random_windows(4, seed=3)),
+    ]
+
+    assert build_substrate_matrix(str(tmp_path), target_dirs) == 9
+    assert 'Error packing' in capsys.readouterr().out
+    assert not os.path.exists(os.path.join(str(tmp_path), MATRIX_FILE + '.tmp.npy'))
+
+    matrix = SubstrateMatrix(str(tmp_path))
+    assert len(matrix) == 9
+    assert list(matrix.offsets) == [('NM_1', 'ENST1'), ('NM_3', 'ENST3')]
+    assert unpack_windows(matrix.rows('NM_3', 'ENST3')['seq']) == random_windows(4, seed=3)
+    np.testing.assert_array_equal(matrix.rows('NM_1', 'ENST1'), table_to_windows(os.path.join(target_dirs[0], 'table.csv')))
+
+def test_rebuilding_the_matrix_removes_its_predictions(tmp_path):
+    from protectio import build_matrix
+
+    db_dir = str(tmp_path)
+    write_table(os.path.join(db_dir, 'prediction_targets', 'NM_1', 'ENST1'), random_windows(5, seed=1))
+    build_matrix(db_dir)
+    matrix = SubstrateMatrix(db_dir)
+    stale_files = [matrix.labels_file('a_'), matrix.scores_file('a_'), matrix.labels_file(''), *matrix.tokens_files('0123456789abcdef')]
+    for stale_file in stale_files:
+        np.save(stale_file, np.zeros(len(matrix), dtype=np.uint8))
+
+    write_table(os.path.join(db_dir, 'prediction_targets', 'NM_2', 'ENST2'), random_windows(3, seed=2))
+    build_matrix(db_dir)
+    assert len(SubstrateMatrix(db_dir)) == 8
+    assert [stale_file for stale_file in stale_files if os.path.exists(stale_file)] == []
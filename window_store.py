@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+
+import numpy as np
+import pandas as pd
+
+from prediction_cache import label_to_id
+
+__authors__ = ["Kazuki Nakamae"]
+__version__ = "1.0.0"
+
+# CBE substrate windows are 20 nt + target C + 19 nt
+WINDOW_LENGTH = 40
+PACKED_WIDTH = WINDOW_LENGTH // 4
+
+# One row of windows.npy: the packed window and its table.csv metadata
+WINDOW_DTYPE = np.dtype([
+    ('seq', np.uint8, (PACKED_WIDTH,)),
+    ('amino_acid', 'S1'),
+    ('codon', 'S3'),
+    ('pos', '<i4'),
+    ('amino_acid_len', '<i4'),
+    ('rel_amino_acid_pos', '<f8'),
+])
+
+WINDOWS_FILE = 'windows.npy'
+LABELS_SUFFIX = 'labels.npy'
+# Probability of LABEL_1 for every window, written by the DNABERT-2 predictors
+SCORES_SUFFIX = 'scores.npy'
+SCORE_DTYPE = np.float16
+# LABEL_1 probability from which a window counts as effective; argmax of two classes
+DEFAULT_THRESHOLD = 0.5
+
+# Whole-database files written by protectio.py matrix
+MATRIX_FILE = 'substrate_matrix.npy'
+MATRIX_INDEX_FILE = 'substrate_index.csv'
+MATRIX_LABELS_SUFFIX = 'matrix_labels.npy'
+MATRIX_SCORES_SUFFIX = 'matrix_scores.npy'
+# Padded token IDs of every matrix row, one pair of files per tokenizer (protectio.py tokenize)
+MATRIX_TOKENS_PREFIX = 'matrix_tokens_'
+
+# 2-bit code of each base byte; 255 marks bytes that cannot be packed
+_BASE_CODES = np.full(256, 255, dtype=np.uint8)
+_BASE_CODES[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+_CODE_BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+def pack_windows(sequences):
+    """
+    Pack 40-nt windows into 2 bits per base (10 bytes per window).
+
+    Args:
+        sequences (list): DNA windows.
+
+    Returns:
+        ndarray: uint8 array of shape (len(sequences), 10).
+
+    Raises:
+        ValueError: If a window is not 40 nt of A/C/G/T.
+    """
+    if any(len(sequence) != WINDOW_LENGTH for sequence in sequences):
+        raise ValueError(f"Only {WINDOW_LENGTH}-nt windows can be packed.")
+    raw = np.array(sequences, dtype=f'S{WINDOW_LENGTH}').view(np.uint8).reshape(len(sequences), WINDOW_LENGTH)
+    codes = _BASE_CODES[raw]
+    if (codes == 255).any():
+        raise ValueError("Only windows of A/C/G/T can be packed.")
+    codes = codes.reshape(len(sequences), PACKED_WIDTH, 4)
+    return (codes[:, :, 0] << 6) | (codes[:, :, 1] << 4) | (codes[:, :, 2] << 2) | codes[:, :, 3]
+
+def unpack_windows(packed):
+    """
+    Restore the windows packed by pack_windows.
+
+    Args:
+        packed (ndarray): uint8 array of shape (n, 10).
+
+    Returns:
+        list: DNA windows.
+    """
+    raw = np.ascontiguousarray(unpack_window_bytes(packed))
+    return raw.view(f'S{WINDOW_LENGTH}').ravel().astype(str).tolist()
+
+def unpack_window_bytes(packed):
+    """
+    Restore packed windows as an (n, 40) uint8 array of ASCII bases, without building strings.
+
+    Args:
+        packed (ndarray): uint8 array of shape (n, 10).
+
+    Returns:
+        ndarray: uint8 array of shape (n, 40).
+    """
+    packed = np.asarray(packed)
+    codes = np.stack([(packed >> shift) & 3 for shift in (6, 4, 2, 0)], axis=-1).reshape(len(packed), WINDOW_LENGTH)
+    return _CODE_BASES[codes]
+
+def write_windows(windows_file, table_file):
+    """
+    Convert a table.csv into windows.npy.
+
+    Args:
+        windows_file (str): Output .npy file.
+        table_file (str): table.csv written by extract_codon_sequence_with_exons.py.
+
+    Returns:
+        int: Number of windows.
+    """
+    windows = table_to_windows(table_file)
+    np.save(windows_file, windows)
+    return len(windows)
+
+def table_to_windows(table_file):
+    """
+    Read a table.csv into a structured array of WINDOW_DTYPE.
+
+    Args:
+        table_file (str): table.csv written by extract_codon_sequence_with_exons.py.
+
+    Returns:
+        ndarray: One row per window.
+    """
+    # pandas parses rel_amino_acid_pos exactly as calc_eff_substrate_density.py does
+    table_df = pd.read_csv(table_file, dtype={'amino_acid': str, 'codon': str}, keep_default_na=False)
+    windows = np.zeros(len(table_df), dtype=WINDOW_DTYPE)
+    windows['seq'] = pack_windows(table_df['flanking_sequence'].tolist()).reshape(len(table_df), PACKED_WIDTH)
+    windows['amino_acid'] = table_df['amino_acid'].to_numpy(dtype='S1')
+    windows['codon'] = table_df['codon'].to_numpy(dtype='S3')
+    windows['pos'] = table_df['pos'].to_numpy()
+    windows['amino_acid_len'] = table_df['amino_acid_len'].to_numpy()
+    windows['rel_amino_acid_pos'] = table_df['rel_amino_acid_pos'].to_numpy(dtype=float)
+    return windows
+
+def read_windows(windows_file, mmap=True):
+    """
+    Open windows.npy, memory-mapped by default.
+
+    Returns:
+        ndarray: Structured array of WINDOW_DTYPE.
+    """
+    return np.load(windows_file, mmap_mode='r' if mmap else None)
+
+def write_labels(labels_file, label_ids):
+    """Save the class ID of every window as a uint8 .npy file."""
+    np.save(labels_file, np.asarray(label_ids, dtype=np.uint8))
+
+def read_labels(labels_file, mmap=True):
+    """Open a <prefix>labels.npy file, memory-mapped by default."""
+    return np.load(labels_file, mmap_mode='r' if mmap else None)
+
+def write_scores(scores_file, scores):
+    """Save the LABEL_1 probability of every window as a float16 .npy file."""
+    np.save(scores_file, np.asarray(scores, dtype=SCORE_DTYPE))
+
+def read_scores(scores_file, mmap=True):
+    """Open a <prefix>scores.npy file, memory-mapped by default."""
+    return np.load(scores_file, mmap_mode='r' if mmap else None)
+
+def scores_file_for(eval_res_file):
+    """Path of the <prefix>scores.npy written next to a <prefix>eval_res.csv."""
+    if eval_res_file.endswith('eval_res.csv'):
+        return eval_res_file[:-len('eval_res.csv')] + SCORES_SUFFIX
+    return os.path.splitext(eval_res_file)[0] + '_' + SCORES_SUFFIX
+
+def convert_eval_res(labels_file, eval_res_file, windows):
+    """
+    Convert a <prefix>eval_res.csv into <prefix>labels.npy aligned to windows.npy.
+
+    Args:
+        labels_file (str): Output .npy file.
+        eval_res_file (str): eval_res.csv of the same transcript.
+        windows (ndarray): The transcript's windows.
+
+    Raises:
+        ValueError: If the eval_res rows are not the windows in table.csv order.
+    """
+    with open(eval_res_file, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        rows = list(reader)
+    if [row[0] for row in rows] != unpack_windows(windows['seq']):
+        raise ValueError(f"{eval_res_file} does not follow the window order of table.csv.")
+    write_labels(labels_file, [label_to_id(row[1]) for row in rows])
+
+def pack_transcript(target_dir, remove_text=False):
+    """
+    Write windows.npy and one <prefix>labels.npy per <prefix>eval_res.csv of a transcript.
+
+    Args:
+        target_dir (str): prediction_targets/<original ID>/<ENST ID> directory.
+        remove_text (bool): Delete table.csv and the eval_res.csv files once packed.
+            target.csv is kept as the input of stand-alone predictor scripts.
+
+    Returns:
+        list: Label prefixes packed.
+    """
+    table_file = os.path.join(target_dir, 'table.csv')
+    windows_file = os.path.join(target_dir, WINDOWS_FILE)
+    if not os.path.isfile(windows_file):
+        write_windows(windows_file + ".tmp.npy", table_file)
+        os.replace(windows_file + ".tmp.npy", windows_file)
+    windows = read_windows(windows_file)
+
+    prefixes = []
+    for file_name in sorted(os.listdir(target_dir)):
+        if not file_name.endswith('eval_res.csv'):
+            continue
+        prefix = file_name[:-len('eval_res.csv')]
+        labels_file = os.path.join(target_dir, prefix + LABELS_SUFFIX)
+        if not os.path.isfile(labels_file):
+            convert_eval_res(labels_file + ".tmp.npy", os.path.join(target_dir, file_name), windows)
+            os.replace(labels_file + ".tmp.npy", labels_file)
+        prefixes.append(prefix)
+
+    if remove_text:
+        for prefix in prefixes:
+            os.remove(os.path.join(target_dir, prefix + 'eval_res.csv'))
+        if os.path.isfile(table_file):
+            os.remove(table_file)
+    return prefixes
+
+def read_transcript_windows(target_dir):
+    """Read the windows of a transcript from windows.npy, or from table.csv if it is not packed."""
+    windows_file = os.path.join(target_dir, WINDOWS_FILE)
+    if os.path.isfile(windows_file):
+        return read_windows(windows_file, mmap=False)
+    return table_to_windows(os.path.join(target_dir, 'table.csv'))
+
+def build_substrate_matrix(db_dir, target_dirs):
+    """
+    Concatenate the windows of every transcript into one memory-mapped array.
+
+    <db_dir>/substrate_matrix.npy holds the windows in target_dirs order, and
+    <db_dir>/substrate_index.csv maps (RefSeq ID, ENST ID) to their row range.
+
+    Args:
+        db_dir (str): PROTECTiO database directory.
+        target_dirs (list): Transcript directories from protectio.find_target_dirs.
+
+    Returns:
+        int: Number of windows.
+    """
+    # Row counts of the packed windows first, so the matrix can be written in place without
+    # holding it in memory. A transcript whose windows cannot be packed (not 40 nt of A/C/G/T)
+    # is reported and left out, as protectio.py pack does.
+    row_counts = []
+    for target_dir in target_dirs:
+        windows_file = os.path.join(target_dir, WINDOWS_FILE)
+        table_file = os.path.join(target_dir, 'table.csv')
+        if not os.path.isfile(windows_file) and (not os.path.isfile(table_file) or os.path.getsize(table_file) == 0):
+            row_counts.append(None)
+            continue
+        try:
+            if os.path.isfile(windows_file):
+                row_counts.append(len(read_windows(windows_file)))
+            else:
+                row_counts.append(len(table_to_windows(table_file)))
+        except Exception as e:
+            print(f"Error packing {target_dir}: {e}")
+            row_counts.append(None)
+
+    matrix_file = os.path.join(db_dir, MATRIX_FILE)
+    total_rows = sum(count for count in row_counts if count)
+    matrix = np.lib.format.open_memmap(matrix_file + ".tmp.npy", mode='w+', dtype=WINDOW_DTYPE, shape=(total_rows,))
+    index_rows = []
+    start = 0
+    try:
+        for target_dir, row_count in zip(target_dirs, row_counts):
+            # Transcripts without substrate windows have no density, as in the text database
+            if not row_count:
+                continue
+            windows = read_transcript_windows(target_dir)
+            if len(windows) != row_count:
+                raise ValueError(f"The windows of {target_dir} changed while the matrix was built.")
+            matrix[start:start + len(windows)] = windows
+            refseq_dir, enst_id = os.path.split(os.path.normpath(target_dir))
+            index_rows.append((os.path.basename(refseq_dir), enst_id, start, start + len(windows)))
+            start += len(windows)
+        matrix.flush()
+    except BaseException:
+        del matrix
+        os.remove(matrix_file + ".tmp.npy")
+        raise
+    del matrix
+    os.replace(matrix_file + ".tmp.npy", matrix_file)
+
+    pd.DataFrame(index_rows, columns=['refseq_id', 'enst_id', 'start', 'end']).to_csv(os.path.join(db_dir, MATRIX_INDEX_FILE), index=False)
+    return start
+
+class SubstrateMatrix:
+    """
+    Read-only view of substrate_matrix.npy and its offsets index.
+
+    Slices of the matrix are memory-mapped, so reading the windows of a transcript
+    neither copies nor parses the database.
+    """
+
+    def __init__(self, db_dir):
+        self.db_dir = db_dir
+        self.windows = read_windows(os.path.join(db_dir, MATRIX_FILE))
+        index_df = pd.read_csv(os.path.join(db_dir, MATRIX_INDEX_FILE), dtype={'refseq_id': str, 'enst_id': str})
+        self.entries = list(index_df.itertuples(index=False, name=None))
+        self.offsets = {(refseq_id, enst_id): (start, end) for refseq_id, enst_id, start, end in self.entries}
+
+    def __len__(self):
+        return len(self.windows)
+
+    def rows(self, refseq_id, enst_id):
+        """Return the windows of one transcript as a memory-mapped slice."""
+        start, end = self.offsets[(refseq_id, enst_id)]
+        return self.windows[start:end]
+
+    def labels_file(self, prefix):
+        """Path of the matrix-wide <prefix>matrix_labels.npy of a predictor."""
+        return os.path.join(self.db_dir, f"{prefix}{MATRIX_LABELS_SUFFIX}")
+
+    def scores_file(self, prefix):
+        """Path of the matrix-wide <prefix>matrix_scores.npy of a predictor."""
+        return os.path.join(self.db_dir, f"{prefix}{MATRIX_SCORES_SUFFIX}")
+
+    def tokens_files(self, tokenizer_key):
+        """Paths of the padded token IDs and token counts of a tokenizer."""
+        stem = os.path.join(self.db_dir, f"{MATRIX_TOKENS_PREFIX}{tokenizer_key}")
+        return f"{stem}.npy", f"{stem}_lengths.npy"
+
+    def read_tokens(self, tokenizer_key):
+        """
+        Open the pre-tokenized windows of a tokenizer, memory-mapped.
+
+        Returns:
+            tuple: (input IDs of shape (rows, width), token count per row), or None if the
+                tokens were not written or belong to an older matrix.
+        """
+        ids_file, lengths_file = self.tokens_files(tokenizer_key)
+        if not os.path.isfile(lengths_file) or not os.path.isfile(ids_file):
+            return None
+        input_ids = np.load(ids_file, mmap_mode='r')
+        lengths = np.load(lengths_file, mmap_mode='r')
+        if len(input_ids) != len(self.windows) or len(lengths) != len(self.windows):
+            print(f"Warning: {ids_file} does not match the substrate matrix. Tokenizing again.")
+            return None
+        return input_ids, lengths
+
+    def iter_chunks(self, chunk_size):
+        """Yield (start, end, packed windows) over the whole matrix in sequential chunks."""
+        for start in range(0, len(self.windows), chunk_size):
+            end = min(start + chunk_size, len(self.windows))
+            yield start, end, self.windows['seq'][start:end]